@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark the decoding of SOAP responses by Service.unwrap_arguments
+
+Compares the old decoding path, in which the body of the response was decoded
+to unicode by requests, re-encoded to utf-8 and parsed into a full tree, with
+the current one, which feeds the raw bytes straight to the parser.
+
+Usage::
+
+    # Record a Browse response from a speaker (the queue by default)
+    python benchmark_unwrap.py --record 192.168.1.101 queue.xml
+
+    # Benchmark recorded responses
+    python benchmark_unwrap.py queue.xml library.xml
+
+    # Benchmark a synthetic Browse response of about 250 KB
+    python benchmark_unwrap.py
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import os
+import sys
+import timeit
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from soco import SoCo  # noqa
+from soco.services import Service  # noqa
+from soco.xml import XML  # noqa
+
+ITEM = (
+    '<item id="Q:0/{0}" parentID="Q:0" restricted="true">'
+    '<res protocolInfo="x-file-cifs:*:audio/mpeg:*" duration="0:04:09">'
+    'x-file-cifs://server/music/Artist%20{0}/Album/{0:02}%20Track.mp3</res>'
+    '<upnp:albumArtURI>/getaa?s=1&amp;u=x-file-cifs%3a%2f%2fserver%2fmusic'
+    '%2fArtist%2520{0}%2fAlbum%2f{0:02}%2520Track.mp3</upnp:albumArtURI>'
+    '<dc:title>Track {0} – “Ünïcödé”</dc:title>'
+    '<upnp:class>object.item.audioItem.musicTrack</upnp:class>'
+    '<dc:creator>Artist {0}</dc:creator><upnp:album>Album</upnp:album>'
+    '<upnp:originalTrackNumber>{0}</upnp:originalTrackNumber></item>')
+
+
+def synthetic_browse_response(count=500):
+    """ A Browse response with `count` tracks, as utf-8 encoded bytes """
+    didl = (
+        '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" '
+        'xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" '
+        'xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">' +
+        ''.join(ITEM.format(i) for i in range(count)) + '</DIDL-Lite>')
+    return (
+        '<?xml version="1.0"?>'
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+        's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+        '<s:Body><u:BrowseResponse '
+        'xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1">'
+        '<Result>{0}</Result><NumberReturned>{1}</NumberReturned>'
+        '<TotalMatches>{1}</TotalMatches><UpdateID>1</UpdateID>'
+        '</u:BrowseResponse></s:Body></s:Envelope>'.format(
+            escape(didl), count)).encode('utf-8')
+
+
+def old_unwrap(content):
+    """ The decoding path used before bytes were passed to the parser """
+    text = content.decode('utf-8')  # response.text
+    tree = XML.fromstring(text.encode('utf-8'))
+    action_response = tree.find(
+        "{http://schemas.xmlsoap.org/soap/envelope/}Body")[0]
+    return dict((i.tag, i.text or "") for i in action_response)
+
+
+def record(ip_address, filename, object_id):
+    """ Save the raw body of a Browse response from a speaker """
+    service = SoCo(ip_address).contentDirectory
+    headers, body = service.build_request('Browse', [
+        ('ObjectID', object_id),
+        ('BrowseFlag', 'BrowseDirectChildren'),
+        ('Filter', '*'),
+        ('StartingIndex', 0),
+        ('RequestedCount', 1000),
+        ('SortCriteria', '')
+    ])
+    response = service.soco.http_session.post(
+        service.base_url + service.control_url, headers=headers, data=body)
+    response.raise_for_status()
+    with io.open(filename, 'wb') as recording:
+        recording.write(response.content)
+    print('Recorded {0} bytes to {1}'.format(len(response.content), filename))
+
+
+def benchmark(name, content, number):
+    """ Time both decoding paths for one response and print the results """
+    assert old_unwrap(content) == Service.unwrap_arguments(content)
+    old = min(timeit.repeat(
+        lambda: old_unwrap(content), number=number, repeat=5)) / number
+    new = min(timeit.repeat(
+        lambda: Service.unwrap_arguments(content),
+        number=number, repeat=5)) / number
+    print('{0}: {1} KB'.format(name, len(content) // 1024))
+    print('    old: {0:8.3f} ms per response'.format(old * 1000))
+    print('    new: {0:8.3f} ms per response ({1:.0%} of old)'.format(
+        new * 1000, new / old))
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('files', nargs='*',
+                        help='files containing recorded SOAP responses')
+    parser.add_argument('--record', metavar='IP',
+                        help='record a Browse response from the speaker at IP '
+                        'to the (single) file given')
+    parser.add_argument('--object-id', default='Q:0',
+                        help='the ObjectID to browse when recording')
+    parser.add_argument('--number', type=int, default=50,
+                        help='the number of decodes per timing run')
+    args = parser.parse_args()
+
+    if args.record:
+        if len(args.files) != 1:
+            parser.error('--record needs exactly one file name')
+        record(args.record, args.files[0], args.object_id)
+        return
+
+    if not args.files:
+        benchmark('synthetic Browse response', synthetic_browse_response(),
+                  args.number)
+    for filename in args.files:
+        with io.open(filename, 'rb') as recording:
+            benchmark(filename, recording.read(), args.number)
+
+
+if __name__ == '__main__':
+    main()
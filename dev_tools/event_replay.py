@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Capture UPnP events from speakers, and replay them to benchmark the event
+pipeline
+
+Usage::
+
+    # Capture the events of the AVTransport and RenderingControl services of
+    # two speakers for ten minutes
+    python event_replay.py capture storm.events 192.168.1.101 192.168.1.102 \\
+        --duration 600
+
+    # Replay them as fast as possible to an event server of our own, and
+    # report the throughput and the time taken to parse and dispatch them
+    python event_replay.py replay storm.events
+
+    # Replay them at their original speed to an event server elsewhere
+    python event_replay.py replay storm.events --speed 1 \\
+        --url http://127.0.0.1:1400/
+
+    # Benchmark a synthetic storm of 10000 volume changes
+    python event_replay.py replay --synthetic 10000
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import asyncio
+import os
+import sys
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from soco import SoCo  # noqa
+from soco.event_capture import (  # noqa
+    CapturedEvent, EventRecorder, benchmark, read_capture, replay)
+from soco.events import SonosEventServer  # noqa
+from soco.subscriptions import SubscriptionManager  # noqa
+
+LAST_CHANGE = (
+    '<Event xmlns="urn:schemas-upnp-org:metadata-1-0/RCS/">'
+    '<InstanceID val="0"><Volume channel="Master" val="{0}"/>'
+    '<Mute channel="Master" val="0"/></InstanceID></Event>')
+
+
+def synthetic_events(count):
+    """ `count` RenderingControl events, each changing the volume, spread
+    over 16 subscriptions """
+    result = []
+    for number in range(count):
+        body = (
+            '<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+            '<e:property><LastChange>{0}</LastChange></e:property>'
+            '</e:propertyset>'.format(escape(LAST_CHANGE.format(
+                number % 100)))).encode('utf-8')
+        result.append(CapturedEvent(
+            number * 0.001,
+            {'sid': 'uuid:sub-{0}'.format(number % 16),
+             'seq': str(number // 16), 'nt': 'upnp:event',
+             'nts': 'upnp:propchange'},
+            body))
+    return result
+
+
+async def capture(args):
+    """ Subscribe to the speakers, and save their events until the time is
+    up """
+    loop = asyncio.get_event_loop()
+    event_server = SonosEventServer(loop, args.host, args.port)
+    event_server.recorder = EventRecorder(args.file)
+    await event_server.start()
+    manager = SubscriptionManager(loop, event_server)
+
+    async def callback(event):
+        """ Ignore the event, which has already been saved """
+        pass
+
+    try:
+        services = []
+        for ip_address in args.speakers:
+            speaker = SoCo(ip_address)
+            services.extend([speaker.avTransport, speaker.renderingControl])
+        await manager.subscribe_all(services, callback, auto_renew=True)
+        print('Capturing events for {0} s...'.format(args.duration))
+        await asyncio.sleep(args.duration)
+    finally:
+        await manager.close()
+        await event_server.shutdown()
+        event_server.recorder.close()
+    print('Captured {0} events'.format(event_server.recorder.count))
+
+
+async def replay_events(args):
+    """ Replay the events, and print a report """
+    if args.synthetic:
+        events = synthetic_events(args.synthetic)
+    else:
+        events = list(read_capture(args.file))
+    speed = args.speed or None
+    if args.url:
+        report = await replay(events, args.url, speed=speed,
+                              concurrency=args.concurrency)
+    else:
+        report = await benchmark(events, speed=speed,
+                                 concurrency=args.concurrency)
+    print(report.format())
+
+
+def main():
+    """ Parse the arguments, and capture or replay events """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    capture_parser = commands.add_parser(
+        'capture', help='Save the events of speakers to a file')
+    capture_parser.add_argument('file', help='The capture file to write')
+    capture_parser.add_argument('speakers', nargs='+',
+                                help='The ip addresses of the speakers')
+    capture_parser.add_argument('--duration', type=float, default=60,
+                                help='Seconds to capture for')
+    capture_parser.add_argument(
+        '--host', required=True,
+        help='The address of this machine, which the speakers can reach')
+    capture_parser.add_argument('--port', type=int, default=1400,
+                                help='The port to receive events on')
+    replay_parser = commands.add_parser(
+        'replay', help='Replay captured events, and report how fast they '
+        'were handled')
+    replay_parser.add_argument('file', nargs='?',
+                               help='The capture file to read')
+    replay_parser.add_argument('--synthetic', type=int, metavar='COUNT',
+                               help='Replay COUNT made up events instead')
+    replay_parser.add_argument(
+        '--speed', type=float, default=0,
+        help='How much faster than captured to replay (default: as fast '
+        'as possible)')
+    replay_parser.add_argument(
+        '--url', help='The event server to replay to (default: one of our '
+        'own, whose parse and dispatch times are reported)')
+    replay_parser.add_argument('--concurrency', type=int, default=1,
+                               help='Requests to have in flight at once')
+    args = parser.parse_args()
+    if args.command == 'capture':
+        coroutine = capture(args)
+    elif args.command == 'replay' and (args.file or args.synthetic):
+        coroutine = replay_events(args)
+    else:
+        parser.print_help()
+        return
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
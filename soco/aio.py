@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+""" Asynchronous (asyncio) control of Sonos speakers
+
+:class:`AsyncSoCo` wraps a :class:`~soco.core.SoCo` instance and provides
+coroutine versions of its most commonly used methods. Network calls are made
+with :meth:`~soco.services.Service.async_send_command`, so that a single event
+loop can control many speakers concurrently, without a thread for each request
+in flight::
+
+    >>> speakers = [AsyncSoCo(ip) for ip in ('192.168.1.101', '192.168.1.102')]
+    >>> await asyncio.gather(*(s.set_volume(20) for s in speakers))
+
+All AsyncSoCo instances on an event loop share one aiohttp session (see
+:func:`soco.connection.get_client_session`), unless another is given. They
+also share the caches and topology information of the wrapped SoCo instances,
+so sync and async calls may be mixed freely.
+
+"""
+
+from __future__ import unicode_literals
+
+from functools import wraps
+import re
+
+from .connection import get_client_session, client_timeout
+from .core import SoCo, PLAY_MODES
+from .data_structures import to_didl_string, DidlObject, DidlResource
+from .exceptions import SoCoSlaveException
+from .services import zone_group_state_shared_cache
+from soco import config
+
+
+def only_on_master(function):
+    """Decorator that raises SoCoSlaveException on master call on slave"""
+    @wraps(function)
+    async def inner_function(self, *args, **kwargs):
+        """Master checking inner function"""
+        if not await self.is_coordinator():
+            message = 'The method or property "{0}" can only be called/used '\
+                'on the coordinator in a group'.format(function.__name__)
+            raise SoCoSlaveException(message)
+        return await function(self, *args, **kwargs)
+    return inner_function
+
+
+# AsyncSoCo shares the parsing helpers and topology state of the SoCo
+# instance it wraps
+# pylint: disable=too-many-public-methods,protected-access
+class AsyncSoCo(object):
+
+    """ Asynchronous control of a Sonos speaker.
+
+    Each method is a coroutine with the same arguments and return value as
+    the method of the same name in :class:`~soco.core.SoCo`.
+
+    """
+
+    def __init__(self, soco, session=None):
+        """
+        Args:
+            soco: A :class:`~soco.core.SoCo` instance, or the ip address of
+                the speaker.
+            session (aiohttp.ClientSession): The session to use for requests.
+                If None, the session shared by the current event loop is used.
+
+        """
+        if not isinstance(soco, SoCo):
+            soco = config.SOCO_CLASS(soco)
+        #: The wrapped :class:`~soco.core.SoCo` instance
+        self.soco = soco
+        self._session = session
+
+    def __repr__(self):
+        return '{0}("{1}")'.format(
+            self.__class__.__name__, self.soco.ip_address)
+
+    @property
+    def session(self):
+        """ The aiohttp session used for requests """
+        if self._session is None:
+            return get_client_session()
+        return self._session
+
+    async def _send(self, service, action, args=None, **kwargs):
+        """ Send a command to one of the wrapped SoCo instance's services """
+        return await service.async_send_command(
+            action, args, session=self.session, **kwargs)
+
+    # Topology
+
+    async def _parse_zone_group_state(self):
+        """ Bring the topology information of the wrapped instance up to
+        date, as :meth:`soco.core.SoCo.all_zones` and the like do, but
+        without blocking if the zone group state must be fetched """
+        if self.soco._check_zone_group_state():
+            return
+        response = await self._send(
+            self.soco.zoneGroupTopology, 'GetZoneGroupState',
+            cache=zone_group_state_shared_cache,
+            cache_timeout=config.TOPOLOGY_TTL)
+        self.soco._zone_group_state_fetched(response['ZoneGroupState'])
+
+    async def player_name(self):
+        """ The speaker's name. A string. """
+        await self._parse_zone_group_state()
+        return self.soco._player_name
+
+    async def uid(self):
+        """ A unique identifier. Looks like: RINCON_000XXXXXXXXXX1400 """
+        if self.soco._uid is None:
+            await self._parse_zone_group_state()
+        return self.soco._uid
+
+    async def is_coordinator(self):
+        """ Return True if this zone is a group coordinator, otherwise False.
+        """
+        await self._parse_zone_group_state()
+        return self.soco._is_coordinator
+
+    async def all_groups(self):
+        """ Return a set of all the available groups """
+        await self._parse_zone_group_state()
+        return self.soco._groups
+
+    async def group(self):
+        """ The Zone Group of which this device is a member. """
+        for group in await self.all_groups():
+            if self.soco in group:
+                return group
+        return None
+
+    async def all_zones(self):
+        """ Return a set of all the available zones """
+        await self._parse_zone_group_state()
+        return self.soco._all_zones
+
+    async def visible_zones(self):
+        """ Return a set of all visible zones """
+        await self._parse_zone_group_state()
+        return self.soco._visible_zones
+
+    async def join(self, master):
+        """ Join this speaker to another "master" speaker (a SoCo or
+        AsyncSoCo instance). """
+        if not isinstance(master, AsyncSoCo):
+            master = AsyncSoCo(master, self._session)
+        await self._send(self.soco.avTransport, 'SetAVTransportURI', [
+            ('InstanceID', 0),
+            ('CurrentURI', 'x-rincon:{0}'.format(await master.uid())),
+            ('CurrentURIMetaData', '')
+        ])
+
+    async def unjoin(self):
+        """ Remove this speaker from a group. """
+        await self._send(
+            self.soco.avTransport, 'BecomeCoordinatorOfStandaloneGroup', [
+                ('InstanceID', 0)
+            ])
+
+    async def get_speaker_info(self, refresh=False):
+        """ Get information about the Sonos speaker. """
+        if self.soco.speaker_info and refresh is False:
+            return self.soco.speaker_info
+        health = self.soco.http_session.health
+        with health.guard():
+            async with self.session.get(
+                    'http://%s:1400/xml/device_description.xml' % (
+                        self.soco.ip_address),
+                    timeout=client_timeout(
+                        health.deadline(self.soco.request_timeout))
+            ) as response:
+                content = await response.read()
+        self.soco._parse_speaker_info(content)
+        return self.soco.speaker_info
+
+    # Transport
+
+    @only_on_master
+    async def play(self):
+        """ Play the currently selected track. """
+        await self._send(self.soco.avTransport, 'Play', [
+            ('InstanceID', 0),
+            ('Speed', 1)
+        ])
+
+    @only_on_master
+    async def play_uri(self, uri='', meta='', title='', start=True):
+        """ Play a given stream. Pauses the queue. """
+        if meta == '' and title != '':
+            meta = self.soco._stream_metadata(title)
+        await self._send(self.soco.avTransport, 'SetAVTransportURI', [
+            ('InstanceID', 0),
+            ('CurrentURI', uri),
+            ('CurrentURIMetaData', meta)
+        ])
+        if start:
+            return await self.play()
+        return False
+
+    @only_on_master
+    async def play_from_queue(self, index, start=True):
+        """ Play a track from the queue by index. The first item in the
+        queue is 0. """
+        uri = 'x-rincon-queue:{0}#0'.format(await self.uid())
+        await self._send(self.soco.avTransport, 'SetAVTransportURI', [
+            ('InstanceID', 0),
+            ('CurrentURI', uri),
+            ('CurrentURIMetaData', '')
+        ])
+        await self._send(self.soco.avTransport, 'Seek', [
+            ('InstanceID', 0),
+            ('Unit', 'TRACK_NR'),
+            ('Target', index + 1)
+        ])
+        if start:
+            return await self.play()
+        return False
+
+    @only_on_master
+    async def pause(self):
+        """ Pause the currently playing track. """
+        await self._send(self.soco.avTransport, 'Pause', [
+            ('InstanceID', 0),
+            ('Speed', 1)
+        ])
+
+    @only_on_master
+    async def stop(self):
+        """ Stop the currently playing track. """
+        await self._send(self.soco.avTransport, 'Stop', [
+            ('InstanceID', 0),
+            ('Speed', 1)
+        ])
+
+    @only_on_master
+    async def seek(self, timestamp):
+        """ Seek to a given timestamp (HH:MM:SS or H:MM:SS) in the current
+        track. """
+        if not re.match(r'^[0-9][0-9]?:[0-9][0-9]:[0-9][0-9]$', timestamp):
+            raise ValueError('invalid timestamp, use HH:MM:SS format')
+        await self._send(self.soco.avTransport, 'Seek', [
+            ('InstanceID', 0),
+            ('Unit', 'REL_TIME'),
+            ('Target', timestamp)
+        ])
+
+    @only_on_master
+    async def next(self):
+        """ Go to the next track. """
+        await self._send(self.soco.avTransport, 'Next', [
+            ('InstanceID', 0),
+            ('Speed', 1)
+        ])
+
+    @only_on_master
+    async def previous(self):
+        """ Go back to the previously played track. """
+        await self._send(self.soco.avTransport, 'Previous', [
+            ('InstanceID', 0),
+            ('Speed', 1)
+        ])
+
+    async def play_mode(self):
+        """ The queue's play mode. See :meth:`SoCo.play_mode` """
+        result = await self._send(
+            self.soco.avTransport, 'GetTransportSettings', [
+                ('InstanceID', 0),
+            ])
+        return result['PlayMode']
+
+    async def set_play_mode(self, playmode):
+        """ Set the speaker's mode """
+        playmode = playmode.upper()
+        if playmode not in PLAY_MODES:
+            raise KeyError("'%s' is not a valid play mode" % playmode)
+        await self._send(self.soco.avTransport, 'SetPlayMode', [
+            ('InstanceID', 0),
+            ('NewPlayMode', playmode)
+        ])
+
+    @only_on_master
+    async def cross_fade(self):
+        """ The speaker's cross fade state. True if enabled, False otherwise
+        """
+        response = await self._send(
+            self.soco.avTransport, 'GetCrossfadeMode', [
+                ('InstanceID', 0),
+            ])
+        return True if int(response['CrossfadeMode']) else False
+
+    @only_on_master
+    async def set_cross_fade(self, crossfade):
+        """ Set the speaker's cross fade state. """
+        await self._send(self.soco.avTransport, 'SetCrossfadeMode', [
+            ('InstanceID', 0),
+            ('CrossfadeMode', '1' if crossfade else '0')
+        ])
+
+    async def get_current_track_info(self):
+        """ Get information about the currently playing track. """
+        response = await self._send(
+            self.soco.avTransport, 'GetPositionInfo', [
+                ('InstanceID', 0),
+                ('Channel', 'Master')
+            ])
+        return self.soco._parse_track_info(response)
+
+    async def get_current_transport_info(self):
+        """ Get the current playback state """
+        response = await self._send(
+            self.soco.avTransport, 'GetTransportInfo', [
+                ('InstanceID', 0),
+            ])
+        return self.soco._parse_transport_info(response)
+
+    # Rendering
+
+    async def _get_rendering_value(self, action, out_arg):
+        """ Get the Master channel value of a RenderingControl variable """
+        response = await self._send(self.soco.renderingControl, action, [
+            ('InstanceID', 0),
+            ('Channel', 'Master'),
+        ])
+        return int(response[out_arg])
+
+    async def volume(self):
+        """ The speaker's volume. An integer between 0 and 100. """
+        return await self._get_rendering_value('GetVolume', 'CurrentVolume')
+
+    async def set_volume(self, volume):
+        """ Set the speaker's volume """
+        volume = max(0, min(int(volume), 100))  # Coerce in range
+        await self._send(self.soco.renderingControl, 'SetVolume', [
+            ('InstanceID', 0),
+            ('Channel', 'Master'),
+            ('DesiredVolume', volume)
+        ])
+
+    async def mute(self):
+        """ The speaker's mute state. True if muted, False otherwise """
+        return bool(await self._get_rendering_value('GetMute', 'CurrentMute'))
+
+    async def set_mute(self, mute):
+        """ Mute (or unmute) the speaker """
+        await self._send(self.soco.renderingControl, 'SetMute', [
+            ('InstanceID', 0),
+            ('Channel', 'Master'),
+            ('DesiredMute', '1' if mute else '0')
+        ])
+
+    async def bass(self):
+        """ The speaker's bass EQ. An integer between -10 and 10. """
+        return await self._get_rendering_value('GetBass', 'CurrentBass')
+
+    async def set_bass(self, bass):
+        """ Set the speaker's bass """
+        bass = max(-10, min(int(bass), 10))  # Coerce in range
+        await self._send(self.soco.renderingControl, 'SetBass', [
+            ('InstanceID', 0),
+            ('DesiredBass', bass)
+        ])
+
+    async def treble(self):
+        """ The speaker's treble EQ. An integer between -10 and 10. """
+        return await self._get_rendering_value('GetTreble', 'CurrentTreble')
+
+    async def set_treble(self, treble):
+        """ Set the speaker's treble """
+        treble = max(-10, min(int(treble), 10))  # Coerce in range
+        await self._send(self.soco.renderingControl, 'SetTreble', [
+            ('InstanceID', 0),
+            ('DesiredTreble', treble)
+        ])
+
+    async def loudness(self):
+        """ The speaker's loudness compensation. True if on, otherwise False.
+        """
+        return bool(
+            await self._get_rendering_value('GetLoudness', 'CurrentLoudness'))
+
+    async def set_loudness(self, loudness):
+        """ Switch on/off the speaker's loudness compensation """
+        await self._send(self.soco.renderingControl, 'SetLoudness', [
+            ('InstanceID', 0),
+            ('Channel', 'Master'),
+            ('DesiredLoudness', '1' if loudness else '0')
+        ])
+
+    async def status_light(self):
+        """ The white Sonos status light. True if on, otherwise False. """
+        result = await self._send(self.soco.deviceProperties, 'GetLEDState')
+        return True if result["CurrentLEDState"] == "On" else False
+
+    async def set_status_light(self, led_on):
+        """ Switch on/off the speaker's status light """
+        await self._send(self.soco.deviceProperties, 'SetLEDState', [
+            ('DesiredLEDState', 'On' if led_on else 'Off'),
+        ])
+
+    # Queue
+
+    async def get_queue(self, start=0, max_items=100,
+                        full_album_art_uri=False):
+        """ Get information about the queue. See :meth:`SoCo.get_queue` """
+        response = await self._send(self.soco.contentDirectory, 'Browse', [
+            ('ObjectID', 'Q:0'),
+            ('BrowseFlag', 'BrowseDirectChildren'),
+            ('Filter', '*'),
+            ('StartingIndex', start),
+            ('RequestedCount', max_items),
+            ('SortCriteria', '')
+        ])
+        return self.soco._parse_queue(response, full_album_art_uri)
+
+    @only_on_master
+    async def add_to_queue(self, queueable_item, metadata=None):
+        """ Add a queueable item to the queue. Return its position. """
+        if not metadata:
+            metadata = to_didl_string(queueable_item)
+        response = await self._send(self.soco.avTransport, 'AddURIToQueue', [
+            ('InstanceID', 0),
+            ('EnqueuedURI', queueable_item.resources[0].uri),
+            ('EnqueuedURIMetaData', metadata),
+            ('DesiredFirstTrackNumberEnqueued', 0),
+            ('EnqueueAsNext', 1)
+        ])
+        return int(response['FirstTrackNumberEnqueued'])
+
+    async def add_uri_to_queue(self, uri, meta=None):
+        """ Add the URI to the queue. Return its position. """
+        res = [DidlResource(uri=uri, protocol_info="x-rincon-playlist:*:*:*")]
+        item = DidlObject(resources=res, title='', parent_id='', item_id='')
+        return await self.add_to_queue(item, metadata=meta)
+
+    @only_on_master
+    async def clear_queue(self):
+        """ Remove all tracks from the queue. """
+        await self._send(self.soco.avTransport, 'RemoveAllTracksFromQueue', [
+            ('InstanceID', 0),
+        ])
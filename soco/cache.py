@@ -3,12 +3,23 @@
 
 from __future__ import unicode_literals
 
+import json
+import logging
+import os
+import sqlite3
+import stat
+import sys
+import tempfile
 import threading
+import weakref
+from collections import OrderedDict, namedtuple
 from time import time
 
-from .compat import dumps
+from .compat import dumps, monotonic
 from soco import config
 
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
 
 class _BaseCache(object):
 
@@ -17,13 +28,18 @@ class _BaseCache(object):
     Does nothing by itself."""
     # pylint: disable=no-self-use, unused-argument
 
-    def __init__(self, default_timeout=0):
+    def __init__(self, default_timeout=0, name=None):
         super(_BaseCache, self).__init__()
         self._cache = {}
         # : The default caching interval in seconds.
         self.default_timeout = default_timeout
         #: Is the cache enabled? True or False
         self.enabled = True
+        #: A name for the cache, used when reporting statistics
+        self.name = name
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.name)
 
     def get(self, *args, **kwargs):
         """
@@ -52,6 +68,28 @@ class _BaseCache(object):
         """
         pass
 
+    def delete_action(self, action):
+        """
+        Delete all items stored for `action` (the first argument to
+        :meth:`put`), whatever their other arguments. Caches which cannot
+        tell which items those are are cleared entirely.
+        """
+        self.clear()
+
+    def stats(self):
+        """
+        Return statistics about the use of the cache. See
+        :meth:`LRUCache.stats`. This cache keeps none.
+        """
+        return {'name': self.name, 'size': 0, 'bytes': 0, 'actions': {}}
+
+    def entries(self):
+        """
+        Return a list of the live entries in the cache. See
+        :meth:`LRUCache.entries`. This cache cannot list them.
+        """
+        return []
+
 
 class NullCache(_BaseCache):
 
@@ -72,8 +110,8 @@ class TimedCache(_BaseCache):
 
     """
 
-    def __init__(self, default_timeout=0):
-        super(TimedCache, self).__init__()
+    def __init__(self, default_timeout=0, name=None):
+        super(TimedCache, self).__init__(default_timeout, name)
         # A thread lock for the cache
         self._cache_lock = threading.Lock()
 
@@ -153,18 +191,876 @@ class TimedCache(_BaseCache):
         return cache_key
 
 
+def _freeze(value):
+    """ Return a hashable equivalent of `value`, converting lists and dicts
+    (recursively) to tuples """
+    value_type = type(value)
+    if value_type is str or value_type is int:
+        return value
+    if value_type is list or value_type is tuple:
+        return tuple([_freeze(item) for item in value])
+    if value_type is dict:
+        return (dict, tuple(sorted(
+            (key, _freeze(item)) for key, item in value.items())))
+    if value_type is bool or value_type is float:
+        # Otherwise True, 1 and 1.0 would all make the same key, but produce
+        # different requests
+        return (value_type, value)
+    return value
+
+
+def _sizeof(item):
+    """ A rough estimate of the memory used by a cached item, in bytes """
+    if isinstance(item, dict):
+        return sys.getsizeof(item) + sum(
+            sys.getsizeof(key) + sys.getsizeof(value)
+            for key, value in item.items())
+    return sys.getsizeof(item)
+
+
+#: A live entry of a cache, as returned by :meth:`LRUCache.entries`. `action`
+#: is the first argument the item was stored with (for the caches used by
+#: services, the name of the action), `key` the whole key, and `ttl` the
+#: number of seconds until it expires.
+CacheEntry = namedtuple('CacheEntry', 'action, key, ttl, item')
+
+# Indexes of the counters kept for each action
+_HITS, _MISSES, _EXPIRATIONS, _EVICTIONS = range(4)
+
+
+def _action_of(cache_key):
+    """ The action (first argument) of a key made by LRUCache.make_key """
+    # get and put call make_key(args, kwargs), so the key is
+    # (((action, ...), kwargs), {})
+    try:
+        action = cache_key[0][0][0]
+    except (IndexError, TypeError):
+        return ''
+    return action if isinstance(action, str) else ''
+
+
+class _Shard(object):
+
+    """ One part of an :class:`LRUCache`, with its own lock """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('lock', 'entries', 'size', 'counters')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key: (expiry time, item, size), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        # action: [hits, misses, expirations, evictions]
+        self.counters = {}
+
+    def count(self, cache_key, counter):
+        """ Increment a counter for the action of `cache_key`. Must be called
+        with the lock held. """
+        action = _action_of(cache_key)
+        counters = self.counters.get(action)
+        if counters is None:
+            counters = self.counters[action] = [0, 0, 0, 0]
+        counters[counter] += 1
+
+
+class _Reaper(object):
+
+    """ A daemon thread which periodically removes expired entries from all
+    live :class:`LRUCache` instances """
+
+    def __init__(self):
+        super(_Reaper, self).__init__()
+        self._caches = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    def add(self, cache):
+        """ Sweep `cache` from now on """
+        with self._lock:
+            self._caches.add(cache)
+
+    def start(self):
+        """ Start the thread, if it is not already running. This is left
+        until something is first stored in a cache, so that importing SoCo
+        does not start a thread. """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='soco-cache-reaper')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        """ The body of the reaper thread """
+        while True:
+            interval = config.CACHE_REAP_INTERVAL
+            self._wakeup.wait(interval if interval and interval > 0 else 60)
+            self._wakeup.clear()
+            if not config.CACHE_REAP_INTERVAL:
+                continue
+            with self._lock:
+                caches = list(self._caches)
+            for cache in caches:
+                try:
+                    cache.purge_expired()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception("Error purging cache %r", cache)
+
+    def caches(self):
+        """ Return a list of the caches being swept """
+        with self._lock:
+            return list(self._caches)
+
+    @property
+    def running(self):
+        """ True if the thread has been started """
+        return self._thread is not None
+
+    def sweep_now(self):
+        """ Wake the reaper up to sweep straight away """
+        self._wakeup.set()
+
+
+_reaper = _Reaper()  # pylint: disable=invalid-name
+
+
+def _stats_dict(values):
+    """ Turn a list of counters into a dict for :meth:`LRUCache.stats` """
+    hits, misses, expirations, evictions = values
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'expirations': expirations,
+        'evictions': evictions,
+        'hit_ratio': float(hits) / lookups if lookups else None,
+    }
+
+
+def format_stats(stats):
+    """ Format the statistics returned by :meth:`LRUCache.stats` as a table,
+    one line per action """
+    lines = ['{0}: {1} items, {2} bytes'.format(
+        stats['name'], stats['size'], stats['bytes'])]
+    rows = sorted(stats['actions'].items())
+    if 'totals' in stats:
+        rows.append(('(all)', stats['totals']))
+    for action, values in rows:
+        ratio = values['hit_ratio']
+        lines.append(
+            '  {0:<30} hits {1:>7} misses {2:>7} expired {3:>7} '
+            'evicted {4:>7} ratio {5}'.format(
+                action or '-', values['hits'], values['misses'],
+                values['expirations'], values['evictions'],
+                '-' if ratio is None else '{0:.1%}'.format(ratio)))
+    return '\n'.join(lines) + '\n'
+
+
+def live_caches():
+    """ Return a list of all the :class:`LRUCache` instances which are still
+    in use, such as the caches of all services, for reporting """
+    return _reaper.caches()
+
+
+class LRUCache(_BaseCache):
+
+    """ A bounded, thread-safe cache for caching method return values
+
+    Items expire `timeout` seconds after they are stored, measured with a
+    monotonic clock. In addition, the cache holds at most `max_entries`
+    items, and approximately `max_bytes` bytes of them. When either limit is
+    reached, the least recently used items are evicted first. A background
+    thread removes expired items every :data:`soco.config.CACHE_REAP_INTERVAL`
+    seconds, so that they do not linger until they are next looked up.
+
+    The cache is split into shards by key, each with its own lock, so that
+    threads using different keys rarely wait for each other. Eviction is
+    least recently used within each shard.
+
+    """
+
+    def __init__(self, default_timeout=0, max_entries=None, max_bytes=None,
+                 shards=None, name=None):
+        """
+        Args:
+            default_timeout (float): The timeout used if none is given to
+                :meth:`put`
+            max_entries (int): The maximum number of items. If None,
+                :data:`soco.config.CACHE_MAX_ENTRIES` is used. 0 means no
+                limit.
+            max_bytes (int): The approximate maximum size of the items, in
+                bytes. If None, :data:`soco.config.CACHE_MAX_BYTES` is used.
+                0 means no limit.
+            shards (int): The number of separately locked shards. If None,
+                :data:`soco.config.CACHE_SHARDS` is used.
+            name (str): A name for the cache, used in statistics
+
+        """
+        super(LRUCache, self).__init__(default_timeout, name)
+        if max_entries is None:
+            max_entries = config.CACHE_MAX_ENTRIES
+        if max_bytes is None:
+            max_bytes = config.CACHE_MAX_BYTES
+        if shards is None:
+            shards = config.CACHE_SHARDS
+        shards = max(1, shards)
+        if max_entries:
+            # Each shard must be able to hold at least one item
+            shards = min(shards, max_entries)
+        #: The maximum number of items held (0 means no limit)
+        self.max_entries = max_entries or 0
+        #: The approximate maximum size of the items held (0 means no limit)
+        self.max_bytes = max_bytes or 0
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_entries = (max_entries // shards) if max_entries else 0
+        self._shard_bytes = (max_bytes // shards) if max_bytes else 0
+        _reaper.add(self)
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def _shard(self, key):
+        """ The shard holding `key` """
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, *args, **kwargs):
+        """Get an item from the cache for this combination of args and kwargs.
+
+        Return None if no unexpired item is found. This means that there is no
+        point storing an item in the cache if it is None.
+
+        """
+        if not self.enabled:
+            return None
+        cache_key = self.make_key(args, kwargs)
+        shard = self._shard(cache_key)
+        with shard.lock:
+            entry = shard.entries.get(cache_key)
+            if entry is None:
+                shard.count(cache_key, _MISSES)
+                return None
+            if entry[0] >= monotonic():
+                shard.entries.move_to_end(cache_key)
+                shard.count(cache_key, _HITS)
+                return entry[1]
+            # An expired item is present - delete it
+            del shard.entries[cache_key]
+            shard.size -= entry[2]
+            shard.count(cache_key, _EXPIRATIONS)
+            shard.count(cache_key, _MISSES)
+        return None
+
+    def put(self, item, *args, **kwargs):
+        """ Put an item into the cache, for this combination of args and
+        kwargs.
+
+        If `timeout` is specified as one of the keyword arguments, the item
+        will remain available for retrieval for `timeout` seconds. If `timeout`
+        is None or not specified, the default cache timeout for this cache will
+        be used. Items with a `timeout` of 0 are not stored at all."""
+
+        if not self.enabled:
+            return
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = self.default_timeout
+        cache_key = self.make_key(args, kwargs)
+        shard = self._shard(cache_key)
+        if not timeout or timeout <= 0:
+            # It would expire straight away, but remove any older value
+            self._delete_key(shard, cache_key)
+            return
+        size = _sizeof(item) if self._shard_bytes else 0
+        if self._shard_bytes and size > self._shard_bytes:
+            # Too big to be cached at all
+            self._delete_key(shard, cache_key)
+            return
+        if not _reaper.running:
+            _reaper.start()
+        with shard.lock:
+            old = shard.entries.pop(cache_key, None)
+            if old is not None:
+                shard.size -= old[2]
+            shard.entries[cache_key] = (monotonic() + timeout, item, size)
+            shard.size += size
+            # Evict the least recently used items, if over a limit
+            while ((self._shard_entries and
+                    len(shard.entries) > self._shard_entries) or
+                   (self._shard_bytes and shard.size > self._shard_bytes)):
+                evicted_key, evicted = shard.entries.popitem(last=False)
+                shard.size -= evicted[2]
+                shard.count(evicted_key, _EVICTIONS)
+
+    @staticmethod
+    def _delete_key(shard, cache_key):
+        """ Remove the entry for `cache_key` from `shard`, if present """
+        with shard.lock:
+            entry = shard.entries.pop(cache_key, None)
+            if entry is not None:
+                shard.size -= entry[2]
+
+    def delete(self, *args, **kwargs):
+        """Delete an item from the cache for this combination of args and
+        kwargs"""
+        cache_key = self.make_key(args, kwargs)
+        self._delete_key(self._shard(cache_key), cache_key)
+
+    def clear(self):
+        """Empty the whole cache"""
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.size = 0
+
+    def delete_action(self, action):
+        """Delete all items stored for `action` (the first argument to
+        :meth:`put`), whatever their other arguments"""
+        for shard in self._shards:
+            with shard.lock:
+                stale = [key for key in shard.entries
+                         if _action_of(key) == action]
+                for key in stale:
+                    shard.size -= shard.entries.pop(key)[2]
+
+    def purge_expired(self):
+        """ Remove all expired items. This is done periodically by a
+        background thread, but may also be called directly.
+
+        Returns:
+            int: the number of items removed
+
+        """
+        removed = 0
+        for shard in self._shards:
+            now = monotonic()
+            with shard.lock:
+                expired = [key for key, entry in shard.entries.items()
+                           if entry[0] < now]
+                for key in expired:
+                    shard.size -= shard.entries.pop(key)[2]
+                    shard.count(key, _EXPIRATIONS)
+            removed += len(expired)
+        return removed
+
+    def stats(self):
+        """ Return statistics about the use of the cache, since it was
+        created or :meth:`reset_stats` was last called.
+
+        Returns:
+            dict: with the keys ``name``, ``size`` (the number of items
+            held), ``bytes`` (their approximate size, if the cache has a byte
+            limit, or else 0), ``totals`` and ``actions``. ``actions`` maps
+            the name of each action to a dict of ``hits``, ``misses``,
+            ``expirations``, ``evictions`` and ``hit_ratio`` (hits as a
+            fraction of lookups, or None if there have been none).
+            ``totals`` is the same, for all actions together.
+
+        """
+        combined = {}
+        size = 0
+        byte_size = 0
+        for shard in self._shards:
+            with shard.lock:
+                size += len(shard.entries)
+                byte_size += shard.size
+                counters = [(action, list(values))
+                            for action, values in shard.counters.items()]
+            for action, values in counters:
+                total = combined.setdefault(action, [0, 0, 0, 0])
+                for index, value in enumerate(values):
+                    total[index] += value
+        totals = [sum(values[index] for values in combined.values())
+                  for index in range(4)]
+        return {
+            'name': self.name,
+            'size': size,
+            'bytes': byte_size,
+            'totals': _stats_dict(totals),
+            'actions': dict((action, _stats_dict(values))
+                            for action, values in combined.items()),
+        }
+
+    def reset_stats(self):
+        """ Set all the counters reported by :meth:`stats` to zero """
+        for shard in self._shards:
+            with shard.lock:
+                shard.counters.clear()
+
+    def entries(self):
+        """ Return a list of the unexpired entries in the cache, as
+        :class:`CacheEntry` namedtuples, most recently used last within each
+        shard. """
+        result = []
+        for shard in self._shards:
+            now = monotonic()
+            with shard.lock:
+                for key, entry in shard.entries.items():
+                    if entry[0] >= now:
+                        result.append(CacheEntry(
+                            _action_of(key), key, entry[0] - now, entry[1]))
+        return result
+
+    def dump(self, stream=None):
+        """ Write the statistics and live entries of the cache as text, to
+        `stream` (by default, stderr) """
+        if stream is None:
+            stream = sys.stderr
+        stream.write(format_stats(self.stats()))
+        for entry in self.entries():
+            # Show just the positional arguments, such as the action and its
+            # (name, value) tuples, if that is what the key holds
+            shown = entry.key[0][0] if entry.action else entry.key
+            stream.write('  {0:8.1f}s  {1!r}\n'.format(entry.ttl, shown))
+
+    @staticmethod
+    def make_key(*args, **kwargs):
+        """
+        Generate a unique, hashable, representation of the args and kwargs
+
+        """
+        # Lists, such as the (name, value) argument lists passed to
+        # send_command, are converted to tuples, which is much cheaper than
+        # pickling them.
+        cache_key = _freeze((args, kwargs))
+        try:
+            hash(cache_key)
+        except TypeError:
+            # Something unusual, which is not hashable
+            cache_key = dumps(cache_key)
+        return cache_key
+
+
+def default_shared_cache_path():
+    """ The database file used by :class:`SharedCache` unless
+    :data:`soco.config.SHARED_CACHE_PATH` says otherwise.
+
+    The file is in a directory which only the current user can use:
+    ``$XDG_RUNTIME_DIR`` if it is set, or else a ``soco-<uid>`` directory,
+    created with mode 0700, in ``/dev/shm`` (which is held in memory) if
+    there is one, or in the temporary directory.
+
+    Raises:
+        OSError: if the directory exists but is not owned by the user, or
+            other users can use it
+
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        _check_private(runtime_dir, os.lstat(runtime_dir))
+        return os.path.join(runtime_dir, 'soco-cache.sqlite')
+    parent = '/dev/shm'
+    if not os.path.isdir(parent):
+        parent = tempfile.gettempdir()
+    user = getattr(os, 'getuid', lambda: '')()
+    directory = os.path.join(parent, 'soco-{0}'.format(user))
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise OSError("{0} is not a directory".format(directory))
+    _check_private(directory, info)
+    return os.path.join(directory, 'cache.sqlite')
+
+
+def _check_private(path, info):
+    """ Raise OSError unless the file or directory `path`, whose stat result
+    is `info`, belongs to the current user and no one else can use it """
+    if not hasattr(os, 'getuid'):
+        # Not a POSIX system, so permissions cannot be checked this way
+        return
+    if info.st_uid != os.getuid():
+        raise OSError("{0} belongs to another user".format(path))
+    if info.st_mode & 0o077:
+        raise OSError("{0} can be used by other users (mode {1:o})".format(
+            path, stat.S_IMODE(info.st_mode)))
+
+
+def _open_private(path):
+    """ Create the file `path`, with mode 0600, if it does not exist, and
+    check that it belongs to the current user and no one else can use it """
+    flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0)
+    handle = os.open(path, flags, 0o600)
+    try:
+        _check_private(path, os.fstat(handle))
+    finally:
+        os.close(handle)
+
+
+def _json_key(args, kwargs):
+    """ The key for a shared cache entry, as JSON text which is the same in
+    every process """
+    try:
+        return json.dumps([args, kwargs], sort_keys=True,
+                          separators=(',', ':'), default=repr)
+    except TypeError:
+        # Dicts with keys of several types cannot be sorted
+        return json.dumps(repr((args, kwargs)))
+
+
+# Open connections to shared cache databases, by (path, process id), so that
+# a process forked after one was opened opens its own
+_connections = {}  # pylint: disable=invalid-name
+_connections_lock = threading.Lock()  # pylint: disable=invalid-name
+
+# When each database was last purged of expired items by this process, by
+# monotonic(), by path
+_last_purged = {}  # pylint: disable=invalid-name
+
+# Change this whenever the schema, or the format of the keys or items,
+# changes, so that old databases are emptied
+_SHARED_SCHEMA_VERSION = 2
+
+_SHARED_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        action TEXT NOT NULL,
+        expires REAL NOT NULL,
+        item TEXT NOT NULL,
+        PRIMARY KEY (namespace, key)
+    );
+    CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+"""
+
+
+class SharedCache(_BaseCache):
+
+    """ A cache shared by all processes on the same host
+
+    Items are stored as JSON in an SQLite database, by default in a private
+    directory in ``/dev/shm``, so that several processes (such as pre-forked
+    workers) controlling the same speakers see each other's results, and
+    each result is fetched from a speaker once per host rather than once per
+    process. Each cache keeps its items apart from those of other caches by
+    its `name`, so caches with the same name in different processes are the
+    same cache.
+
+    Items expire `timeout` seconds after they are stored, by the wall
+    clock, since monotonic clocks are not comparable between processes. The
+    database holds at most `max_entries` items, for all caches together.
+    When it is full, expired items, and then those closest to expiry, are
+    removed first.
+
+    Only items which can be stored as JSON, such as the dicts of strings
+    returned by commands, are cached. The database file must belong to the
+    current user, and no one else may be able to read or write it, since
+    whoever can write it controls the results of commands. Otherwise it is
+    not used.
+
+    Select it with :data:`soco.config.CACHE_CLASS`. Database errors are
+    logged, and treated as cache misses, so that they never stop a command
+    being sent.
+
+    """
+
+    def __init__(self, default_timeout=0, max_entries=None, name=None,
+                 path=None):
+        """
+        Args:
+            default_timeout (float): The timeout used if none is given to
+                :meth:`put`
+            max_entries (int): The maximum number of items in the database.
+                If None, :data:`soco.config.SHARED_CACHE_MAX_ENTRIES` is
+                used. 0 means no limit.
+            name (str): The name of the cache, which is shared by all caches
+                with this name
+            path (str): The database file. If None,
+                :data:`soco.config.SHARED_CACHE_PATH` is used, or if that is
+                None too, :func:`default_shared_cache_path`.
+
+        """
+        super(SharedCache, self).__init__(default_timeout, name)
+        if max_entries is None:
+            max_entries = config.SHARED_CACHE_MAX_ENTRIES
+        #: The maximum number of items in the database (0 means no limit)
+        self.max_entries = max_entries or 0
+        self._path = path
+        self._namespace = name or ''
+        self._counters = {}
+        self._counters_lock = threading.Lock()
+
+    @property
+    def path(self):
+        """ The database file """
+        if self._path is not None:
+            return self._path
+        if config.SHARED_CACHE_PATH is not None:
+            return config.SHARED_CACHE_PATH
+        return default_shared_cache_path()
+
+    def _connect(self):
+        """ Return this process's connection to the database, and the lock
+        which must be held while using it """
+        path = self.path
+        key = (path, os.getpid())
+        with _connections_lock:
+            connection = _connections.get(key)
+            if connection is None:
+                if path != ':memory:':
+                    _open_private(path)
+                connection = sqlite3.connect(
+                    path, timeout=5, check_same_thread=False,
+                    isolation_level=None)
+                # The contents can always be fetched again, so durability
+                # does not matter
+                connection.execute('PRAGMA journal_mode = WAL')
+                connection.execute('PRAGMA synchronous = OFF')
+                version = connection.execute(
+                    'PRAGMA user_version').fetchone()[0]
+                if version != _SHARED_SCHEMA_VERSION:
+                    connection.execute('DROP TABLE IF EXISTS entries')
+                    connection.execute('PRAGMA user_version = {0}'.format(
+                        _SHARED_SCHEMA_VERSION))
+                connection.executescript(_SHARED_SCHEMA)
+                connection = _connections[key] = (
+                    connection, threading.Lock())
+        return connection
+
+    def _execute(self, statement, parameters=()):
+        """ Execute an SQL statement, and return all the rows it returns, or
+        None if the database could not be used """
+        try:
+            connection, lock = self._connect()
+            with lock:
+                return connection.execute(statement, parameters).fetchall()
+        except (sqlite3.Error, OSError) as error:
+            log.warning("Shared cache %s failed: %s", self.path, error)
+            return None
+
+    def _count(self, action, counter):
+        """ Increment a counter, for this process, for `action` """
+        with self._counters_lock:
+            counters = self._counters.get(action)
+            if counters is None:
+                counters = self._counters[action] = [0, 0, 0, 0]
+            counters[counter] += 1
+
+    @staticmethod
+    def make_key(*args, **kwargs):
+        """
+        Generate a representation of the args and kwargs which is the same
+        in every process, as JSON text
+
+        """
+        return _json_key(args, kwargs)
+
+    def get(self, *args, **kwargs):
+        """Get an item from the cache for this combination of args and kwargs.
+
+        Return None if no unexpired item is found. This means that there is no
+        point storing an item in the cache if it is None.
+
+        """
+        if not self.enabled:
+            return None
+        action = args[0] if args and isinstance(args[0], str) else ''
+        rows = self._execute(
+            'SELECT expires, item FROM entries WHERE namespace = ? AND '
+            'key = ?', (self._namespace, self.make_key(args, kwargs)))
+        if not rows:
+            self._count(action, _MISSES)
+            return None
+        expires, item = rows[0]
+        if expires < time():
+            # Left to be removed by purge_expired or a later put
+            self._count(action, _EXPIRATIONS)
+            self._count(action, _MISSES)
+            return None
+        try:
+            item = json.loads(item)
+        except ValueError:
+            log.warning("Ignoring invalid item in shared cache %s",
+                        self.path)
+            self._count(action, _MISSES)
+            return None
+        self._count(action, _HITS)
+        return item
+
+    def put(self, item, *args, **kwargs):
+        """ Put an item into the cache, for this combination of args and
+        kwargs.
+
+        If `timeout` is specified as one of the keyword arguments, the item
+        will remain available for retrieval for `timeout` seconds. If `timeout`
+        is None or not specified, the default cache timeout for this cache will
+        be used. Items with a `timeout` of 0 are not stored at all."""
+
+        if not self.enabled:
+            return
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = self.default_timeout
+        if not timeout or timeout <= 0:
+            # It would expire straight away, but remove any older value
+            self.delete(*args, **kwargs)
+            return
+        action = args[0] if args and isinstance(args[0], str) else ''
+        try:
+            encoded = json.dumps(item, separators=(',', ':'))
+        except (TypeError, ValueError):
+            log.debug("Not caching %r, which cannot be stored as JSON", item)
+            self.delete(*args, **kwargs)
+            return
+        self._execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+            (self._namespace, self.make_key(args, kwargs), action,
+             time() + timeout, encoded))
+        if self.max_entries:
+            # Remove expired items, and then those closest to expiry, while
+            # over the limit
+            self._execute(
+                'DELETE FROM entries WHERE expires < ? OR rowid IN ('
+                'SELECT rowid FROM entries ORDER BY expires LIMIT MAX(0, ('
+                'SELECT COUNT(*) FROM entries) - ?))',
+                (time(), self.max_entries))
+        else:
+            self._purge_now_and_then()
+
+    def _purge_now_and_then(self):
+        """ Remove expired items from the database, if this process has not
+        done so for :data:`soco.config.SHARED_CACHE_PURGE_INTERVAL` seconds
+        """
+        path = self.path
+        now = monotonic()
+        with _connections_lock:
+            last = _last_purged.get(path)
+            if last is not None and \
+                    now - last < config.SHARED_CACHE_PURGE_INTERVAL:
+                return
+            _last_purged[path] = now
+        self._execute('DELETE FROM entries WHERE expires < ?', (time(),))
+
+    def delete(self, *args, **kwargs):
+        """Delete an item from the cache for this combination of args and
+        kwargs"""
+        self._execute(
+            'DELETE FROM entries WHERE namespace = ? AND key = ?',
+            (self._namespace, self.make_key(args, kwargs)))
+
+    def clear(self):
+        """Empty the whole cache. Other caches sharing the database are not
+        affected."""
+        self._execute('DELETE FROM entries WHERE namespace = ?',
+                      (self._namespace,))
+
+    def delete_action(self, action):
+        """Delete all items stored for `action` (the first argument to
+        :meth:`put`), whatever their other arguments"""
+        self._execute(
+            'DELETE FROM entries WHERE namespace = ? AND action = ?',
+            (self._namespace, action))
+
+    def purge_expired(self):
+        """ Remove all expired items of all caches from the database
+
+        Returns:
+            int: the number of items removed
+
+        """
+        rows = self._execute('SELECT COUNT(*) FROM entries WHERE expires < ?',
+                             (time(),))
+        self._execute('DELETE FROM entries WHERE expires < ?', (time(),))
+        return rows[0][0] if rows else 0
+
+    def __len__(self):
+        rows = self._execute(
+            'SELECT COUNT(*) FROM entries WHERE namespace = ? AND '
+            'expires >= ?', (self._namespace, time()))
+        return rows[0][0] if rows else 0
+
+    def stats(self):
+        """ Return statistics about the use of the cache, as
+        :meth:`LRUCache.stats` does. The size is that of the shared cache,
+        but the counters are for this process only. ``bytes`` is always 0.
+        """
+        with self._counters_lock:
+            combined = dict((action, list(values))
+                            for action, values in self._counters.items())
+        totals = [sum(values[index] for values in combined.values())
+                  for index in range(4)]
+        return {
+            'name': self.name,
+            'size': len(self),
+            'bytes': 0,
+            'totals': _stats_dict(totals),
+            'actions': dict((action, _stats_dict(values))
+                            for action, values in combined.items()),
+        }
+
+    def reset_stats(self):
+        """ Set all the counters reported by :meth:`stats` to zero """
+        with self._counters_lock:
+            self._counters.clear()
+
+    def entries(self):
+        """ Return a list of the unexpired entries in the cache, as
+        :class:`CacheEntry` namedtuples """
+        now = time()
+        rows = self._execute(
+            'SELECT action, key, expires, item FROM entries WHERE '
+            'namespace = ? AND expires >= ?', (self._namespace, now)) or []
+        return [CacheEntry(action, json.loads(key), expires - now,
+                           json.loads(item))
+                for action, key, expires, item in rows]
+
+
 class Cache(_BaseCache):
 
     """A factory class which returns an instance of a cache subclass.
 
-    If config.CACHE_ENABLED is False, the dummy inactive cache will be returned
+    The class used is :data:`soco.config.CACHE_CLASS`, or :class:`LRUCache`
+    if that is None. If config.CACHE_ENABLED is False, the dummy inactive
+    cache will be returned
     """
 
     def __new__(cls, *args, **kwargs):
         if config.CACHE_ENABLED:
-            new_cls = TimedCache
+            new_cls = config.CACHE_CLASS or LRUCache
         else:
             new_cls = NullCache
         instance = super(Cache, cls).__new__(new_cls)
         instance.__init__(*args, **kwargs)
         return instance
+
+
+class LazyCache(object):
+
+    """ A cache which is only created, by :class:`Cache`, when it is first
+    used, and otherwise behaves exactly like it.
+
+    Caches defined when a module is imported are created like this, so that
+    :data:`soco.config.CACHE_CLASS` can still be set after SoCo has been
+    imported.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LazyCache, self).__init__()
+        self._args = args
+        self._kwargs = kwargs
+        self._cache = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        """ The cache, which is created if it does not exist yet """
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = Cache(*self._args, **self._kwargs)
+        return self._cache
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.cache, name)
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __repr__(self):
+        return repr(self.cache)
@@ -6,6 +6,7 @@
 
 try:  # python 3
     from http.server import SimpleHTTPRequestHandler  # nopep8
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # nopep8
     from urllib.request import urlopen  # nopep8
     from urllib.error import URLError  # nopep8
     from urllib.parse import quote_plus  # nopep8
@@ -17,6 +18,7 @@ try:  # python 3
 
 except ImportError:  # python 2.7
     from SimpleHTTPServer import SimpleHTTPRequestHandler  # nopep8
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # nopep8
     from urllib2 import urlopen, URLError  # nopep8
     from urllib import quote_plus  # nopep8
     import SocketServer as socketserver  # nopep8
@@ -29,6 +31,11 @@ try:  # python 2.7 - this has to be done the other way round
 except ImportError:  # python 3
     from pickle import dumps  # nopep8
 
+try:  # python 3.3+
+    from time import monotonic  # nopep8
+except ImportError:  # python 2
+    from time import time as monotonic  # nopep8
+
 # Support Python 2.6
 try:  # Python 2.7+
     from logging import NullHandler  # nopep8
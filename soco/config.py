@@ -24,3 +24,342 @@ CACHE_ENABLED = True
 #: if you want to use a different port than 1400, set EVENT_LISTENER_PORT
 #: accordingly after importing but before subscribing to an event
 EVENT_LISTENER_PORT = 1400
+
+#: The maximum number of keep-alive HTTP connections which are kept open to
+#: each speaker. Requests beyond this number, made from several threads at
+#: once, still succeed, but their connections are not kept for reuse.
+HTTP_POOL_SIZE = 4
+
+#: Pooled connections to a speaker which have been idle for longer than this
+#: many seconds are closed, rather than reused. Set to 0 to keep them forever.
+HTTP_IDLE_TIMEOUT = 60
+
+#: The maximum number of speakers which are sent commands concurrently by
+#: :func:`soco.fanout.fan_out`, unless otherwise specified.
+FAN_OUT_MAX_WORKERS = 8
+
+#: If True (the default), identical read-only SOAP requests to a speaker (eg
+#: GetPositionInfo or GetZoneGroupState) which are made from several threads
+#: at once are coalesced, so that only one of them goes over the network. See
+#: :meth:`soco.services.Service.send_command`.
+SINGLE_FLIGHT_ENABLED = True
+
+#: The timeout, in seconds, for HTTP requests to a speaker which are not given
+#: one explicitly, for example through the `request_timeout` argument of
+#: :class:`soco.core.SoCo`. None means wait forever.
+REQUEST_TIMEOUT = 20
+
+#: While requests to a speaker have recently failed with network errors, they
+#: are allowed no more than this many seconds. See :mod:`soco.health`.
+DEGRADED_REQUEST_TIMEOUT = 3
+
+#: After this many network failures in a row, requests to a speaker fail
+#: immediately (the circuit opens), rather than waiting for a timeout.
+CIRCUIT_FAILURE_THRESHOLD = 3
+
+#: The number of seconds for which the circuit to a speaker stays open, before
+#: one request is let through to see if it has recovered.
+CIRCUIT_RESET_TIMEOUT = 30
+
+#: The directory in which service descriptions (SCPD files) are saved, so that
+#: they need only be downloaded once for each model and firmware version. If
+#: None, a ``soco/scpd`` directory in the user's cache directory is used. Set
+#: to an empty string to keep them in memory only. See :mod:`soco.scpd`.
+SCPD_CACHE_DIR = None
+
+#: If True (the default), commands are checked against the description of
+#: their service, once it is known, before they are sent. Unknown actions and
+#: missing arguments raise an exception, and arguments are put in the order
+#: the speaker expects. Arguments which the service does not declare are sent
+#: after the others.
+SCPD_VALIDATION = True
+
+#: If True (the default), request latencies, errors, cache hits and requests
+#: in flight are recorded in the registry in :mod:`soco.metrics`.
+METRICS_ENABLED = True
+
+#: If True, the raw bytes of HTTP requests to speakers and their responses are
+#: recorded, with their status and timing, in a ring buffer for each speaker.
+#: See :mod:`soco.trace`. False (the default) records nothing.
+WIRE_TRACE_ENABLED = False
+
+#: The number of exchanges with each speaker kept by the wire trace.
+WIRE_TRACE_BUFFER_SIZE = 100
+
+#: If True (the default), and wire tracing is enabled, the recent exchanges
+#: with a speaker are logged at WARNING level whenever a command sent to it
+#: fails.
+WIRE_TRACE_DUMP_ON_ERROR = True
+
+#: The class of the caches created by :class:`soco.cache.Cache`. Specify the
+#: actual class object here, not a string. If None, the default,
+#: :class:`soco.cache.LRUCache` is used. :class:`soco.cache.TimedCache` is the
+#: unbounded cache used by earlier versions. :class:`soco.cache.SharedCache`
+#: is shared by all processes on the host. Must be set before any SoCo
+#: instances are created.
+CACHE_CLASS = None
+
+#: The maximum number of items held by each :class:`soco.cache.LRUCache`.
+#: 0 means no limit.
+CACHE_MAX_ENTRIES = 1000
+
+#: The approximate maximum size, in bytes, of the items held by each
+#: :class:`soco.cache.LRUCache`. 0 means no limit.
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+#: The number of separately locked shards in each :class:`soco.cache.LRUCache`.
+CACHE_SHARDS = 8
+
+#: The interval, in seconds, at which expired items are removed from all
+#: :class:`soco.cache.LRUCache` instances by a background thread. 0 means
+#: they are only removed when next looked up.
+CACHE_REAP_INTERVAL = 60
+
+#: If True (the default), events received for a subscription to a service
+#: update that service's cache: results which the event shows to be out of
+#: date are invalidated, and those which it reports in full (eg volume, mute
+#: and zone group state) are primed. See
+#: :meth:`soco.services.Service.update_cache_from_event`.
+EVENT_CACHE_ENABLED = True
+
+#: The number of seconds for which results primed from an event are cached.
+#: Every later event for the same service replaces them.
+EVENT_CACHE_TTL = 30
+
+#: The number of seconds for which the zone group topology fetched from a
+#: speaker is considered fresh, and used without asking again.
+TOPOLOGY_TTL = 5
+
+#: Once the topology is no longer fresh, it is still used for up to this many
+#: seconds (from when it was fetched), while a fresh copy is fetched in the
+#: background. After that, callers wait for a fresh copy. 0 means always wait.
+TOPOLOGY_MAX_STALENESS = 60
+
+#: If True, pages of music library browse results are saved in an SQLite
+#: database, and served from it until the library changes, even after a
+#: restart. See :mod:`soco.library_cache`. False (the default) saves nothing.
+MUSIC_LIBRARY_CACHE_ENABLED = False
+
+#: The database file of the music library cache. If None,
+#: ``soco/library.sqlite`` in the user's cache directory is used.
+MUSIC_LIBRARY_CACHE_PATH = None
+
+#: The number of seconds for which the ``SystemUpdateID`` of a household's
+#: music library is trusted, before a speaker is asked whether it has changed.
+#: ContentDirectory events report changes sooner, if subscribed to.
+MUSIC_LIBRARY_CACHE_CHECK_INTERVAL = 300
+
+#: The caching policy for each action, keyed by (service type, action name).
+#: Each policy is a dict, which may contain:
+#:
+#: ``ttl``
+#:     The number of seconds for which results are cached, unless a
+#:     ``cache_timeout`` is given to
+#:     :meth:`~soco.services.Service.send_command`.
+#: ``cacheable``
+#:     If False, results are never read from or stored in the cache, even if
+#:     a ``cache_timeout`` is given. Defaults to True.
+#: ``invalidated_by``
+#:     A list of (service type, action name) tuples. Whenever one of those
+#:     actions succeeds, all cached results of this action from the same
+#:     speaker are discarded.
+#: ``writes_through``
+#:     For a setter, the cached getter result which a successful call
+#:     updates. See :meth:`soco.services.Service.write_through`.
+#:
+#: Actions which are not listed are cached only if a ``cache_timeout`` is
+#: given, since each service's cache has a default timeout of 0.
+CACHE_POLICIES = {
+    ('RenderingControl', 'GetVolume'): {
+        'ttl': 1,
+        'invalidated_by': [
+            ('RenderingControl', 'SetVolume'),
+            ('RenderingControl', 'SetRelativeVolume'),
+            ('RenderingControl', 'RampToVolume'),
+            ('RenderingControl', 'RestoreVolumePriorToRamp'),
+        ],
+    },
+    ('RenderingControl', 'GetMute'): {
+        'ttl': 1,
+        'invalidated_by': [('RenderingControl', 'SetMute')],
+    },
+    ('RenderingControl', 'GetBass'): {
+        'ttl': 10,
+        'invalidated_by': [
+            ('RenderingControl', 'SetBass'),
+            ('RenderingControl', 'ResetBasicEQ'),
+        ],
+    },
+    ('RenderingControl', 'GetTreble'): {
+        'ttl': 10,
+        'invalidated_by': [
+            ('RenderingControl', 'SetTreble'),
+            ('RenderingControl', 'ResetBasicEQ'),
+        ],
+    },
+    ('RenderingControl', 'GetLoudness'): {
+        'ttl': 10,
+        'invalidated_by': [
+            ('RenderingControl', 'SetLoudness'),
+            ('RenderingControl', 'ResetBasicEQ'),
+        ],
+    },
+    ('AVTransport', 'GetTransportSettings'): {
+        'ttl': 10,
+        'invalidated_by': [('AVTransport', 'SetPlayMode')],
+    },
+    ('AVTransport', 'GetCrossfadeMode'): {
+        'ttl': 10,
+        'invalidated_by': [('AVTransport', 'SetCrossfadeMode')],
+    },
+    ('RenderingControl', 'SetVolume'): {
+        'writes_through': {
+            'action': 'GetVolume',
+            'args': ['InstanceID', 'Channel'],
+            'values': {'CurrentVolume': 'DesiredVolume'},
+            'provisional': True,
+        },
+    },
+    ('RenderingControl', 'SetRelativeVolume'): {
+        'writes_through': {
+            'action': 'GetVolume',
+            'args': ['InstanceID', 'Channel'],
+            'values': {'CurrentVolume': 'NewVolume'},
+        },
+    },
+    ('RenderingControl', 'SetMute'): {
+        'writes_through': {
+            'action': 'GetMute',
+            'args': ['InstanceID', 'Channel'],
+            'values': {'CurrentMute': 'DesiredMute'},
+            'provisional': True,
+        },
+    },
+    ('RenderingControl', 'SetBass'): {
+        'writes_through': {
+            'action': 'GetBass',
+            'args': ['InstanceID', ('Channel', 'Master')],
+            'values': {'CurrentBass': 'DesiredBass'},
+            'provisional': True,
+        },
+    },
+    ('RenderingControl', 'SetTreble'): {
+        'writes_through': {
+            'action': 'GetTreble',
+            'args': ['InstanceID', ('Channel', 'Master')],
+            'values': {'CurrentTreble': 'DesiredTreble'},
+            'provisional': True,
+        },
+    },
+    ('RenderingControl', 'SetLoudness'): {
+        'writes_through': {
+            'action': 'GetLoudness',
+            'args': ['InstanceID', 'Channel'],
+            'values': {'CurrentLoudness': 'DesiredLoudness'},
+            'provisional': True,
+        },
+    },
+    ('AVTransport', 'SetPlayMode'): {
+        'writes_through': {
+            'action': 'GetTransportSettings',
+            'args': ['InstanceID'],
+            'values': {'PlayMode': 'NewPlayMode'},
+            'merge': True,
+            'provisional': True,
+        },
+    },
+    ('AVTransport', 'SetCrossfadeMode'): {
+        'writes_through': {
+            'action': 'GetCrossfadeMode',
+            'args': ['InstanceID'],
+            'values': {'CrossfadeMode': 'CrossfadeMode'},
+            'provisional': True,
+        },
+    },
+    # These change continually while playing
+    ('AVTransport', 'GetPositionInfo'): {'cacheable': False},
+    ('AVTransport', 'GetTransportInfo'): {'cacheable': False},
+    ('ContentDirectory', 'Browse'): {
+        'ttl': 2,
+        'invalidated_by': [
+            ('AVTransport', 'AddURIToQueue'),
+            ('AVTransport', 'AddMultipleURIsToQueue'),
+            ('AVTransport', 'RemoveTrackFromQueue'),
+            ('AVTransport', 'RemoveTrackRangeFromQueue'),
+            ('AVTransport', 'RemoveAllTracksFromQueue'),
+            ('AVTransport', 'ReorderTracksInQueue'),
+            ('AVTransport', 'SaveQueue'),
+            ('AVTransport', 'CreateSavedQueue'),
+            ('AVTransport', 'AddURIToSavedQueue'),
+            ('ContentDirectory', 'DestroyObject'),
+        ],
+    },
+}
+
+#: The database file used by :class:`soco.cache.SharedCache`. If None, a file
+#: in ``$XDG_RUNTIME_DIR``, or else in a private directory in ``/dev/shm`` (or
+#: the temporary directory, if there is no ``/dev/shm``), is used. All
+#: processes which should share a cache must use the same file, and it must
+#: belong to their user, with no access for anyone else.
+SHARED_CACHE_PATH = None
+
+#: The maximum number of items held by :class:`soco.cache.SharedCache`, for
+#: all caches together. 0 means no limit.
+SHARED_CACHE_MAX_ENTRIES = 10000
+
+#: How often, in seconds, each process removes expired items from the
+#: database of :class:`soco.cache.SharedCache`, when storing an item. Without
+#: this, expired items are only removed to keep within
+#: :data:`SHARED_CACHE_MAX_ENTRIES`, and a database with no limit would grow
+#: for ever.
+SHARED_CACHE_PURGE_INTERVAL = 60
+
+#: If True (the default), a successful setter, such as ``SetVolume``, updates
+#: the cached result of the corresponding getter, so that reading the value
+#: back needs no request. See :meth:`soco.services.Service.write_through`.
+WRITE_THROUGH_ENABLED = True
+
+#: The number of seconds for which a provisional value written through by a
+#: setter is cached, unless an event confirms it first.
+WRITE_THROUGH_PROVISIONAL_TTL = 2
+
+#: The maximum number of events waiting to be passed to the callbacks of each
+#: subscription. 0 means no limit.
+EVENT_QUEUE_SIZE = 100
+
+#: What to do with an event when the queue for its subscription is full:
+#: ``'drop_oldest'`` (the default) drops the oldest event waiting,
+#: ``'coalesce'`` merges it into the newest event waiting, keeping the latest
+#: value of each variable, and ``'block'`` holds up the speaker until there is
+#: room. See :class:`soco.events.EventQueue`.
+EVENT_QUEUE_OVERFLOW = 'drop_oldest'
+
+#: The number of threads which run event callbacks that are not coroutine
+#: functions.
+EVENT_CALLBACK_WORKERS = 4
+
+#: The maximum number of connections which a
+#: :class:`soco.subscriptions.SubscriptionManager` keeps open to all speakers
+#: at once, for subscribing, renewing and unsubscribing.
+SUBSCRIPTION_MAX_CONNECTIONS = 20
+
+#: Subscriptions made by a :class:`soco.subscriptions.SubscriptionManager`
+#: are renewed after this fraction of the period for which they were granted
+#: has passed...
+SUBSCRIPTION_RENEWAL_FRACTION = 0.75
+
+#: ...give or take a random fraction of the period of up to this much, so
+#: that subscriptions made together are not all renewed together.
+SUBSCRIPTION_RENEWAL_JITTER = 0.1
+
+#: The maximum number of renewals which a
+#: :class:`soco.subscriptions.SubscriptionManager` makes at once. Renewals
+#: which fall due together wait their turn.
+SUBSCRIPTION_RENEWAL_CONCURRENCY = 8
+
+#: The number of seconds after which a failed renewal is tried again.
+SUBSCRIPTION_RETRY_INTERVAL = 10
+
+#: The resolution, in seconds, of the timer wheel on which a
+#: :class:`soco.subscriptions.SubscriptionManager` schedules renewals.
+SUBSCRIPTION_WHEEL_TICK = 1.0
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+""" Pooled, keep-alive HTTP connections to Sonos speakers
+
+All the HTTP requests which SoCo makes to a speaker (SOAP actions, device
+descriptions and service descriptions) go through a :class:`SpeakerSession`.
+There is one session for each speaker ip address, shared by every service of
+the corresponding SoCo instance, so that repeated calls can reuse an open TCP
+connection to port 1400 rather than paying for a fresh handshake each time.
+
+Sessions are safe to use from many threads at once. Each one keeps at most
+:data:`soco.config.HTTP_POOL_SIZE` connections open, and connections which
+have not been used for :data:`soco.config.HTTP_IDLE_TIMEOUT` seconds are
+closed rather than reused. Every session also tracks the health of its
+speaker (see :mod:`soco.health`), so that requests to a speaker which has
+stopped responding fail fast.
+
+The asynchronous control path (see :mod:`soco.aio`) uses aiohttp instead. All
+coroutines running on one event loop share a single
+:class:`aiohttp.ClientSession`, returned by :func:`get_client_session`.
+
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import threading
+import weakref
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from .compat import monotonic
+from .health import SpeakerHealth
+from . import trace
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+class SpeakerSession(object):
+
+    """ A thread-safe pool of keep-alive HTTP connections to one speaker.
+
+    The interface is a small subset of that of :class:`requests.Session`, so
+    that ``session.get(url, timeout=5)`` and ``session.post(url, data=body)``
+    work as expected.
+
+    """
+
+    def __init__(self, ip_address, pool_size=None, idle_timeout=None):
+        """
+        Args:
+            ip_address (str): The ip address of the speaker
+            pool_size (int): The maximum number of connections to keep open.
+                If None, :data:`soco.config.HTTP_POOL_SIZE` is used.
+            idle_timeout (float): The number of seconds after which idle
+                connections are closed. If None,
+                :data:`soco.config.HTTP_IDLE_TIMEOUT` is used. 0 means never.
+
+        """
+        super(SpeakerSession, self).__init__()
+        self.ip_address = ip_address
+        if pool_size is None:
+            pool_size = config.HTTP_POOL_SIZE
+        if idle_timeout is None:
+            idle_timeout = config.HTTP_IDLE_TIMEOUT
+        #: The maximum number of connections kept open to the speaker
+        self.pool_size = pool_size
+        #: Connections idle for longer than this many seconds are closed
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._session = None
+        self._last_used = 0
+        self._in_use = 0
+        #: The :class:`soco.health.SpeakerHealth` of the speaker
+        self.health = SpeakerHealth(ip_address)
+
+    def __repr__(self):
+        return '<{0} for {1}, pool size {2}>'.format(
+            self.__class__.__name__, self.ip_address, self.pool_size)
+
+    def _new_session(self):
+        """ Create a requests session with a suitably sized adapter """
+        session = requests.Session()
+        # All requests go to a single host, so one pool of pool_size
+        # connections is all we need. If more threads than that are making
+        # requests at the same time, the extra connections are simply not
+        # kept alive afterwards.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        return session
+
+    def _is_idle(self, now):
+        """ True if the connections have been idle for too long """
+        return (self._session is not None and self._in_use == 0 and
+                self.idle_timeout and
+                now - self._last_used > self.idle_timeout)
+
+    def _acquire(self):
+        """ Return the underlying requests session, creating it if needed """
+        now = monotonic()
+        with self._lock:
+            if self._is_idle(now):
+                # The speaker has probably dropped these connections by now
+                # anyway, so start afresh
+                log.debug("Closing idle connections to %s", self.ip_address)
+                self._session.close()
+                self._session = None
+            if self._session is None:
+                self._session = self._new_session()
+            self._in_use += 1
+            self._last_used = now
+            return self._session
+
+    def _release(self):
+        """ Mark the end of a request """
+        with self._lock:
+            self._in_use -= 1
+            self._last_used = monotonic()
+
+    def request(self, method, url, **kwargs):
+        """ Send a request to the speaker, reusing a pooled connection if one
+        is available. Arguments are as for :meth:`requests.Session.request`.
+        The timeout is adjusted to the health of the speaker (see
+        :meth:`soco.health.SpeakerHealth.deadline`).
+
+        Returns:
+            :class:`requests.Response`: the response.
+
+        Raises:
+            SoCoCircuitOpenException: if the speaker has stopped responding.
+
+        """
+        kwargs['timeout'] = self.health.deadline(kwargs.get('timeout'))
+        with self.health.guard():
+            session = self._acquire()
+            try:
+                if config.WIRE_TRACE_ENABLED:
+                    return trace.traced_request(
+                        session, self.ip_address, method, url, **kwargs)
+                return session.request(method, url, **kwargs)
+            finally:
+                self._release()
+
+    def get(self, url, **kwargs):
+        """ Send a GET request. See :meth:`request` """
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """ Send a POST request. See :meth:`request` """
+        return self.request('POST', url, **kwargs)
+
+    def evict_idle(self):
+        """ Close the pooled connections if they have been idle for longer
+        than :attr:`idle_timeout` seconds. Return True if they were closed.
+
+        """
+        with self._lock:
+            if not self._is_idle(monotonic()):
+                return False
+            self._session.close()
+            self._session = None
+            return True
+
+    def close(self):
+        """ Close all pooled connections. The session may still be used
+        afterwards, in which case new connections will be opened. """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class SessionRegistry(object):
+
+    """ A thread-safe registry of :class:`SpeakerSession` objects, one for
+    each speaker ip address. """
+
+    def __init__(self):
+        super(SessionRegistry, self).__init__()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, ip_address):
+        """ Return the session for the speaker at `ip_address`, creating it
+        if necessary """
+        with self._lock:
+            session = self._sessions.get(ip_address)
+            if session is None:
+                session = self._sessions[ip_address] = SpeakerSession(
+                    ip_address)
+            return session
+
+    def evict_idle(self):
+        """ Close connections which have been idle for too long, in all
+        sessions. This happens automatically when a session is next used,
+        but a long running program may want to call this periodically to
+        release sockets to speakers it no longer talks to.
+
+        Returns:
+            int: the number of sessions whose connections were closed
+
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(1 for session in sessions if session.evict_idle())
+
+    def close_all(self):
+        """ Close the connections in all sessions """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session.close()
+
+
+#: The registry used by all SoCo instances
+sessions = SessionRegistry()  # pylint: disable=invalid-name
+
+
+def get_session(ip_address):
+    """ Return the shared :class:`SpeakerSession` for a speaker """
+    return sessions.get(ip_address)
+
+
+# One aiohttp session for each event loop. aiohttp sessions are bound to the
+# loop on which they were created, so they cannot be shared any more widely.
+_client_sessions = weakref.WeakKeyDictionary()  # pylint: disable=invalid-name
+
+
+def get_client_session(loop=None):
+    """ Return the :class:`aiohttp.ClientSession` shared by all asynchronous
+    requests made on `loop`, creating it if necessary.
+
+    Args:
+        loop: The event loop. If None, the current event loop is used.
+
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    session = _client_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=config.HTTP_POOL_SIZE, loop=loop)
+        session = _client_sessions[loop] = aiohttp.ClientSession(
+            connector=connector, loop=loop)
+    return session
+
+
+async def close_client_session(loop=None):
+    """ Close the shared :class:`aiohttp.ClientSession` for `loop`, if there
+    is one. Call this before closing the event loop. """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    session = _client_sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def client_timeout(seconds):
+    """ Convert a timeout in seconds (or None) into a value suitable for the
+    `timeout` argument of aiohttp requests """
+    # Older versions of aiohttp take a plain number
+    if seconds is None or not hasattr(aiohttp, 'ClientTimeout'):
+        return seconds
+    return aiohttp.ClientTimeout(total=seconds)
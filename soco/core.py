@@ -7,16 +7,21 @@ the main entry to the SoCo functionality
 from __future__ import unicode_literals
 
 import socket
-import json
 import logging
 import re
-import requests
+import threading
 from functools import wraps
-import time
 
 from .services import DeviceProperties, ContentDirectory
 from .services import RenderingControl, AVTransport, ZoneGroupTopology
 from .services import AlarmClock
+from . import metrics
+from .compat import monotonic
+from .connection import get_session
+from .services import zone_group_state_shared_cache
+from .services import stamp_zone_group_state, zone_group_state_age
+from .fanout import fan_out
+from .library_cache import music_library_cache
 from .groups import ZoneGroup
 from .exceptions import SoCoUPnPException, SoCoSlaveException
 from .data_structures import DidlPlaylistContainer,\
@@ -30,8 +35,6 @@ from soco import config
 
 _LOG = logging.getLogger(__name__)
 
-performance_logger = logging.getLogger("sonos")
-
 class _ArgsSingleton(type):
 
     """ A metaclass which permits only a single instance of each derived class
@@ -204,6 +207,9 @@ class SoCo(_SocoSingletonBase):
         #: The speaker's ip address
         self.ip_address = ip_address
         self.request_timeout = request_timeout
+        #: The pooled HTTP session used for all requests to this speaker.
+        #: See :class:`~soco.connection.SpeakerSession`
+        self.http_session = get_session(ip_address)
         self.speaker_info = {}  # Stores information about the current speaker
 
         # The services which we use
@@ -224,6 +230,10 @@ class SoCo(_SocoSingletonBase):
         self._uid = None
         self._visible_zones = set()
         self._zgs_cache = None
+        # When the topology was last known to be fresh (monotonic time)
+        self._zgs_fetched_at = None
+        self._zgs_lock = threading.Lock()
+        self._zgs_refreshing = False
 
         _LOG.debug("Created SoCo instance for ip: %s", ip_address)
 
@@ -381,15 +391,12 @@ class SoCo(_SocoSingletonBase):
 
         # first, set the queue itself as the source URI
         uri = 'x-rincon-queue:{0}#0'.format(self.uid())
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         self.avTransport.SetAVTransportURI([
             ('InstanceID', 0),
             ('CurrentURI', uri),
             ('CurrentURIMetaData', '')
         ])
-        uri_set_time = time.time()
-        log_args = dict(action="SetAVTransportUri", duration=(uri_set_time-start_timestamp)*1000, uri=uri)
-        performance_logger.info("soco:play_from_queue:%s" % json.dumps(log_args))
 
         # second, set the track number with a seek command
         self.avTransport.Seek([
@@ -397,11 +404,8 @@ class SoCo(_SocoSingletonBase):
             ('Unit', 'TRACK_NR'),
             ('Target', index + 1)
         ])
-        log_args = dict(action="Seek", duration=(time.time()-uri_set_time)*1000, track=index+1)
-        performance_logger.info("soco:play_from_queue:%s" % json.dumps(log_args))
-
-        log_args = dict(action="All", duration=(time.time()-start_timestamp)*1000, track=index+1, uri=uri)
-        performance_logger.info("soco:play_from_queue:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'play_from_queue')
 
         # finally, just play what's set if needed
         if start:
@@ -418,13 +422,13 @@ class SoCo(_SocoSingletonBase):
         Raises SoCoException (or a subclass) upon errors.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         self.avTransport.Play([
             ('InstanceID', 0),
             ('Speed', 1)
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:play:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'play')
 
     @only_on_master
     def play_uri(self, uri='', meta='', title='', start=True):
@@ -448,33 +452,39 @@ class SoCo(_SocoSingletonBase):
         Raises SoCoException (or a subclass) upon errors.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         if meta == '' and title != '':
-            meta_template = '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements'\
-                '/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" '\
-                'xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" '\
-                'xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'\
-                '<item id="R:0/0/0" parentID="R:0/0" restricted="true">'\
-                '<dc:title>{title}</dc:title><upnp:class>'\
-                'object.item.audioItem.audioBroadcast</upnp:class><desc '\
-                'id="cdudn" nameSpace="urn:schemas-rinconnetworks-com:'\
-                'metadata-1-0/">{service}</desc></item></DIDL-Lite>'
-            tunein_service = 'SA_RINCON65031_'
-            # Radio stations need to have at least a title to play
-            meta = meta_template.format(title=title, service=tunein_service)
+            meta = self._stream_metadata(title)
 
         self.avTransport.SetAVTransportURI([
             ('InstanceID', 0),
             ('CurrentURI', uri),
             ('CurrentURIMetaData', meta)
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000, uri=uri)
-        performance_logger.info("soco:play_uri:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'play_uri')
         # The track is enqueued, now play it if needed
         if start:
             return self.play()
         return False
 
+    @staticmethod
+    def _stream_metadata(title):
+        """ Build the minimal DIDL metadata needed to play a stream with the
+        given title """
+        meta_template = '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements'\
+            '/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" '\
+            'xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" '\
+            'xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'\
+            '<item id="R:0/0/0" parentID="R:0/0" restricted="true">'\
+            '<dc:title>{title}</dc:title><upnp:class>'\
+            'object.item.audioItem.audioBroadcast</upnp:class><desc '\
+            'id="cdudn" nameSpace="urn:schemas-rinconnetworks-com:'\
+            'metadata-1-0/">{service}</desc></item></DIDL-Lite>'
+        tunein_service = 'SA_RINCON65031_'
+        # Radio stations need to have at least a title to play
+        return meta_template.format(title=title, service=tunein_service)
+
     @only_on_master
     def pause(self):
         """ Pause the currently playing track.
@@ -485,13 +495,13 @@ class SoCo(_SocoSingletonBase):
         Raises SoCoException (or a subclass) upon errors.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         self.avTransport.Pause([
             ('InstanceID', 0),
             ('Speed', 1)
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:pause:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'pause')
 
     @only_on_master
     def stop(self):
@@ -544,13 +554,13 @@ class SoCo(_SocoSingletonBase):
         songs can be skipped).
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         self.avTransport.Next([
             ('InstanceID', 0),
             ('Speed', 1)
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:next:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'next')
 
     @only_on_master
     def previous(self):
@@ -567,13 +577,13 @@ class SoCo(_SocoSingletonBase):
         go back on tracks.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         self.avTransport.Previous([
             ('InstanceID', 0),
             ('Speed', 1)
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:previous:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'previous')
 
     def mute(self):
         """ The speaker's mute state. True if muted, False otherwise """
@@ -596,19 +606,19 @@ class SoCo(_SocoSingletonBase):
 
     def volume(self):
         """ The speaker's volume. An integer between 0 and 100. """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         response = self.renderingControl.GetVolume([
             ('InstanceID', 0),
             ('Channel', 'Master'),
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:volume:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'volume')
         volume = response['CurrentVolume']
         return int(volume)
 
     def set_volume(self, volume):
         """ Set the speaker's volume """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         volume = int(volume)
         volume = max(0, min(volume, 100))  # Coerce in range
         self.renderingControl.SetVolume([
@@ -616,8 +626,8 @@ class SoCo(_SocoSingletonBase):
             ('Channel', 'Master'),
             ('DesiredVolume', volume)
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000, volume=volume)
-        performance_logger.info("soco:set_volume:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'set_volume')
 
     def bass(self):
         """ The speaker's bass EQ. An integer between -10 and 10. """
@@ -685,21 +695,115 @@ class SoCo(_SocoSingletonBase):
         # This is called quite frequently, so it is worth optimising it.
         # Maintain a private cache. If the zgt has not changed, there is no
         # need to repeat all the XML parsing. In addition, switch on network
-        # caching for a short interval (5 secs).
-        zgs = self.zoneGroupTopology.GetZoneGroupState(cache_timeout=5)['ZoneGroupState']
+        # caching for a short interval (config.TOPOLOGY_TTL secs).
+        #
+        # Once that has passed, the last known topology is still used, for
+        # up to config.TOPOLOGY_MAX_STALENESS secs, while it is refreshed in
+        # the background (stale-while-revalidate). Only after that do
+        # callers wait for a fresh copy.
+        if not self._check_zone_group_state():
+            self._fetch_zone_group_state()
+
+    def _check_zone_group_state(self):
+        """ Bring the topology attributes up to date, if that can be done
+        without waiting for the speaker. Return True if they can be used, or
+        False if the zone group state must be fetched, and waited for. """
+        fetched_at = self._zgs_fetched_at
+        age = None if fetched_at is None else monotonic() - fetched_at
+        if age is not None and age < config.TOPOLOGY_TTL:
+            return True
+        # Another instance, or an event, may already have fetched a new copy
+        if self._zone_group_state_from_cache():
+            return True
+        max_staleness = config.TOPOLOGY_MAX_STALENESS
+        if age is not None and max_staleness and age < max_staleness:
+            self._refresh_zone_group_state()
+            return True
+        return False
+
+    def _zone_group_state_from_cache(self):
+        """ Update the topology attributes from the zone group state in the
+        shared cache, if there is one there. Its age is the time since it
+        was fetched, or reported in an event, or if that is not known,
+        config.TOPOLOGY_TTL. Return True if there was one. """
+        cached = zone_group_state_shared_cache.get('GetZoneGroupState', None)
+        if cached is None:
+            return False
+        zgs = cached['ZoneGroupState']
+        age = zone_group_state_age(zgs)
+        if age is None:
+            age = config.TOPOLOGY_TTL
+        self._update_zone_group_state(zgs, fetched_at=monotonic() - age)
+        return True
+
+    def _fetch_zone_group_state(self):
+        """ Fetch the zone group state (or take it from the shared cache)
+        and update the topology attributes, waiting for the result """
+        if self._zone_group_state_from_cache():
+            return
+        zgs = self.zoneGroupTopology.GetZoneGroupState(
+            cache_timeout=config.TOPOLOGY_TTL)['ZoneGroupState']
+        self._zone_group_state_fetched(zgs)
+
+    def _zone_group_state_fetched(self, zgs):
+        """ Update the topology attributes from a ZoneGroupState string
+        which has just been fetched from the speaker, and record in the
+        shared cache when that was """
+        stamp_zone_group_state(zgs, config.TOPOLOGY_TTL)
+        self._update_zone_group_state(zgs, fetched_at=monotonic())
+
+    def _refresh_zone_group_state(self):
+        """ Fetch the zone group state in a background thread, unless that
+        is already happening """
+        with self._zgs_lock:
+            if self._zgs_refreshing:
+                return
+            self._zgs_refreshing = True
+
+        def refresh():
+            """ The body of the thread """
+            try:
+                self._fetch_zone_group_state()
+            except Exception:  # pylint: disable=broad-except
+                # Keep using the stale topology. Once it is too old,
+                # callers will fetch it themselves and see the error.
+                _LOG.warning("Failed to refresh topology from %s",
+                             self.ip_address, exc_info=True)
+            finally:
+                self._zgs_refreshing = False
+
+        _LOG.debug("Refreshing topology from %s in the background",
+                   self.ip_address)
+        thread = threading.Thread(target=refresh,
+                                  name='soco-topology-refresh')
+        thread.daemon = True
+        thread.start()
+
+    def _update_zone_group_state(self, zgs, fetched_at=None):
+        """ Update the topology attributes from a ZoneGroupState string, as
+        returned by GetZoneGroupState. `fetched_at` is the time, by
+        monotonic(), at which it was fetched from a speaker, if known. """
+        if fetched_at is not None:
+            self._zgs_fetched_at = fetched_at
         if zgs == self._zgs_cache:
             return
-        self._zgs_cache = zgs
         tree = XML.fromstring(zgs.encode('utf-8'))
-        self._groups = parser.parse_zone_group_state(xml_group_state=tree)
+        groups = parser.parse_zone_group_state(xml_group_state=tree)
 
-        self._all_zones.clear()
-        self._visible_zones.clear()
-        for zone_group in self._groups:
+        all_zones = set()
+        visible_zones = set()
+        for zone_group in groups:
             for group_member in zone_group.members:
-                self._all_zones.add(group_member)
+                all_zones.add(group_member)
                 if group_member.is_visible:
-                    self._visible_zones.add(group_member)
+                    visible_zones.add(group_member)
+        # Replace, rather than update, the sets, since other threads may be
+        # using them while a background refresh is done
+        with self._zgs_lock:
+            self._groups = groups
+            self._all_zones = all_zones
+            self._visible_zones = visible_zones
+            self._zgs_cache = zgs
 
     def all_groups(self):
         """  Return a set of all the available groups"""
@@ -748,10 +852,15 @@ class SoCo(_SocoSingletonBase):
         speaker which to join. There's probably a bit more to it if multiple
         groups have been defined.
 
+        Returns:
+        A dict of :class:`~soco.fanout.FanOutResult`, one for each zone told
+        to join, keyed by zone. A zone which could not join does not stop the
+        others from doing so.
+
         """
-        # Tell every other visible zone to join this one
-        # pylint: disable = expression-not-assigned
-        [zone.join(self) for zone in self.visible_zones if zone is not self]
+        # Tell every other visible zone to join this one, all at once
+        zones = [zone for zone in self.visible_zones() if zone is not self]
+        return fan_out(zones, 'join', args=(self,))
 
     def join(self, master):
         """ Join this speaker to another "master" speaker.
@@ -904,12 +1013,20 @@ class SoCo(_SocoSingletonBase):
         string.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         response = self.avTransport.GetPositionInfo([
             ('InstanceID', 0),
             ('Channel', 'Master')
         ])
+        track = self._parse_track_info(response)
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address,
+            'get_current_track_info')
+        return track
 
+    def _parse_track_info(self, response):
+        """ Build the track info dict returned by get_current_track_info
+        from the result of a GetPositionInfo call """
         track = {'title': '', 'artist': '', 'album': '', 'album_art': '',
                  'position': ''}
         track['playlist_position'] = response['Track']
@@ -968,8 +1085,6 @@ class SoCo(_SocoSingletonBase):
             if album_art_url is not None:
                 track['album_art'] = self._build_album_art_full_uri(
                     album_art_url)
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:get_current_track_info:%s" % json.dumps(log_args))
         return track
 
     def get_speaker_info(self, refresh=False):
@@ -986,12 +1101,17 @@ class SoCo(_SocoSingletonBase):
         if self.speaker_info and refresh is False:
             return self.speaker_info
         else:
-            response = requests.get(
+            response = self.http_session.get(
                 'http://%s:1400/xml/device_description.xml' % (self.ip_address),
                 timeout=self.request_timeout
             )
-            dom = XML.fromstring(response.content)
+            self._parse_speaker_info(response.content)
+        return self.speaker_info
 
+    def _parse_speaker_info(self, device_description):
+        """ Populate :attr:`speaker_info` from the device description XML
+        (as bytes) """
+        dom = XML.fromstring(device_description)
         device = dom.find('{urn:schemas-upnp-org:device-1-0}device')
         if device is not None:
             self.speaker_info['zone_name'] = \
@@ -1011,8 +1131,6 @@ class SoCo(_SocoSingletonBase):
             self.speaker_info['player_name'] = device.findtext(
                 '{urn:schemas-upnp-org:device-1-0}roomName')
 
-        return self.speaker_info
-
     def get_current_transport_info(self):
         """ Get the current playback state
 
@@ -1026,11 +1144,20 @@ class SoCo(_SocoSingletonBase):
         states of CurrentTransportStatus and CurrentSpeed.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         response = self.avTransport.GetTransportInfo([
             ('InstanceID', 0),
         ])
+        playstate = self._parse_transport_info(response)
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address,
+            'get_current_transport_info')
+        return playstate
 
+    @staticmethod
+    def _parse_transport_info(response):
+        """ Build the dict returned by get_current_transport_info from the
+        result of a GetTransportInfo call """
         playstate = {
             'current_transport_status': '',
             'current_transport_state': '',
@@ -1042,9 +1169,6 @@ class SoCo(_SocoSingletonBase):
         playstate['current_transport_status'] = \
             response['CurrentTransportStatus']
         playstate['current_transport_speed'] = response['CurrentSpeed']
-
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:get_current_transport_info:%s" % json.dumps(log_args))
         return playstate
 
     def get_queue(self, start=0, max_items=100, full_album_art_uri=False):
@@ -1060,8 +1184,7 @@ class SoCo(_SocoSingletonBase):
         implementation
 
         """
-        queue = []
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         response = self.contentDirectory.Browse([
             ('ObjectID', 'Q:0'),
             ('BrowseFlag', 'BrowseDirectChildren'),
@@ -1070,6 +1193,15 @@ class SoCo(_SocoSingletonBase):
             ('RequestedCount', max_items),
             ('SortCriteria', '')
         ])
+        queue = self._parse_queue(response, full_album_art_uri)
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'get_queue')
+        return queue
+
+    def _parse_queue(self, response, full_album_art_uri=False):
+        """ Build the Queue returned by get_queue from the result of a
+        Browse call """
+        queue = []
         result = response['Result']
 
         metadata = {}
@@ -1089,8 +1221,6 @@ class SoCo(_SocoSingletonBase):
                 self._update_album_art_to_full_uri(item)
             queue.append(item)
 
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:get_queue:%s" % json.dumps(log_args))
         # pylint: disable=star-args
         return Queue(queue, **metadata)
 
@@ -1460,8 +1590,22 @@ class SoCo(_SocoSingletonBase):
             tuple: (response, metadata) where response is the returned metadata
                 and metadata is a dict with the 'number_returned',
                 'total_matches' and 'update_id' integers
+
+        If :data:`soco.config.MUSIC_LIBRARY_CACHE_ENABLED` is True, pages are
+        served from, and saved in, the persistent cache in
+        :mod:`soco.library_cache`, until the library changes.
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
+        library_cache = (music_library_cache
+                         if config.MUSIC_LIBRARY_CACHE_ENABLED else None)
+        if library_cache is not None:
+            cached = library_cache.lookup(self, search, start, max_items)
+            if cached is not None:
+                metrics.operation_duration.observe(
+                    monotonic() - start_timestamp, self.ip_address,
+                    '_music_lib_search')
+                return cached
+
         response = self.contentDirectory.Browse([
             ('ObjectID', search),
             ('BrowseFlag', 'BrowseDirectChildren'),
@@ -1475,9 +1619,13 @@ class SoCo(_SocoSingletonBase):
         metadata = {}
         for tag in ['NumberReturned', 'TotalMatches', 'UpdateID']:
             metadata[camel_to_underscore(tag)] = int(response[tag])
+        if library_cache is not None:
+            library_cache.store(self, search, start, max_items, response,
+                                metadata)
 
-        log_args = dict(duration=(time.time() - start_timestamp)*1000, search=search)
-        performance_logger.info("soco:_music_lib_search:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address,
+            '_music_lib_search')
 
         return response, metadata
 
@@ -1497,7 +1645,7 @@ class SoCo(_SocoSingletonBase):
     @only_on_master
     def add_to_queue(self, queueable_item, metadata=None):
         """ Adds a queueable item to the queue """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         metadata = to_didl_string(queueable_item) if not metadata else metadata;
         response = self.avTransport.AddURIToQueue([
             ('InstanceID', 0),
@@ -1506,8 +1654,8 @@ class SoCo(_SocoSingletonBase):
             ('DesiredFirstTrackNumberEnqueued', 0),
             ('EnqueueAsNext', 1)
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000, uri=queueable_item.resources[0].uri)
-        performance_logger.info("soco:add_to_queue:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'add_to_queue')
         qnumber = response['FirstTrackNumberEnqueued']
         return int(qnumber)
 
@@ -1543,12 +1691,12 @@ class SoCo(_SocoSingletonBase):
         Raises SoCoException (or a subclass) upon errors.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         self.avTransport.RemoveAllTracksFromQueue([
             ('InstanceID', 0),
         ])
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:clear_queue:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'clear_queue')
 
     def get_favorite_radio_shows(self, start=0, max_items=100):
         """ Get favorite radio shows from Sonos' Radio app.
@@ -1605,7 +1753,7 @@ class SoCo(_SocoSingletonBase):
         max_items -- The total number of results to return.
 
         """
-        start_timestamp = time.time()
+        start_timestamp = monotonic()
         if favorite_type != RADIO_SHOWS and favorite_type != RADIO_STATIONS:
             favorite_type = SONOS_FAVORITES
 
@@ -1651,8 +1799,8 @@ class SoCo(_SocoSingletonBase):
         result['returned'] = len(favorites)
         result['favorites'] = favorites
 
-        log_args = dict(duration=(time.time()-start_timestamp)*1000)
-        performance_logger.info("soco:__get_favorites:%s" % json.dumps(log_args))
+        metrics.operation_duration.observe(
+            monotonic() - start_timestamp, self.ip_address, 'get_favorites')
         return result
 
     def _update_album_art_to_full_uri(self, item):
@@ -134,6 +134,12 @@ def discover(timeout=1, include_invisible=False, interface_addr=None):
             # the others, than to wait for query responses from them
             # ourselves.
             zone = config.SOCO_CLASS(addr[0])
+            # A speaker which has stopped answering requests may still
+            # answer discovery. Asking it for the topology would fail, so
+            # wait for another to respond instead.
+            if not zone.http_session.health.available:
+                _LOG.debug('Skipping %s: circuit open', addr[0])
+                continue
             if include_invisible:
                 return zone.all_zones()
             else:
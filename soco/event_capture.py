@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+""" Capturing events, and replaying them to measure the event pipeline
+
+An :class:`EventRecorder` saves the headers and body of every NOTIFY request
+received by a :class:`soco.events.SonosEventServer`, with the time it
+arrived, to a compact (gzipped) file::
+
+    >>> from soco.event_capture import EventRecorder
+    >>> event_server.recorder = EventRecorder('storm.events')
+    >>> # ... later
+    >>> event_server.recorder.close()
+    >>> event_server.recorder = None
+
+The events in the file, read with :func:`read_capture`, can be posted back
+to an event server with :func:`replay`, at the speed at which they arrived or
+as fast as possible, with no speakers needed. :func:`benchmark` replays them
+to an event server of its own, and reports the throughput, the latency of
+each NOTIFY, and the time spent parsing and dispatching events (see
+:data:`soco.metrics.event_parse_duration` and
+:data:`soco.metrics.event_dispatch_duration`). The script
+``dev_tools/event_replay.py`` does all this from the command line.
+
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import gzip
+import json
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import aiohttp
+
+from . import metrics
+from .connection import client_timeout
+from .events import SonosEventServer
+
+#: An event read from a capture file. `timestamp` is the wall clock time at
+#: which it was received, `headers` a dict of the headers which matter to an
+#: event server, with lower case names, and `body` the body, as bytes.
+CapturedEvent = namedtuple('CapturedEvent', 'timestamp, headers, body')
+
+# The start of every capture file, including the version of the format
+_MAGIC = b'SOCOEVT\x01'
+
+# Each event is saved as its timestamp, the lengths of its headers and body,
+# and then the headers, as JSON, and the body
+_RECORD = struct.Struct('>dII')
+
+# The headers saved
+_HEADERS = ('sid', 'seq', 'nt', 'nts', 'content-type')
+
+
+class EventRecorder(object):
+
+    """ Saves events to a capture file. Safe to use from many threads. """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The file to write. It is replaced if it exists.
+
+        """
+        super(EventRecorder, self).__init__()
+        self.path = path
+        #: The number of events saved so far
+        self.count = 0
+        self._file = gzip.open(path, 'wb')
+        self._file.write(_MAGIC)
+        self._lock = threading.Lock()
+
+    def record(self, headers, body, timestamp=None):
+        """ Save an event
+
+        Args:
+            headers: The headers of the NOTIFY request (any mapping)
+            body (bytes): Its body
+            timestamp (float): The time at which it was received. Defaults
+                to now.
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        saved = {}
+        for name, value in headers.items():
+            if name.lower() in _HEADERS:
+                saved[name.lower()] = value
+        encoded = json.dumps(saved, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(_RECORD.pack(timestamp, len(encoded), len(body)))
+            self._file.write(encoded)
+            self._file.write(body)
+            self.count += 1
+
+    def close(self):
+        """ Finish writing the file """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_capture(path):
+    """ Read the events in a capture file, in the order they were received
+
+    Yields:
+        CapturedEvent: each event
+
+    Raises:
+        ValueError: if the file is not a capture file, or is cut short
+
+    """
+    with gzip.open(path, 'rb') as capture:
+        if capture.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("{0} is not an event capture file".format(path))
+        while True:
+            prefix = capture.read(_RECORD.size)
+            if not prefix:
+                return
+            if len(prefix) != _RECORD.size:
+                raise ValueError("{0} is truncated".format(path))
+            timestamp, headers_length, body_length = _RECORD.unpack(prefix)
+            headers = capture.read(headers_length)
+            body = capture.read(body_length)
+            if len(headers) != headers_length or len(body) != body_length:
+                raise ValueError("{0} is truncated".format(path))
+            yield CapturedEvent(
+                timestamp, json.loads(headers.decode('utf-8')), body)
+
+
+def _percentile(ordered, fraction):
+    """ The value below which `fraction` of the sorted values fall """
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class ReplayReport(object):
+
+    """ The results of replaying events """
+
+    def __init__(self, latencies, errors, elapsed):
+        super(ReplayReport, self).__init__()
+        #: The time each NOTIFY took to be answered, in seconds, in order
+        self.latencies = latencies
+        #: The number of NOTIFY requests which failed
+        self.errors = errors
+        #: The number of seconds the replay took
+        self.elapsed = elapsed
+        #: (count, total seconds) tuples for the parsing and dispatching of
+        #: events by the event server, or None if it was not in this process
+        self.parse = None
+        self.dispatch = None
+
+    @property
+    def count(self):
+        """ The number of events replayed """
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        """ The number of events replayed per second """
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, fraction):
+        """ The NOTIFY latency below which `fraction` of them fall """
+        return _percentile(sorted(self.latencies), fraction)
+
+    def format(self):
+        """ Return the report as text """
+        lines = [
+            '{0} events in {1:.3f} s: {2:.0f} events/s, {3} errors'.format(
+                self.count, self.elapsed, self.throughput, self.errors),
+            'NOTIFY latency: p50 {0:.3f} ms, p95 {1:.3f} ms, p99 {2:.3f} ms, '
+            'max {3:.3f} ms'.format(*[
+                self.percentile(fraction) * 1000
+                for fraction in (0.5, 0.95, 0.99, 1.0)]),
+        ]
+        for name, stats in (('parse', self.parse),
+                            ('dispatch', self.dispatch)):
+            if stats is not None and stats[0]:
+                lines.append('{0}: {1} events, mean {2:.3f} ms'.format(
+                    name, stats[0], stats[1] / stats[0] * 1000))
+        return '\n'.join(lines)
+
+
+async def replay(events, url, speed=1.0, session=None, concurrency=1,
+                 timeout=10):
+    """ Post captured events to an event server
+
+    Args:
+        events: An iterable of :class:`CapturedEvent`
+        url (str): The url of the event server, eg
+            ``'http://127.0.0.1:1400/'``
+        speed (float): How much faster than they were received to post the
+            events, eg 1 for the original speed, or None for as fast as
+            possible
+        session (aiohttp.ClientSession): The session to post with. If None,
+            one is made, and closed afterwards.
+        concurrency (int): The number of requests which may be waiting for
+            answers at once. With more than one, events may arrive out of
+            order.
+        timeout (float): The number of seconds to wait for each answer
+
+    Returns:
+        ReplayReport: the results
+
+    """
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession()
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = [0]
+
+    async def post(event):
+        """ Post one event, and time it """
+        start = loop.time()
+        try:
+            async with session.request(
+                    'NOTIFY', url, headers=event.headers, data=event.body,
+                    timeout=client_timeout(timeout)) as response:
+                await response.read()
+                if response.status != 200:
+                    errors[0] += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors[0] += 1
+        finally:
+            latencies.append(loop.time() - start)
+            semaphore.release()
+
+    tasks = []
+    start = loop.time()
+    first = None
+    try:
+        for event in events:
+            if speed:
+                if first is None:
+                    first = event.timestamp
+                delay = start + (event.timestamp - first) / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(post(event)))
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        if own_session:
+            await session.close()
+    return ReplayReport(latencies, errors[0], loop.time() - start)
+
+
+async def benchmark(events, speed=None, concurrency=1):
+    """ Replay events to an event server of our own, with a callback for
+    every subscription, and report how fast it handled them, including the
+    time it spent parsing and dispatching them
+
+    Args:
+        events: A list of :class:`CapturedEvent`
+        speed (float): See :func:`replay`. Defaults to as fast as possible.
+        concurrency (int): See :func:`replay`
+
+    Returns:
+        ReplayReport: the results
+
+    """
+    loop = asyncio.get_event_loop()
+    event_server = SonosEventServer(loop, '127.0.0.1', 0)
+
+    async def callback(event):
+        """ Receive an event, and do nothing with it """
+        pass
+
+    for sid in set(event.headers.get('sid') for event in events):
+        if sid:
+            event_server.register_callback_for_service_id(sid, callback)
+    await event_server.start()
+    # Events are labelled with the service type, which is unknown here
+    parse_before = metrics.event_parse_duration.get('')
+    dispatch_before = metrics.event_dispatch_duration.get('')
+    try:
+        report = await replay(
+            events, 'http://127.0.0.1:{0}/'.format(event_server.listen_port),
+            speed=speed, concurrency=concurrency)
+    finally:
+        await event_server.shutdown()
+    parse_after = metrics.event_parse_duration.get('')
+    dispatch_after = metrics.event_dispatch_duration.get('')
+    report.parse = (parse_after[0] - parse_before[0],
+                    parse_after[1] - parse_before[1])
+    report.dispatch = (dispatch_after[0] - dispatch_before[0],
+                       dispatch_after[1] - dispatch_before[1])
+    return report
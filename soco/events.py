@@ -1,22 +1,143 @@
 import aiohttp
 import aiohttp.web
 import asyncio
+import collections
+import concurrent.futures
 import enum
 import functools
 import logging
 
 from soco import config
+from . import connection
+from . import metrics
 from . import parser
 
 from . import exceptions
 
 log = logging.getLogger(__name__)
 
+# The results of checking the sequence number of an event
+SEQ_OK = 'ok'
+SEQ_DUPLICATE = 'duplicate'
+SEQ_GAP = 'gap'
+
+# Sequence numbers wrap round from this to 1 (not 0)
+SEQ_MAX = 4294967295
+
+
+def compare_sequence(last, seq):
+  """Compare the sequence number `seq` of an event with `last`, that of the
+  latest event received for the same subscription (or None if there has
+  been none). Return SEQ_OK if it is the next one, SEQ_DUPLICATE if it is
+  the same as or older than `last`, or SEQ_GAP if some were skipped."""
+  if last is None:
+    # The first event of a subscription is numbered 0
+    return SEQ_OK if seq == 0 else SEQ_GAP
+  if seq == 0 and last != 0:
+    # The subscription was started again. A second 0 is a duplicate.
+    return SEQ_OK
+  expected = 1 if last >= SEQ_MAX else last + 1
+  if seq == expected:
+    return SEQ_OK
+  # How far ahead of `last` it is, allowing for wrapping round
+  ahead = (seq - last) % SEQ_MAX
+  if 0 < ahead < SEQ_MAX // 2:
+    return SEQ_GAP
+  return SEQ_DUPLICATE
+
+
 class SonosEvent:
+  """An event passed to subscription callbacks. Its evented variables are
+  attributes, which are only parsed when first read (see
+  :class:`soco.parser.EventVariables`)."""
 
-  def __init__(self, **entries):
+  def __init__(self, variables=None, **entries):
+    self._variables = variables if variables is not None else {}
     self.__dict__.update(entries)
 
+  def __getattr__(self, name):
+    if name.startswith('__') or name == '_variables':
+      raise AttributeError(name)
+    try:
+      return self._variables[name]
+    except KeyError:
+      raise AttributeError(name)
+
+  @property
+  def variables(self):
+    """The evented variables, by name (usually
+    :class:`soco.parser.EventVariables`)."""
+    return self._variables
+
+  def merge(self, other):
+    """Add the variables of a later event, `other`, to this one, replacing
+    any with the same names."""
+    if isinstance(self._variables, parser.EventVariables) and \
+        isinstance(other._variables, parser.EventVariables):
+      self._variables.merge(other._variables)
+    else:
+      self._variables.update(other._variables)
+
+
+# What to do with an event when the queue for its subscription is full
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_COALESCE = 'coalesce'
+OVERFLOW_BLOCK = 'block'
+
+
+class EventQueue:
+  """A bounded queue of the events for one subscription, waiting to be passed
+  to its callbacks.
+
+  When the queue is full, `overflow` decides what happens to another event:
+  OVERFLOW_DROP_OLDEST drops the oldest event in the queue, OVERFLOW_COALESCE
+  merges the new event into the newest one in the queue, so that only the
+  latest value of each variable is kept, and OVERFLOW_BLOCK makes
+  :meth:`put` wait until there is room. The speaker then waits for its
+  NOTIFY request to be answered, and holds back later events.
+  """
+
+  def __init__(self, maxsize, overflow, label=''):
+    if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE,
+                        OVERFLOW_BLOCK):
+      raise ValueError("Unknown overflow policy: {0}".format(overflow))
+    self.maxsize = maxsize
+    self.overflow = overflow
+    self.label = label # The service, for metrics
+    self._events = collections.deque()
+    self._not_empty = asyncio.Event()
+    self._not_full = asyncio.Event()
+    self._not_full.set()
+
+  def __len__(self):
+    return len(self._events)
+
+  def full(self):
+    return 0 < self.maxsize <= len(self._events)
+
+  async def put(self, event):
+    while self.full():
+      if self.overflow == OVERFLOW_DROP_OLDEST:
+        self._events.popleft()
+        metrics.events_overflowed.inc(self.label, self.overflow)
+        break
+      if self.overflow == OVERFLOW_COALESCE:
+        self._events[-1].merge(event)
+        metrics.events_overflowed.inc(self.label, self.overflow)
+        return
+      self._not_full.clear()
+      await self._not_full.wait()
+    self._events.append(event)
+    self._not_empty.set()
+
+  async def get(self):
+    while not self._events:
+      self._not_empty.clear()
+      await self._not_empty.wait()
+    event = self._events.popleft()
+    self._not_full.set()
+    return event
+
 class SonosEventServer:
 
   def __init__(self, loop, listen_host, listen_port):
@@ -39,12 +160,147 @@ class SonosEventServer:
     self.listen_port = listen_port
     self._socket_server = None
     self.sid_to_callback_mapping = {}
+    # The services whose caches are updated by events, by sid
+    self.sid_to_service_mapping = {}
+    # The sequence number of the latest event received, by sid
+    self.sid_to_last_seq = {}
+    # The sids whose state is being fetched again after lost events
+    self._resyncing = set()
+    # The queues of events waiting for callbacks, and the tasks which
+    # deliver them, by sid
+    self._queues = {}
+    self._deliveries = {}
+    # The threads which run callbacks which are not coroutines
+    self._executor = None
+    # Records every NOTIFY received, if capturing (see soco.event_capture)
+    self.recorder = None
 
   def register_callback_for_service_id(self, sid, callback):
     self.sid_to_callback_mapping.setdefault(sid, set()).add(callback)
 
   def unregister_callback_for_service_id(self, sid, callback):
-    self.sid_to_callback_mapping.setdefault(sid, set()).remove(callback)
+    callbacks = self.sid_to_callback_mapping.get(sid, set())
+    callbacks.discard(callback)
+    if not callbacks:
+      self.sid_to_callback_mapping.pop(sid, None)
+
+  def register_service_for_service_id(self, sid, service):
+    """Update the cache of `service` from the events received for `sid`."""
+    self.sid_to_service_mapping[sid] = service
+
+  def unregister_service_for_service_id(self, sid):
+    self.sid_to_service_mapping.pop(sid, None)
+    self.sid_to_last_seq.pop(sid, None)
+    self._queues.pop(sid, None)
+    delivery = self._deliveries.pop(sid, None)
+    if delivery is not None:
+      delivery.cancel()
+
+  def _service_label(self, sid):
+    service = self.sid_to_service_mapping.get(sid)
+    return service.service_type if service is not None else ''
+
+  def check_sequence(self, sid, seq):
+    """Check the sequence number of an event received for `sid`, and record
+    it unless the event is a duplicate. Duplicates and gaps are counted in
+    :mod:`soco.metrics`. Returns SEQ_OK, SEQ_DUPLICATE or SEQ_GAP."""
+    try:
+      seq = int(seq)
+    except (TypeError, ValueError):
+      return SEQ_OK
+    result = compare_sequence(self.sid_to_last_seq.get(sid), seq)
+    if result == SEQ_DUPLICATE:
+      log.debug("Dropping duplicate event %s for %s", seq, sid)
+      metrics.event_duplicates.inc(self._service_label(sid))
+      return result
+    if result == SEQ_GAP:
+      log.info("Events lost for %s: expected %s, received %s", sid,
+               self.sid_to_last_seq.get(sid, -1) + 1, seq)
+      metrics.event_gaps.inc(self._service_label(sid))
+    self.sid_to_last_seq[sid] = seq
+    return result
+
+  def resync(self, sid):
+    """Fetch the state reported by the events for `sid` afresh, after some
+    were lost, and pass it to the callbacks as an event whose `resync`
+    attribute is True. Nothing is done unless the service subscribed to is
+    known."""
+    service = self.sid_to_service_mapping.get(sid)
+    if service is None or sid in self._resyncing:
+      return
+    self._resyncing.add(sid)
+    future = asyncio.ensure_future(self._resync(sid, service), loop=self.loop)
+    future.add_done_callback(self.check_for_callback_error)
+
+  async def _resync(self, sid, service):
+    try:
+      variables = await service.resync_state()
+    finally:
+      self._resyncing.discard(sid)
+    if not variables:
+      return
+    variables["sid"] = sid
+    variables["seq"] = None
+    variables["resync"] = True
+    await self.dispatch(sid, SonosEvent(variables))
+
+  async def dispatch(self, sid, event):
+    """Queue an event for the callbacks registered for `sid`.
+
+    Each subscription has its own :class:`EventQueue`, holding up to
+    :data:`soco.config.EVENT_QUEUE_SIZE` events, with the overflow policy
+    :data:`soco.config.EVENT_QUEUE_OVERFLOW`. A task passes its events to
+    the callbacks one at a time, in the order they were received. Callbacks
+    may be coroutine functions, or plain functions, which are run on a pool
+    of :data:`soco.config.EVENT_CALLBACK_WORKERS` threads.
+    """
+    if not self.sid_to_callback_mapping.get(sid):
+      return
+    queue = self._queues.get(sid)
+    if queue is None:
+      queue = self._queues[sid] = EventQueue(
+          config.EVENT_QUEUE_SIZE, config.EVENT_QUEUE_OVERFLOW,
+          self._service_label(sid))
+      self._deliveries[sid] = asyncio.ensure_future(
+          self._deliver(sid, queue), loop=self.loop)
+    await queue.put(event)
+
+  async def _deliver(self, sid, queue):
+    """Pass the events in `queue` to the callbacks for `sid`, in order."""
+    while True:
+      event = await queue.get()
+      for callback in list(self.sid_to_callback_mapping.get(sid, ())):
+        try:
+          await self._call(callback, event)
+        except asyncio.CancelledError:
+          raise
+        except Exception:  # pylint: disable=broad-except
+          log.exception("Exception occured handling event callback")
+
+  async def _call(self, callback, event):
+    """Call a callback with an event, on the thread pool unless it is a
+    coroutine function."""
+    if asyncio.iscoroutinefunction(callback):
+      await callback(event)
+      return
+    if self._executor is None:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=config.EVENT_CALLBACK_WORKERS)
+    result = await self.loop.run_in_executor(self._executor, callback, event)
+    if asyncio.iscoroutine(result):
+      # eg a functools.partial of a coroutine function
+      await result
+
+  def update_service_cache(self, sid, variables):
+    """Pass the variables of an event to the service subscribed with `sid`,
+    so that it can bring its cache up to date before callbacks run."""
+    service = self.sid_to_service_mapping.get(sid)
+    if service is None:
+      return
+    try:
+      service.update_cache_from_event(variables)
+    except Exception:  # pylint: disable=broad-except
+      log.exception("Error updating cache of %s from event", service)
 
   async def start(self):
     log.info("Starting event listening server at %s:%s", self.listen_host, self.listen_port)
@@ -53,6 +309,9 @@ class SonosEventServer:
         host=self.listen_host,
         port=self.listen_port,
     )
+    if not self.listen_port:
+      # Listening on a port chosen by the OS
+      self.listen_port = self._socket_server.sockets[0].getsockname()[1]
 
   async def shutdown(self):
     # Stop accepting any new connections
@@ -64,22 +323,52 @@ class SonosEventServer:
     # Fire a shutdown signal to any registered on_shutdown handlers
     await self._app.shutdown()
 
-    # Close any outstanding connections (with a 5 second timeout)
-    await self._socket_server_protocol.finish_connections(timeout=5)
+    # Close any outstanding connections (with a 5 second timeout). Newer
+    # versions of aiohttp call this shutdown
+    finish_connections = getattr(
+        self._socket_server_protocol, 'finish_connections', None)
+    if finish_connections is None:
+      finish_connections = self._socket_server_protocol.shutdown
+    await finish_connections(timeout=5)
+
+    # Stop delivering events
+    for delivery in self._deliveries.values():
+      delivery.cancel()
+    self._deliveries.clear()
+    self._queues.clear()
+    if self._executor is not None:
+      self._executor.shutdown(wait=False)
+      self._executor = None
 
   async def handle_incoming_event(self, request):
     if request.method.lower() != "notify":
       return aiohttp.web.Response(status=204)
 
-    content = await request.text()
-    variables = parser.parse_event_xml(content)
-    variables["sid"] = request.headers["sid"] # Event Subscription Identifier
-    variables["seq"] = request.headers["seq"] # Event Sequence Number
-    event = SonosEvent(**variables)
-
-    for callback in self.sid_to_callback_mapping.get(request.headers["sid"], []):
-      callback_future = asyncio.ensure_future(callback(event), loop=self.loop)
-      callback_future.add_done_callback(self.check_for_callback_error)
+    content = None
+    if self.recorder is not None:
+      content = await request.read()
+      self.recorder.record(request.headers, content)
+
+    sid = request.headers["sid"] # Event Subscription Identifier
+    seq = request.headers.get("seq") # Event Sequence Number
+    sequence = self.check_sequence(sid, seq)
+    if sequence == SEQ_DUPLICATE:
+      # Acknowledge it, so that it is not sent again, but go no further
+      return aiohttp.web.Response(status=200)
+
+    if content is None:
+      content = await request.read()
+    label = self._service_label(sid)
+    with metrics.event_parse_duration.time(label):
+      variables = parser.parse_event(content)
+    variables["sid"] = sid
+    variables["seq"] = seq
+    variables["resync"] = False
+    with metrics.event_dispatch_duration.time(label):
+      self.update_service_cache(sid, variables)
+      await self.dispatch(sid, SonosEvent(variables))
+    if sequence == SEQ_GAP:
+      self.resync(sid)
 
     return aiohttp.web.Response(status=200)
 
@@ -88,17 +377,37 @@ class SonosEventServer:
       log.exception("Exception occured handling event callback: %s", callback_future.exception())
 
 
+def parse_timeout(header):
+  """Return the number of seconds in a TIMEOUT header, such as
+  'Second-3600', or None if the subscription never expires."""
+  if not header or header.lower() == 'infinite':
+    return None
+  return int(header.lower().lstrip('second-'))
+
+
 class SonosSubscription:
 
-  def __init__(self, loop, event_server, subscribe_uri, callback_func, requested_timeout=None):
+  def __init__(self, loop, event_server, subscribe_uri, callback_func,
+               requested_timeout=None, service=None, session=None):
       self.loop = loop
       self.event_server = event_server
       self.subscribe_uri = subscribe_uri
       self.sid = None # A unique ID for this subscription, provided by sonos
       self.callback_func = callback_func # Callback to send events to
       self.requested_timeout = requested_timeout # The period for which the subscription is requested
+      # The Service whose cache is updated by events, if any
+      self.service = service
+      self.timeout = None # The period for which the subscription was granted
       self._renewal_handle = None
-      self._session = aiohttp.ClientSession(loop=loop)
+      # The aiohttp session for SUBSCRIBE and UNSUBSCRIBE requests. If None,
+      # the session shared by everything on the loop is used
+      self._session = session
+
+  @property
+  def session(self):
+      if self._session is not None:
+        return self._session
+      return connection.get_client_session(self.loop)
 
   async def subscribe(self, auto_renew=False):
       response = await self._make_subscription_request(
@@ -111,7 +420,11 @@ class SonosSubscription:
           }
       )
       self.sid = response.headers['sid']
+      self.timeout = parse_timeout(response.headers.get('timeout'))
       self.event_server.register_callback_for_service_id(self.sid, self.callback_func)
+      if self.service is not None:
+        self.event_server.register_service_for_service_id(
+            self.sid, self.service)
       if auto_renew:
         self._set_up_renewal(response.headers.get('timeout'), auto_renew)
 
@@ -125,9 +438,13 @@ class SonosSubscription:
             method="SUBSCRIBE",
             headers={'SID': self.sid}
         )
+        self.timeout = parse_timeout(response.headers.get('timeout'))
         if auto_renew:
           self._set_up_renewal(response.headers.get('timeout'), auto_renew)
       except exceptions.SoCoPreconditionException:
+        # The speaker has forgotten the subscription. Stop handling events
+        # for the old sid before subscribing afresh under a new one.
+        self._unregister()
         await self.subscribe(auto_renew=auto_renew)
 
       log.info("Successfully renewed subscription with id: %s", self.sid)
@@ -144,14 +461,19 @@ class SonosSubscription:
           method="UNSUBSCRIBE",
           headers={"SID": self.sid},
       )
-      self._session.close()
-      self.event_server.unregister_callback_for_service_id(self.sid, self.callback_func)
+      self._unregister()
+
+  def _unregister(self):
+      """Stop passing the events for this subscription's sid on."""
+      self.event_server.unregister_callback_for_service_id(
+          self.sid, self.callback_func)
+      self.event_server.unregister_service_for_service_id(self.sid)
 
   async def _make_subscription_request(self, method, headers):
     if self.requested_timeout:
       headers["TIMEOUT"] = "Second-{0}".format(self.requested_timeout)
 
-    async with self._session.request(
+    async with self.session.request(
         method=method,
         url=self.subscribe_uri,
         headers=headers,
@@ -166,9 +488,9 @@ class SonosSubscription:
       return response
 
   def _set_up_renewal(self, timeout, auto_renew):
-    if not timeout or timeout == 'infinite':
+    converted_timeout = parse_timeout(timeout)
+    if converted_timeout is None:
       return
-    converted_timeout = int(timeout.lower().lstrip('second-'))
     self._renewal_handle = self.loop.call_later(
         converted_timeout*.75, # We must renew a subscription before it expires
         functools.partial(self._call_renew, auto_renew=auto_renew)
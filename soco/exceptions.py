@@ -69,3 +69,15 @@ class SoCoSlaveException(SoCoException):
 class SoCoPreconditionException(SoCoException):
     """Raised when a precondition for a request is not met"""
 
+
+class SoCoCircuitOpenException(SoCoException):
+
+    """ Raised, without making a network request, when a speaker has failed
+    to respond to too many requests in a row. See :mod:`soco.health` """
+
+    def __init__(self, message, ip_address, retry_in):
+        super(SoCoCircuitOpenException, self).__init__(message)
+        #: The ip address of the speaker
+        self.ip_address = ip_address
+        #: The number of seconds until a request will be let through again
+        self.retry_in = retry_in
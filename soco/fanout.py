@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+""" Run the same call on many speakers concurrently
+
+Household-wide jobs, such as setting the volume of every zone or pausing
+everything, take one network round trip per speaker. Made one after another,
+they take N times as long as a single call. :func:`fan_out` makes the calls
+concurrently instead, with a bounded pool of worker threads::
+
+    >>> from soco.fanout import fan_out
+    >>> results = fan_out(zone.visible_zones(), 'set_volume', args=(20,))
+    >>> failed = [z for z, outcome in results.items() if not outcome.ok]
+
+A failure on one speaker does not affect the calls to the others. The result
+of each call, or the exception it raised, is returned for every speaker.
+
+"""
+
+from __future__ import unicode_literals
+
+from collections import namedtuple
+# pylint: disable=redefined-builtin
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+import logging
+
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+class FanOutResult(namedtuple('FanOutResult', 'result, exception')):
+
+    """ The outcome of a call to one speaker. Exactly one of `result` and
+    `exception` is meaningful: if the call raised an exception, it is stored
+    in `exception` and `result` is None. """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        """ True if the call succeeded """
+        return self.exception is None
+
+
+def _resolve(zone, method):
+    """ Return the callable to invoke for `zone` """
+    if callable(method):
+        return lambda *args, **kwargs: method(zone, *args, **kwargs)
+    target = zone
+    for name in method.split('.'):
+        target = getattr(target, name)
+    return target
+
+
+# pylint: disable=too-many-arguments
+def fan_out(zones, method, args=(), kwargs=None, max_workers=None,
+            timeout=None):
+    """ Call a method on many speakers concurrently.
+
+    Args:
+        zones (iterable): The SoCo instances to call, eg the result of
+            ``visible_zones()``.
+        method: What to call for each zone. Either the name of a SoCo method
+            (eg ``'pause'``), a dotted path to a service action (eg
+            ``'renderingControl.SetVolume'``), or a callable, which will be
+            passed the zone as its first argument.
+        args (tuple): Positional arguments for each call.
+        kwargs (dict): Keyword arguments for each call.
+        max_workers (int): The maximum number of calls in progress at once.
+            If None, :data:`soco.config.FAN_OUT_MAX_WORKERS` is used.
+        timeout (float): The maximum number of seconds to wait for all the
+            calls to complete. Calls which have not completed by then are
+            reported with a :class:`concurrent.futures.TimeoutError`. If None,
+            wait for as long as it takes.
+
+    Returns:
+        dict: a :class:`FanOutResult` for each zone, keyed by zone.
+
+    """
+    zones = list(zones)
+    if kwargs is None:
+        kwargs = {}
+    if max_workers is None:
+        max_workers = config.FAN_OUT_MAX_WORKERS
+    results = {}
+    if not zones:
+        return results
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(zones))))
+    try:
+        futures = {}
+        for zone in zones:
+            try:
+                function = _resolve(zone, method)
+            except AttributeError as exc:
+                results[zone] = FanOutResult(None, exc)
+                continue
+            futures[executor.submit(function, *args, **kwargs)] = zone
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            exception = future.exception()
+            if exception is not None:
+                log.debug("Fan out call to %s failed: %s",
+                          futures[future], exception)
+                results[futures[future]] = FanOutResult(None, exception)
+            else:
+                results[futures[future]] = FanOutResult(future.result(), None)
+        for future in not_done:
+            future.cancel()
+            results[futures[future]] = FanOutResult(
+                None, TimeoutError("Call timed out"))
+    finally:
+        # Do not wait for calls which have timed out
+        executor.shutdown(wait=False)
+    return results
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+""" Per-speaker health tracking, with a circuit breaker
+
+A speaker which is switched off, or has dropped off the network, does not
+answer. Without a limit, every request to it would wait for the full network
+timeout, and a sweep over a household would be held up by every dead zone in
+it. Each speaker therefore has a :class:`SpeakerHealth`, which moves between
+these states:
+
+``healthy``
+    Requests succeed. They are allowed up to
+    :data:`soco.config.REQUEST_TIMEOUT` seconds, unless a timeout is given.
+
+``degraded``
+    Some recent requests failed with a network error, but fewer than
+    :data:`soco.config.CIRCUIT_FAILURE_THRESHOLD` in a row. Requests are
+    allowed at most :data:`soco.config.DEGRADED_REQUEST_TIMEOUT` seconds.
+
+``open``
+    Too many requests in a row have failed. Further requests fail
+    immediately with :class:`soco.exceptions.SoCoCircuitOpenException`,
+    without touching the network, for
+    :data:`soco.config.CIRCUIT_RESET_TIMEOUT` seconds.
+
+``half-open``
+    The reset timeout has passed. A single request is let through as a
+    probe, while others still fail fast. If the probe succeeds, the speaker
+    is healthy again; if not, the circuit opens for another period.
+
+Any response from a speaker, even an HTTP or UPnP error, counts as success:
+only network errors (failed connections and timeouts) count as failures.
+
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import socket
+import threading
+from contextlib import contextmanager
+
+import aiohttp
+import requests
+
+from .compat import monotonic
+from .exceptions import SoCoCircuitOpenException
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Errors which mean that the speaker could not be reached, or did not answer
+# in time
+NETWORK_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    aiohttp.ClientConnectionError,
+    asyncio.TimeoutError,
+    socket.error,
+)
+
+
+class SpeakerHealth(object):
+
+    """ The health of one speaker, and a circuit breaker for requests to it.
+
+    Wrap each request in :meth:`guard`::
+
+        with health.guard():
+            response = session.post(url, data=body,
+                                    timeout=health.deadline(timeout))
+
+    """
+
+    def __init__(self, ip_address, failure_threshold=None,
+                 reset_timeout=None):
+        """
+        Args:
+            ip_address (str): The ip address of the speaker
+            failure_threshold (int): The number of consecutive network
+                failures after which the circuit opens. If None,
+                :data:`soco.config.CIRCUIT_FAILURE_THRESHOLD` is used.
+            reset_timeout (float): The number of seconds for which the
+                circuit stays open before a probe is allowed. If None,
+                :data:`soco.config.CIRCUIT_RESET_TIMEOUT` is used.
+
+        """
+        super(SpeakerHealth, self).__init__()
+        self.ip_address = ip_address
+        if failure_threshold is None:
+            failure_threshold = config.CIRCUIT_FAILURE_THRESHOLD
+        if reset_timeout is None:
+            reset_timeout = config.CIRCUIT_RESET_TIMEOUT
+        #: Consecutive failures after which the circuit opens
+        self.failure_threshold = failure_threshold
+        #: Seconds for which the circuit stays open
+        self.reset_timeout = reset_timeout
+        #: The number of consecutive network failures
+        self.failures = 0
+        self._state = HEALTHY
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{0} for {1}: {2}>'.format(
+            self.__class__.__name__, self.ip_address, self.state)
+
+    @property
+    def state(self):
+        """ The current state: one of ``'healthy'``, ``'degraded'``,
+        ``'open'`` or ``'half-open'`` """
+        with self._lock:
+            if self._state == OPEN and self._reset_due(monotonic()):
+                return HALF_OPEN
+            return self._state
+
+    @property
+    def available(self):
+        """ False if requests to the speaker would currently fail fast """
+        with self._lock:
+            if self._state == OPEN:
+                return self._reset_due(monotonic())
+            if self._state == HALF_OPEN:
+                return not self._probing
+            return True
+
+    def _reset_due(self, now):
+        """ True if the circuit has been open for long enough to probe """
+        return now - self._opened_at >= self.reset_timeout
+
+    def deadline(self, timeout=None):
+        """ Return the timeout, in seconds, to use for a request.
+
+        Args:
+            timeout (float): The timeout requested by the caller, if any.
+                Otherwise :data:`soco.config.REQUEST_TIMEOUT` is used. While
+                the speaker is degraded, this is capped at
+                :data:`soco.config.DEGRADED_REQUEST_TIMEOUT`.
+
+        """
+        if timeout is None:
+            timeout = config.REQUEST_TIMEOUT
+        if self._state != HEALTHY and config.DEGRADED_REQUEST_TIMEOUT:
+            if timeout is None:
+                return config.DEGRADED_REQUEST_TIMEOUT
+            return min(timeout, config.DEGRADED_REQUEST_TIMEOUT)
+        return timeout
+
+    def before_call(self):
+        """ Check that a request may be sent to the speaker.
+
+        Raises:
+            SoCoCircuitOpenException: if the circuit is open, or another
+                request is already probing a half-open circuit.
+
+        """
+        with self._lock:
+            if self._state == HEALTHY or self._state == DEGRADED:
+                return
+            now = monotonic()
+            if self._state == OPEN and self._reset_due(now):
+                log.info("Probing %s after %s seconds", self.ip_address,
+                         self.reset_timeout)
+                self._state = HALF_OPEN
+                self._probing = True
+                return
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            retry_in = max(0, self.reset_timeout - (now - self._opened_at))
+        raise SoCoCircuitOpenException(
+            "Circuit open for {0}: {1} consecutive network failures".format(
+                self.ip_address, self.failures), self.ip_address, retry_in)
+
+    def record_success(self):
+        """ Record that the speaker answered a request """
+        with self._lock:
+            if self._state != HEALTHY:
+                log.info("%s is healthy again", self.ip_address)
+            self._state = HEALTHY
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """ Record that a request to the speaker failed with a network
+        error """
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if (self._state == HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                if self._state != OPEN:
+                    log.warning(
+                        "Opening circuit for %s after %s failures",
+                        self.ip_address, self.failures)
+                self._state = OPEN
+                self._opened_at = monotonic()
+            else:
+                self._state = DEGRADED
+
+    def reset(self):
+        """ Forget all failures, and close the circuit """
+        self.record_success()
+
+    @contextmanager
+    def guard(self):
+        """ A context manager which checks that a request may be sent (see
+        :meth:`before_call`) and records its outcome. It may also be used
+        around ``await`` expressions in coroutines. """
+        self.before_call()
+        try:
+            yield
+        except NETWORK_ERRORS:
+            self.record_failure()
+            raise
+        except Exception:
+            # The speaker answered, but something else went wrong
+            self.record_success()
+            raise
+        except BaseException:
+            # Cancelled or interrupted, so nothing was learned about the
+            # speaker. Let another request probe it.
+            with self._lock:
+                self._probing = False
+            raise
+        else:
+            self.record_success()
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+""" A persistent cache of music library browse results
+
+Browsing the music library is slow: each page of results is a ``Browse``
+request to a speaker, and a large library can take many of them. The
+results only change when the library is re-indexed, which the speakers
+announce by changing the ``SystemUpdateID`` of their ContentDirectory
+service. The :class:`MusicLibraryCache` saves each page of results in an
+SQLite database, keyed by household, object ID, starting index and count,
+with the ``SystemUpdateID`` current when it was fetched. A page is only
+served while that is still the current ``SystemUpdateID`` of the household,
+so that later runs can browse the library without asking the speakers
+again until the library actually changes.
+
+The current ``SystemUpdateID`` is learned from ContentDirectory events, if
+there is a subscription to them, and otherwise asked for at most once every
+:data:`soco.config.MUSIC_LIBRARY_CACHE_CHECK_INTERVAL` seconds. Both it and
+the household of each speaker are saved in the database too.
+
+The cache is used by :meth:`soco.core.SoCo.get_music_library_information`,
+:meth:`soco.core.SoCo.browse` and :meth:`soco.core.SoCo.browse_by_idstring`
+when :data:`soco.config.MUSIC_LIBRARY_CACHE_ENABLED` is True.
+
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .exceptions import SoCoUPnPException
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+# Change this whenever the schema changes, so that old databases are rebuilt
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pages (
+        household TEXT NOT NULL,
+        object_id TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        system_update_id INTEGER NOT NULL,
+        result TEXT NOT NULL,
+        number_returned INTEGER NOT NULL,
+        total_matches INTEGER NOT NULL,
+        update_id INTEGER NOT NULL,
+        PRIMARY KEY (household, object_id, start, count)
+    );
+    CREATE TABLE IF NOT EXISTS households (
+        household TEXT PRIMARY KEY,
+        system_update_id INTEGER NOT NULL,
+        checked_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS speakers (
+        ip_address TEXT PRIMARY KEY,
+        household TEXT NOT NULL
+    );
+"""
+
+
+def default_cache_path():
+    """ The database file used unless
+    :data:`soco.config.MUSIC_LIBRARY_CACHE_PATH` says otherwise """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'soco', 'library.sqlite')
+
+
+class MusicLibraryCache(object):
+
+    """ A thread-safe cache of music library browse results, saved in an
+    SQLite database. """
+
+    def __init__(self, path=None, check_interval=None):
+        """
+        Args:
+            path (str): The database file. If None,
+                :data:`soco.config.MUSIC_LIBRARY_CACHE_PATH` is used, or if
+                that is None too, :func:`default_cache_path`. ``':memory:'``
+                keeps the cache in memory only.
+            check_interval (float): The number of seconds for which a
+                ``SystemUpdateID`` is trusted without asking a speaker for
+                it again. If None,
+                :data:`soco.config.MUSIC_LIBRARY_CACHE_CHECK_INTERVAL` is
+                used.
+
+        """
+        super(MusicLibraryCache, self).__init__()
+        self._path = path
+        self._check_interval = check_interval
+        self._connection = None
+        self._lock = threading.RLock()
+        # Households by speaker ip address, and (SystemUpdateID, checked_at)
+        # tuples by household, as also saved in the database
+        self._households = {}
+        self._update_ids = {}
+
+    @property
+    def path(self):
+        """ The database file """
+        if self._path is not None:
+            return self._path
+        if config.MUSIC_LIBRARY_CACHE_PATH is not None:
+            return config.MUSIC_LIBRARY_CACHE_PATH
+        return default_cache_path()
+
+    @property
+    def check_interval(self):
+        """ The number of seconds for which a ``SystemUpdateID`` is
+        trusted """
+        if self._check_interval is not None:
+            return self._check_interval
+        return config.MUSIC_LIBRARY_CACHE_CHECK_INTERVAL
+
+    def _connect(self):
+        """ Return the connection to the database, opening it, and creating
+        the tables, if necessary. Must be called with the lock held. """
+        if self._connection is not None:
+            return self._connection
+        path = self.path
+        if path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+        connection = sqlite3.connect(path, timeout=10,
+                                     check_same_thread=False)
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version != _SCHEMA_VERSION:
+                if version:
+                    log.info("Rebuilding music library cache %s", path)
+                with connection:
+                    for table in ('pages', 'households', 'speakers'):
+                        connection.execute(
+                            'DROP TABLE IF EXISTS {0}'.format(table))
+                connection.executescript(_SCHEMA)
+                connection.execute(
+                    'PRAGMA user_version = {0}'.format(_SCHEMA_VERSION))
+        except sqlite3.Error:
+            connection.close()
+            raise
+        self._connection = connection
+        return connection
+
+    def _execute(self, statement, parameters=()):
+        """ Execute an SQL statement in a transaction, and return all the
+        rows it returns """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(statement, parameters).fetchall()
+
+    def household(self, soco, fetch=True):
+        """ Return the household ID of a speaker, or None if it is unknown
+        and `fetch` is False """
+        household = self._households.get(soco.ip_address)
+        if household is not None:
+            return household
+        rows = self._execute(
+            'SELECT household FROM speakers WHERE ip_address = ?',
+            (soco.ip_address,))
+        if rows:
+            household = rows[0][0]
+        elif not fetch:
+            return None
+        else:
+            household = soco.deviceProperties.GetHouseholdID()[
+                'CurrentHouseholdID']
+            self._execute(
+                'INSERT OR REPLACE INTO speakers VALUES (?, ?)',
+                (soco.ip_address, household))
+        self._households[soco.ip_address] = household
+        return household
+
+    def system_update_id(self, soco, household):
+        """ Return the current ``SystemUpdateID`` of a household, asking the
+        speaker `soco` for it if it has not been learned within the check
+        interval """
+        known = self._update_ids.get(household)
+        if known is None:
+            rows = self._execute(
+                'SELECT system_update_id, checked_at FROM households '
+                'WHERE household = ?', (household,))
+            if rows:
+                known = self._update_ids[household] = tuple(rows[0])
+        if known is not None and time.time() - known[1] < self.check_interval:
+            return known[0]
+        update_id = int(soco.contentDirectory.GetSystemUpdateID()['Id'])
+        self.set_system_update_id(household, update_id)
+        return update_id
+
+    def set_system_update_id(self, household, update_id):
+        """ Record the current ``SystemUpdateID`` of a household. Pages
+        fetched under any other value are deleted. """
+        update_id = int(update_id)
+        with self._lock:
+            known = self._update_ids.get(household)
+            self._update_ids[household] = (update_id, time.time())
+            self._execute(
+                'INSERT OR REPLACE INTO households VALUES (?, ?, ?)',
+                (household, update_id, self._update_ids[household][1]))
+            if known is None or known[0] != update_id:
+                deleted = self._execute(
+                    'SELECT COUNT(*) FROM pages WHERE household = ? AND '
+                    'system_update_id != ?', (household, update_id))[0][0]
+                if deleted:
+                    log.info("Music library of %s changed, dropping %s "
+                             "cached pages", household, deleted)
+                    self._execute(
+                        'DELETE FROM pages WHERE household = ? AND '
+                        'system_update_id != ?', (household, update_id))
+
+    def update_from_event(self, soco, update_id):
+        """ Record a ``SystemUpdateID`` reported by a ContentDirectory event
+        from a speaker. Ignored if the household of the speaker is not yet
+        known, since finding out would need a request. """
+        try:
+            household = self.household(soco, fetch=False)
+            if household is not None:
+                self.set_system_update_id(household, update_id)
+        except (sqlite3.Error, OSError, ValueError) as error:
+            log.warning("Could not update music library cache: %s", error)
+
+    def lookup(self, soco, object_id, start, count):
+        """ Return the cached ``Browse`` result for a page, as a
+        (response, metadata) tuple like that returned by
+        :meth:`soco.core.SoCo._music_lib_search`, or None if it is not
+        cached or out of date """
+        try:
+            household = self.household(soco)
+            update_id = self.system_update_id(soco, household)
+            rows = self._execute(
+                'SELECT result, number_returned, total_matches, update_id '
+                'FROM pages WHERE household = ? AND object_id = ? AND '
+                'start = ? AND count = ? AND system_update_id = ?',
+                (household, object_id, start, count, update_id))
+        except (SoCoUPnPException, sqlite3.Error, OSError) as error:
+            log.warning("Could not read music library cache: %s", error)
+            return None
+        if not rows:
+            return None
+        result, number_returned, total_matches, page_update_id = rows[0]
+        response = {
+            'Result': result,
+            'NumberReturned': str(number_returned),
+            'TotalMatches': str(total_matches),
+            'UpdateID': str(page_update_id),
+        }
+        metadata = {
+            'number_returned': number_returned,
+            'total_matches': total_matches,
+            'update_id': page_update_id,
+        }
+        return response, metadata
+
+    def store(self, soco, object_id, start, count, response, metadata):
+        """ Save a page of ``Browse`` results, as returned by
+        :meth:`soco.core.SoCo._music_lib_search` """
+        try:
+            household = self.household(soco)
+            update_id = self.system_update_id(soco, household)
+            self._execute(
+                'INSERT OR REPLACE INTO pages VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (household, object_id, start, count, update_id,
+                 response['Result'], metadata['number_returned'],
+                 metadata['total_matches'], metadata['update_id']))
+        except (SoCoUPnPException, sqlite3.Error, OSError) as error:
+            log.warning("Could not write music library cache: %s", error)
+
+    def clear(self, household=None):
+        """ Delete the cached pages of a household, or of all households """
+        if household is None:
+            self._execute('DELETE FROM pages')
+        else:
+            self._execute('DELETE FROM pages WHERE household = ?',
+                          (household,))
+
+    def close(self):
+        """ Close the database. It is opened again when next needed. """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._households.clear()
+            self._update_ids.clear()
+
+
+#: The cache used by all speakers
+music_library_cache = MusicLibraryCache()  # pylint: disable=invalid-name
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+""" In-process metrics: counters, gauges and latency histograms
+
+SoCo records how long its requests to speakers take, how often they fail, how
+often the cache saves one, and how many are in progress at once. Recording a
+value costs a dict lookup and an addition under a lock, so metrics can be
+left switched on in production. Set :data:`soco.config.METRICS_ENABLED` to
+False to switch them off.
+
+The metrics can be read from Python, with :meth:`MetricsRegistry.collect` or
+:meth:`MetricsRegistry.snapshot`, or exported in the Prometheus text format,
+with :meth:`MetricsRegistry.exposition`. :func:`start_http_server` serves
+them for Prometheus to scrape::
+
+    >>> from soco import metrics
+    >>> server = metrics.start_http_server(8000)
+    >>> # Now see http://localhost:8000/metrics
+
+These metrics are recorded:
+
+``soco_request_duration_seconds`` (histogram: speaker, service, action)
+    The time taken by SOAP requests to speakers, including their responses.
+``soco_request_errors_total`` (counter: speaker, service, action, error)
+    The SOAP requests which failed, by the name of the exception raised.
+``soco_cache_hits_total`` (counter: speaker, service, action)
+    The commands which were answered from the cache.
+``soco_requests_in_flight`` (gauge: speaker)
+    The SOAP requests currently waiting for a response.
+``soco_operation_duration_seconds`` (histogram: speaker, operation)
+    The time taken by higher level operations of :class:`soco.core.SoCo`,
+    such as ``get_queue`` or ``play_from_queue``, which may each make
+    several requests.
+``soco_event_duplicates_total`` (counter: service)
+    The events dropped because one with the same or a later sequence number
+    had already been received for the subscription.
+``soco_event_gaps_total`` (counter: service)
+    The gaps in the sequence numbers of the events received for a
+    subscription, each of which means that events were lost.
+``soco_events_overflowed_total`` (counter: service, policy)
+    The events dropped or coalesced because the queue for their
+    subscription was full.
+``soco_subscription_renewals_total`` (counter: service, result)
+    The renewals of subscriptions made by
+    :class:`soco.subscriptions.SubscriptionManager`, by whether they
+    succeeded (``ok``) or failed (``error``).
+``soco_event_parse_duration_seconds`` (histogram: service)
+    The time taken to parse the body of each event received.
+``soco_event_dispatch_duration_seconds`` (histogram: service)
+    The time taken to update caches from each event, and queue it for the
+    callbacks of its subscription.
+
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from .compat import (
+    monotonic, BaseHTTPRequestHandler, HTTPServer, socketserver)
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+#: The default upper bounds, in seconds, of histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+#: Bucket bounds, in seconds, for work done locally, which takes much less
+#: time than a request
+LOCAL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                 0.05, 0.1)
+
+
+def _format_value(value):
+    """ Format a sample value as Prometheus expects """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '{0:.1f}'.format(value)
+    return '{0}'.format(value)
+
+
+def _escape_label(value):
+    """ Escape a label value for the Prometheus text format """
+    if isinstance(value, (int, float)):
+        return _format_value(value)
+    return ('{0}'.format(value).replace('\\', r'\\')
+            .replace('\n', r'\n').replace('"', r'\"'))
+
+
+def _format_labels(names, values):
+    """ Format label names and values as {name="value",...} """
+    if not names:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(name, _escape_label(value))
+        for name, value in zip(names, values)) + '}'
+
+
+class Metric(object):
+
+    """ The base class for a family of metrics with the same name, and one
+    value for each combination of label values. """
+
+    #: The Prometheus type of the metric
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Args:
+            name (str): The name of the metric, eg
+                ``soco_request_errors_total``
+            documentation (str): A description of the metric
+            labelnames (tuple): The names of its labels
+
+        """
+        super(Metric, self).__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.name)
+
+    def _check(self, labels):
+        """ Check that the right number of label values is given """
+        if len(labels) != len(self.labelnames):
+            raise ValueError('{0} expects labels {1}'.format(
+                self.name, ', '.join(self.labelnames)))
+
+    def samples(self):
+        """ Return a list of (suffix, label names, label values, value)
+        tuples, one for each value of the metric """
+        with self._lock:
+            return [('', self.labelnames, labels, value)
+                    for labels, value in sorted(self._values.items())]
+
+    def get(self, *labels):
+        """ Return the current value for the given label values """
+        with self._lock:
+            return self._values.get(tuple(labels), 0)
+
+    def clear(self):
+        """ Forget all values """
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+
+    """ A value which only goes up """
+
+    kind = 'counter'
+
+    def inc(self, *labels, **kwargs):
+        """ Increase the value for the given label values by `amount`
+        (default 1) """
+        amount = kwargs.get('amount', 1)
+        if amount < 0:
+            raise ValueError('Counters can only be increased')
+        if not config.METRICS_ENABLED:
+            return
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+
+    """ A value which can go up and down """
+
+    kind = 'gauge'
+
+    def inc(self, *labels, **kwargs):
+        """ Increase the value for the given label values by `amount`
+        (default 1) """
+        if not config.METRICS_ENABLED:
+            return
+        self._check(labels)
+        amount = kwargs.get('amount', 1)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, **kwargs):
+        """ Decrease the value for the given label values by `amount`
+        (default 1) """
+        self.inc(*labels, amount=-kwargs.get('amount', 1))
+
+    def set(self, value, *labels):
+        """ Set the value for the given label values """
+        if not config.METRICS_ENABLED:
+            return
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+
+    """ The distribution of observed values, such as latencies, in buckets
+
+    For each combination of label values, the count of observations in each
+    bucket, their total count and their sum are kept.
+
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        #: The upper bounds of the buckets, in increasing order
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS))
+
+    def observe(self, value, *labels):
+        """ Record an observed value for the given label values """
+        if not config.METRICS_ENABLED:
+            return
+        self._check(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Counts for each bucket, then one for +Inf, then the sum
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """ A context manager which observes the time its body takes, in
+        seconds """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - start, *labels)
+
+    def get(self, *labels):
+        """ Return a (count, sum) tuple for the given label values """
+        with self._lock:
+            state = self._values.get(tuple(labels))
+            if state is None:
+                return (0, 0)
+            return (sum(state[:-1]), state[-1])
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(state))
+                            for labels, state in self._values.items())
+        names = self.labelnames + ('le',)
+        result = []
+        for labels, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                result.append(('_bucket', names, labels + (bound,),
+                               cumulative))
+            result.append(('_count', self.labelnames, labels, cumulative))
+            result.append(('_sum', self.labelnames, labels, state[-1]))
+        return result
+
+
+class MetricsRegistry(object):
+
+    """ A collection of metrics, which can be read or exported together """
+
+    def __init__(self):
+        super(MetricsRegistry, self).__init__()
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """ Add a metric to the registry, and return it """
+        with self._lock:
+            if any(existing.name == metric.name
+                   for existing in self._metrics):
+                raise ValueError(
+                    'A metric called {0} already exists'.format(metric.name))
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """ Create and register a :class:`Counter` """
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        """ Create and register a :class:`Gauge` """
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=None):
+        """ Create and register a :class:`Histogram` """
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self):
+        """ Return a list of the registered metrics """
+        with self._lock:
+            return list(self._metrics)
+
+    def snapshot(self):
+        """ Return the current values of all metrics, as a dict mapping
+        sample names (including labels, as in the Prometheus format) to
+        values """
+        result = {}
+        for metric in self.collect():
+            for suffix, names, labels, value in metric.samples():
+                result[metric.name + suffix +
+                       _format_labels(names, labels)] = value
+        return result
+
+    def exposition(self):
+        """ Return all metrics in the Prometheus text format (version
+        0.0.4) """
+        lines = []
+        for metric in self.collect():
+            lines.append('# HELP {0} {1}'.format(
+                metric.name, metric.documentation.replace('\n', ' ')))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            for suffix, names, labels, value in metric.samples():
+                lines.append('{0}{1}{2} {3}'.format(
+                    metric.name, suffix, _format_labels(names, labels),
+                    _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """ Reset all metrics """
+        for metric in self.collect():
+            metric.clear()
+
+
+#: The registry holding SoCo's own metrics
+registry = MetricsRegistry()  # pylint: disable=invalid-name
+
+request_duration = registry.histogram(  # pylint: disable=invalid-name
+    'soco_request_duration_seconds',
+    'Time taken by SOAP requests to speakers',
+    ('speaker', 'service', 'action'))
+request_errors = registry.counter(  # pylint: disable=invalid-name
+    'soco_request_errors_total',
+    'SOAP requests to speakers which failed',
+    ('speaker', 'service', 'action', 'error'))
+cache_hits = registry.counter(  # pylint: disable=invalid-name
+    'soco_cache_hits_total',
+    'Commands answered from the cache',
+    ('speaker', 'service', 'action'))
+requests_in_flight = registry.gauge(  # pylint: disable=invalid-name
+    'soco_requests_in_flight',
+    'SOAP requests waiting for a response',
+    ('speaker',))
+operation_duration = registry.histogram(  # pylint: disable=invalid-name
+    'soco_operation_duration_seconds',
+    'Time taken by higher level SoCo operations',
+    ('speaker', 'operation'))
+
+event_duplicates = registry.counter(  # pylint: disable=invalid-name
+    'soco_event_duplicates_total',
+    'Duplicate or out of date events dropped',
+    ('service',))
+event_gaps = registry.counter(  # pylint: disable=invalid-name
+    'soco_event_gaps_total',
+    'Gaps in the sequence of events received',
+    ('service',))
+events_overflowed = registry.counter(  # pylint: disable=invalid-name
+    'soco_events_overflowed_total',
+    'Events dropped or coalesced because a subscription queue was full',
+    ('service', 'policy'))
+subscription_renewals = registry.counter(  # pylint: disable=invalid-name
+    'soco_subscription_renewals_total',
+    'Renewals of managed subscriptions',
+    ('service', 'result'))
+event_parse_duration = registry.histogram(  # pylint: disable=invalid-name
+    'soco_event_parse_duration_seconds',
+    'Time taken to parse the body of each event',
+    ('service',), buckets=LOCAL_BUCKETS)
+event_dispatch_duration = registry.histogram(  # pylint: disable=invalid-name
+    'soco_event_dispatch_duration_seconds',
+    'Time taken to update caches from each event and queue it for delivery',
+    ('service',), buckets=LOCAL_BUCKETS)
+
+
+@contextmanager
+def track_request(speaker, service, action):
+    """ A context manager around a SOAP request, which records its duration,
+    and whether it failed, and counts it as in flight while it runs. It may
+    also be used around ``await`` expressions in coroutines. """
+    requests_in_flight.inc(speaker)
+    start = monotonic()
+    try:
+        yield
+    except Exception as error:
+        request_errors.inc(speaker, service, action, type(error).__name__)
+        raise
+    finally:
+        requests_in_flight.dec(speaker)
+        request_duration.observe(monotonic() - start, speaker, service,
+                                 action)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    """ An HTTP request handler which serves the metrics of a registry in
+    the Prometheus text format, on any path. """
+
+    #: The registry to serve. Override in a subclass to serve another one.
+    registry = registry
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Serve the metrics """
+        body = self.registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):  # pylint: disable=arguments-differ
+        log.debug("%s - %s", self.address_string(), fmt % args)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    """ An HTTP server with a thread for each request """
+
+    daemon_threads = True
+
+
+def start_http_server(port, address=''):
+    """ Serve the metrics over HTTP, for Prometheus to scrape, from a daemon
+    thread.
+
+    Args:
+        port (int): The port to listen on. 0 picks a free one.
+        address (str): The address to listen on. '' means all.
+
+    Returns:
+        The server. Its ``server_address`` attribute gives the address and
+        port actually used, and ``shutdown()`` stops it.
+
+    """
+    server = _ThreadingHTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='soco-metrics')
+    thread.daemon = True
+    thread.start()
+    log.info("Serving metrics on port %s", server.server_address[1])
+    return server
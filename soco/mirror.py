@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+""" A local mirror of the state of speakers, kept up to date by events
+
+Reading the volume or the current track of a speaker is a SOAP request, even
+though the speaker reports every change to them in UPnP events. A
+:class:`StateMirror` subscribes to the AVTransport, RenderingControl,
+ContentDirectory and ZoneGroupTopology services of each speaker added to it,
+and keeps the state which their events report in memory, so that it can be
+read without any network requests::
+
+    mirror = StateMirror(loop, event_server)
+    await mirror.add(speaker)
+    ...
+    mirror.volume(speaker)
+    mirror.get_current_track_info(speaker)
+
+Speakers send their whole evented state when a subscription starts, and
+then only what changes. The mirror keeps four sections for each speaker:
+``'transport'`` and ``'rendering'`` hold the variables of AVTransport and
+RenderingControl events, ``'queue'`` the update ID of the queue, from
+ContentDirectory events, and ``'topology'`` the zone group state. Each
+event is applied to its section as a whole, under a lock, so readers in
+other threads never see half of one. If events are lost, the event server
+fetches the state afresh (see :meth:`soco.events.SonosEventServer.resync`),
+and the mirror applies that like any other event. So it only polls the
+speakers after a gap. If what is fetched leaves out the update ID of the
+queue, that becomes unknown (None), rather than stale.
+
+Functions added with :meth:`StateMirror.add_listener` are called with the
+variables which changed, whenever an event changes a section.
+
+Subscriptions are made, and renewed, by a
+:class:`soco.subscriptions.SubscriptionManager`.
+
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import copy
+import functools
+import logging
+import threading
+
+from .parser import EventVariables
+from .subscriptions import SubscriptionManager
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+#: The services subscribed to for each speaker, as (SoCo attribute, section)
+#: tuples
+MIRRORED_SERVICES = (
+    ('avTransport', 'transport'),
+    ('renderingControl', 'rendering'),
+    ('contentDirectory', 'queue'),
+    ('zoneGroupTopology', 'topology'),
+)
+
+# Variables added to events by the event server, which are not state
+_EVENT_FIELDS = ('sid', 'seq', 'resync')
+
+# The id of the queue in ContainerUpdateIDs
+_QUEUE_ID = 'Q:0'
+
+
+def _raw_values(variables):
+    """ Return the values of event variables, as received, in a dict """
+    result = {}
+    for name in variables:
+        if name in _EVENT_FIELDS:
+            continue
+        if isinstance(variables, EventVariables):
+            result[name] = variables.raw(name)
+        else:
+            result[name] = variables[name]
+    return result
+
+
+def _queue_variables(variables):
+    """ Pick the update ID of the queue out of the ContainerUpdateIDs of a
+    ContentDirectory event, which looks like ``'Q:0,12,S:,3'``, or out of
+    the state fetched again after a gap (see
+    :attr:`soco.services.ContentDirectory.RESYNC_GETTERS`). If that state
+    does not include it, the update ID is no longer known. """
+    if variables.get('resync'):
+        if 'queue_update_id' in variables:
+            return {'update_id': variables.raw('queue_update_id')
+                    if isinstance(variables, EventVariables)
+                    else variables['queue_update_id']}
+        return {'update_id': None}
+    container_update_ids = variables.get('container_update_i_ds')
+    if not container_update_ids:
+        return {}
+    parts = container_update_ids.split(',')
+    for container, update_id in zip(parts[::2], parts[1::2]):
+        if container == _QUEUE_ID:
+            return {'update_id': update_id}
+    return {}
+
+
+class SpeakerState(object):
+
+    """ The mirrored state of one speaker. Each section is a dict of the
+    values of its variables, as received. """
+
+    def __init__(self, soco):
+        super(SpeakerState, self).__init__()
+        #: The :class:`soco.core.SoCo` instance
+        self.soco = soco
+        self.transport = {}
+        self.rendering = {}
+        self.queue = {}
+        self.topology = {}
+        #: The subscriptions which keep this state up to date
+        self.subscriptions = []
+
+    def section(self, name):
+        """ Return the dict for a section """
+        return getattr(self, name)
+
+
+class StateMirror(object):
+
+    """ Mirrors the state of speakers, from their events. Reads never make
+    network requests. """
+
+    def __init__(self, loop, event_server, manager=None):
+        """
+        Args:
+            loop: The event loop on which subscriptions are made, and events
+                received.
+            event_server (soco.events.SonosEventServer): The server which
+                receives the events.
+            manager (soco.subscriptions.SubscriptionManager): The manager
+                through which to subscribe. If None, the mirror makes its
+                own, and closes it in :meth:`close`.
+
+        """
+        super(StateMirror, self).__init__()
+        self.loop = loop
+        self._own_manager = manager is None
+        if manager is None:
+            manager = SubscriptionManager(loop, event_server)
+        self.manager = manager
+        self._states = {}
+        self._listeners = []
+        # Held while an event is applied, and while state is read
+        self._lock = threading.Lock()
+        # Groups parsed from the zone group state, by speaker, with the
+        # zone group state they were parsed from
+        self._groups = {}
+
+    async def add(self, soco, requested_timeout=None):
+        """ Start mirroring a speaker, by subscribing to its services. Does
+        nothing if it is already mirrored. """
+        if soco in self._states:
+            return
+        state = self._states[soco] = SpeakerState(soco)
+        results = await asyncio.gather(*[
+            self.manager.subscribe(
+                getattr(soco, attribute),
+                functools.partial(self._on_event, state, section),
+                requested_timeout=requested_timeout, auto_renew=True)
+            for attribute, section in MIRRORED_SERVICES],
+            return_exceptions=True)
+        for result in results:
+            if not isinstance(result, Exception):
+                state.subscriptions.append(result)
+        for result in results:
+            if isinstance(result, Exception):
+                await self.remove(soco)
+                raise result
+
+    async def remove(self, soco):
+        """ Stop mirroring a speaker, and unsubscribe from its services """
+        with self._lock:
+            state = self._states.pop(soco, None)
+            self._groups.pop(soco, None)
+        if state is None:
+            return
+        for subscription in state.subscriptions:
+            try:
+                await self.manager.unsubscribe(subscription)
+            except Exception as error:  # pylint: disable=broad-except
+                log.warning("Could not unsubscribe %s: %s",
+                            subscription.sid, error)
+
+    async def close(self):
+        """ Stop mirroring all speakers """
+        for soco in list(self._states):
+            await self.remove(soco)
+        if self._own_manager:
+            await self.manager.close()
+
+    def add_listener(self, callback):
+        """ Call `callback` whenever an event changes the state of a speaker.
+
+        It is called on the event loop, with the :class:`soco.core.SoCo`
+        instance, the name of the section, and a dict of the variables which
+        changed, by name, with their new values as received.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """ Stop calling a function added with :meth:`add_listener` """
+        self._listeners.remove(callback)
+
+    async def _on_event(self, state, section, event):
+        """ Apply an event to a section of the state of a speaker """
+        variables = event.variables
+        if section == 'queue':
+            values = _queue_variables(variables)
+        else:
+            values = _raw_values(variables)
+        changes = {}
+        with self._lock:
+            if self._states.get(state.soco) is not state:
+                # No longer mirrored
+                return
+            current = state.section(section)
+            for name, value in values.items():
+                if isinstance(value, dict) and isinstance(
+                        current.get(name), dict):
+                    # Only some channels may be reported
+                    value = dict(current[name], **value)
+                if current.get(name) != value:
+                    current[name] = changes[name] = value
+        if not changes:
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(state.soco, section, changes)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Exception in state mirror listener")
+
+    def _section(self, soco, section):
+        """ Return a copy of a section of the state of a speaker, as
+        :class:`soco.parser.EventVariables`, which convert the values to
+        their types """
+        with self._lock:
+            try:
+                state = self._states[soco]
+            except KeyError:
+                raise ValueError("{0} is not mirrored".format(soco))
+            return EventVariables(copy.deepcopy(state.section(section)))
+
+    def snapshot(self, soco):
+        """ Return a copy of all the mirrored state of a speaker, as a dict
+        of :class:`soco.parser.EventVariables` by section """
+        return dict((section, self._section(soco, section))
+                    for _, section in MIRRORED_SERVICES)
+
+    def volume(self, soco, channel='Master'):
+        """ The volume of a speaker, as an int, or None if not yet known """
+        return self._section(soco, 'rendering').get('volume', {}).get(channel)
+
+    def mute(self, soco, channel='Master'):
+        """ Whether a speaker is muted, or None if not yet known """
+        return self._section(soco, 'rendering').get('mute', {}).get(channel)
+
+    def queue_update_id(self, soco):
+        """ The update ID of the queue of a speaker, as an int, which
+        changes whenever the queue does, or None if not known """
+        return self._section(soco, 'queue').get('update_id')
+
+    def get_current_transport_info(self, soco):
+        """ The playback state of a speaker, as returned by
+        :meth:`soco.core.SoCo.get_current_transport_info` """
+        transport = self._section(soco, 'transport')
+        # pylint: disable=protected-access
+        return soco._parse_transport_info({
+            'CurrentTransportState': transport.raw('transport_state')
+            if 'transport_state' in transport else '',
+            'CurrentTransportStatus': transport.raw('transport_status')
+            if 'transport_status' in transport else '',
+            'CurrentSpeed': transport.raw('transport_play_speed')
+            if 'transport_play_speed' in transport else '',
+        })
+
+    def get_current_track_info(self, soco):
+        """ The currently playing track of a speaker, as returned by
+        :meth:`soco.core.SoCo.get_current_track_info`, except that the
+        position is always '', since events do not report it """
+        transport = self._section(soco, 'transport')
+
+        def raw(name):
+            """ The value of a variable as received, or '' """
+            return transport.raw(name) if name in transport else ''
+
+        # pylint: disable=protected-access
+        return soco._parse_track_info({
+            'Track': raw('current_track'),
+            'TrackDuration': raw('current_track_duration'),
+            'TrackURI': raw('current_track_uri'),
+            'TrackMetaData': raw('current_track_meta_data'),
+            'RelTime': '',
+        })
+
+    def group(self, soco):
+        """ The :class:`soco.groups.ZoneGroup` of which a speaker is a
+        member, from the mirrored zone group state, or None if that is not
+        yet known or the speaker is in no group.
+
+        The members of the group look up their names from the zone group
+        state too, which events have already put in the shared cache.
+        """
+        with self._lock:
+            try:
+                state = self._states[soco]
+            except KeyError:
+                raise ValueError("{0} is not mirrored".format(soco))
+            zone_group_state = state.topology.get('zone_group_state')
+            if not zone_group_state:
+                return None
+            # pylint: disable=protected-access
+            parsed = self._groups.get(soco)
+            if parsed is None or parsed[0] != zone_group_state:
+                soco._update_zone_group_state(zone_group_state)
+                parsed = self._groups[soco] = (zone_group_state, soco._groups)
+        for group in parsed[1]:
+            if soco in group:
+                return group
+        return None
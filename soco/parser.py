@@ -1,3 +1,6 @@
+from collections.abc import MutableMapping
+import threading
+
 from .exceptions import DIDLMetadataError
 from .data_structures import from_didl_string
 from .utils import camel_to_underscore
@@ -84,6 +87,247 @@ def parse_event_xml(xml_event):
         result[camel_to_underscore(variable.tag)] = variable.text
   return result
 
+# The tags of evented variables, and their names in parsed events. Tags
+# which are not listed are translated with camel_to_underscore the first time
+# they are seen, and added.
+TAG_NAMES = dict((tag, camel_to_underscore(tag)) for tag in (
+    # RenderingControl
+    'Volume', 'Mute', 'Bass', 'Treble', 'Loudness', 'OutputFixed',
+    'HeadphoneConnected', 'SpeakerSize', 'SubGain', 'SubEnabled',
+    'SubPolarity', 'SubCrossover', 'NightMode', 'DialogLevel',
+    'PresetNameList', 'SupportsOutputFixed',
+    # AVTransport
+    'TransportState', 'CurrentPlayMode', 'CurrentCrossfadeMode',
+    'NumberOfTracks', 'CurrentTrack', 'CurrentSection', 'CurrentTrackURI',
+    'CurrentTrackDuration', 'CurrentTrackMetaData', 'NextTrackURI',
+    'NextTrackMetaData', 'EnqueuedTransportURI',
+    'EnqueuedTransportURIMetaData', 'PlaybackStorageMedium',
+    'AVTransportURI', 'AVTransportURIMetaData', 'NextAVTransportURI',
+    'NextAVTransportURIMetaData', 'CurrentTransportActions',
+    'CurrentValidPlayModes', 'TransportStatus', 'SleepTimerGeneration',
+    'AlarmRunning', 'SnoozeRunning', 'RestartPending',
+    'TransportPlaySpeed', 'CurrentMediaDuration', 'RecordStorageMedium',
+    'PossiblePlaybackStorageMedia', 'PossibleRecordStorageMedia',
+    'RecordMediumWriteStatus', 'CurrentRecordQualityMode',
+    'PossibleRecordQualityModes',
+    # ZoneGroupTopology
+    'ZoneGroupState', 'ThirdPartyMediaServersX', 'AvailableSoftwareUpdate',
+    'AlarmRunSequence', 'ZoneGroupName', 'ZoneGroupID',
+    'ZonePlayerUUIDsInGroup',
+    # ContentDirectory
+    'SystemUpdateID', 'ContainerUpdateIDs', 'ShareIndexInProgress',
+    'ShareIndexLastError', 'UserRadioUpdateID', 'SavedQueuesUpdateID',
+    'ShareListUpdateID', 'RecentlyPlayedUpdateID', 'FavoritesUpdateID',
+    'RadioFavoritesUpdateID', 'RadioLocationUpdateID',
+    # Queue
+    'UpdateID', 'Curated',
+))
+
+# Translations of full tags, including any namespace, as they are met
+_tag_names = {}
+# The number of full tags to remember, so that a misbehaving sender cannot
+# make the table grow without limit
+_TAG_NAMES_LIMIT = 1000
+
+
+def _tag_name(tag):
+  """ The name in parsed events of the variable with XML tag `tag` """
+  name = _tag_names.get(tag)
+  if name is None:
+    local = tag.rsplit('}', 1)[-1]
+    name = TAG_NAMES.get(local)
+    if name is None:
+      name = camel_to_underscore(local)
+    if len(_tag_names) < _TAG_NAMES_LIMIT:
+      _tag_names[tag] = name
+  return name
+
+
+def _to_bool(value):
+  """ Convert a flag, such as '1' or 'True', to a bool """
+  return value == '1' or value.lower() == 'true'
+
+
+# The types of variables whose values are not strings, by name
+VALUE_TYPES = {
+    'volume': int,
+    'bass': int,
+    'treble': int,
+    'sub_gain': int,
+    'mute': _to_bool,
+    'loudness': _to_bool,
+    'output_fixed': _to_bool,
+    'headphone_connected': _to_bool,
+    'night_mode': _to_bool,
+    'dialog_level': _to_bool,
+    'current_crossfade_mode': _to_bool,
+    'number_of_tracks': int,
+    'current_track': int,
+    'current_section': int,
+    'system_update_id': int,
+    'update_id': int,
+}
+
+
+def _convert(name, value):
+  """ Convert the raw value of a variable to its type """
+  if isinstance(value, dict):
+    return dict((channel, _convert(name, channel_value))
+                for channel, channel_value in value.items())
+  if not isinstance(value, str):
+    return value
+  if value.startswith('<DIDL-Lite'):
+    try:
+      return from_didl_string(value)[0]
+    except DIDLMetadataError:
+      # If sonos adds a field that we haven't registered don't hose us
+      return value
+  convert = VALUE_TYPES.get(name)
+  if convert is None:
+    return value
+  try:
+    return convert(value)
+  except ValueError:
+    # eg 'NOT_IMPLEMENTED'
+    return value
+
+
+# Held while the LastChange XML of any event is parsed
+_last_change_lock = threading.Lock()
+
+
+def _parse_last_change(text, raw):
+  """ Add the variables in the LastChange XML `text` to the dict `raw` """
+  last_change = XML.fromstring(text.encode('utf-8'))
+  # The LastChange XML holds a single InstanceID (or, for the Queue
+  # service, QueueID) element, whatever its namespace
+  for instance in last_change:
+    for last_change_var in instance:
+      name = _tag_name(last_change_var.tag)
+      value = last_change_var.get('val')
+      if value is None:
+        value = last_change_var.text or ''
+      channel = last_change_var.get('channel')
+      if channel is None:
+        raw[name] = value
+      else:
+        raw.setdefault(name, {})[channel] = value
+    break
+
+
+class EventVariables(MutableMapping):
+  """ The variables reported by one event, by name. Only the variables
+  which changed are reported.
+
+  The LastChange XML, in which RenderingControl and AVTransport events
+  report their variables, is only parsed when a variable is first looked
+  up (or the variables are listed), and values are converted to their types
+  when each is first looked up, and not before. So an event which nobody
+  reads costs no more than parsing its outer XML. Volumes and other levels,
+  including the values for each channel, are ints, flags are bools, and
+  DIDL metadata is a :class:`~soco.data_structures.DidlObject`. The value
+  as received can still be had with :meth:`raw`.
+  """
+
+  def __init__(self, raw=None, last_change=None):
+    self._raw = raw if raw is not None else {}
+    self._values = {}
+    # The text of LastChange variables which have not been parsed yet
+    self._last_change = last_change or None
+
+  def _expand(self):
+    """ Parse any LastChange XML not yet parsed. Variables already present,
+    such as those set by the event server, are kept. """
+    if self._last_change is None:
+      return
+    with _last_change_lock:
+      if self._last_change is None:
+        return
+      parsed = {}
+      for text in self._last_change:
+        _parse_last_change(text, parsed)
+      for name, value in parsed.items():
+        self._raw.setdefault(name, value)
+      self._last_change = None
+
+  def __getitem__(self, name):
+    try:
+      return self._values[name]
+    except KeyError:
+      pass
+    self._expand()
+    value = self._values[name] = _convert(name, self._raw[name])
+    return value
+
+  def __setitem__(self, name, value):
+    self._raw[name] = value
+    self._values[name] = value
+
+  def __delitem__(self, name):
+    self._expand()
+    del self._raw[name]
+    self._values.pop(name, None)
+
+  def __iter__(self):
+    self._expand()
+    return iter(self._raw)
+
+  def __len__(self):
+    self._expand()
+    return len(self._raw)
+
+  def __contains__(self, name):
+    if name in self._raw:
+      return True
+    self._expand()
+    return name in self._raw
+
+  def __repr__(self):
+    self._expand()
+    return '<EventVariables {0}>'.format(sorted(self._raw))
+
+  def raw(self, name):
+    """ The value of a variable as it was received, as a string, or a dict
+    of strings by channel """
+    self._expand()
+    return self._raw[name]
+
+  def merge(self, other):
+    """ Add the variables of a later event, `other`, replacing any with the
+    same names """
+    self._expand()
+    other._expand()
+    for name, value in other._raw.items():
+      self._raw[name] = value
+      if name in other._values:
+        self._values[name] = other._values[name]
+      else:
+        self._values.pop(name, None)
+
+
+def parse_event(xml_event):
+  """ Parse the body of a UPnP event into :class:`EventVariables`
+
+  This does the same job as :func:`parse_event_xml`, but only parses the
+  outer XML straight away. Any LastChange XML is parsed when a variable is
+  first looked up, and the values are converted, and given their types,
+  when each is used.
+
+  Arg:
+      xml_event (bytes): the body of the event
+  """
+  raw = {}
+  last_change = []
+  tree = XML.fromstring(xml_event)
+  for prop in tree:
+    for variable in prop:
+      if variable.tag == 'LastChange':
+        last_change.append(variable.text)
+      else:
+        raw[_tag_name(variable.tag)] = variable.text
+  return EventVariables(raw, last_change)
+
+
 def parse_zone_group_state(xml_group_state):
   """ The Zone Group State contains a lot of useful information. Retrieve
   and parse it, and populate the relevant properties. """
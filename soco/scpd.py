@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+""" A registry of UPnP service descriptions
+
+Each UPnP service publishes a Service Control Protocol Description (SCPD),
+an XML document listing its actions, their arguments and the types of its
+state variables. The description depends only on the model of the speaker
+and the version of its firmware, so it need only be downloaded and parsed
+once for each of them. The :class:`ScpdRegistry` keeps parsed descriptions in
+memory, and saves them as JSON files in :data:`soco.config.SCPD_CACHE_DIR`,
+so that later runs do not need to download them at all.
+
+Once the description of a service is known, :class:`soco.services.Service`
+uses it to check the actions and arguments of commands before they are sent,
+and to put the arguments in the order the speaker expects.
+
+"""
+
+from __future__ import unicode_literals
+
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import namedtuple, OrderedDict
+
+from .xml import XML
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+Action = namedtuple('Action', 'name, in_args, out_args')
+Argument = namedtuple('Argument', 'name, vartype')
+StateVariable = namedtuple('StateVariable', 'name, vartype, send_events')
+
+# The version of the format of the files saved on disk. Change it whenever
+# ServiceDescription.to_dict changes, so that old files are ignored.
+_FORMAT_VERSION = 1
+
+_NS = '{urn:schemas-upnp-org:service-1-0}'
+
+
+class ServiceDescription(object):
+
+    """ The parsed description of a UPnP service. """
+
+    def __init__(self, actions, state_variables):
+        """
+        Args:
+            actions (list): The :class:`Action` namedtuples of the service
+            state_variables (list): Its :class:`StateVariable` namedtuples
+
+        """
+        super(ServiceDescription, self).__init__()
+        #: An OrderedDict of :class:`Action` namedtuples, by action name
+        self.actions = OrderedDict((action.name, action)
+                                   for action in actions)
+        #: An OrderedDict of :class:`StateVariable` namedtuples, by name
+        self.state_variables = OrderedDict((var.name, var)
+                                           for var in state_variables)
+
+    @classmethod
+    def from_xml(cls, scpd_body):
+        """ Parse a service description from the SCPD XML, as bytes """
+        # pylint: disable=invalid-name
+        tree = XML.fromstring(scpd_body)
+        state_variables = []
+        for state in tree.iterfind(
+                '{0}serviceStateTable/{0}stateVariable'.format(_NS)):
+            state_variables.append(StateVariable(
+                state.findtext('{0}name'.format(_NS)),
+                state.findtext('{0}dataType'.format(_NS)),
+                state.get('sendEvents') == 'yes'))
+        vartypes = dict((var.name, var.vartype) for var in state_variables)
+        actions = []
+        for action in tree.iterfind(
+                '{0}actionList/{0}action'.format(_NS)):
+            in_args = []
+            out_args = []
+            for arg in action.iterfind(
+                    '{0}argumentList/{0}argument'.format(_NS)):
+                argument = Argument(
+                    arg.findtext('{0}name'.format(_NS)),
+                    vartypes.get(arg.findtext(
+                        '{0}relatedStateVariable'.format(_NS))))
+                if arg.findtext('{0}direction'.format(_NS)) == 'in':
+                    in_args.append(argument)
+                else:
+                    out_args.append(argument)
+            actions.append(Action(
+                action.findtext('{0}name'.format(_NS)), in_args, out_args))
+        return cls(actions, state_variables)
+
+    def to_dict(self):
+        """ Return the description as a dict which can be saved as JSON """
+        return {
+            'actions': [
+                [action.name,
+                 [list(arg) for arg in action.in_args],
+                 [list(arg) for arg in action.out_args]]
+                for action in self.actions.values()],
+            'state_variables': [
+                list(var) for var in self.state_variables.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Create a description from a dict returned by :meth:`to_dict` """
+        return cls(
+            [Action(name, [Argument(*arg) for arg in in_args],
+                    [Argument(*arg) for arg in out_args])
+             for name, in_args, out_args in data['actions']],
+            [StateVariable(*var) for var in data['state_variables']])
+
+    def event_vars(self):
+        """ Return a list of (variable name, data type) tuples for the
+        variables which are evented """
+        return [(var.name, var.vartype)
+                for var in self.state_variables.values() if var.send_events]
+
+    def normalize_arguments(self, action, args):
+        """ Check the arguments of an action against the description, and
+        return them in the order in which the action declares them.
+        Arguments which the action does not declare are passed through,
+        after the others, since speakers ignore them, and some firmware
+        versions expect them (eg the ``Speed`` argument of ``Pause``).
+
+        Args:
+            action (str): The name of the action
+            args (list): A list of (name, value) tuples, or None
+
+        Returns:
+            list: the (name, value) tuples, reordered if necessary
+
+        Raises:
+            ValueError: if the action is unknown, or an argument is missing
+                or repeated.
+
+        """
+        try:
+            in_args = self.actions[action].in_args
+        except KeyError:
+            raise ValueError("Unknown action: {0}".format(action))
+        names = [name for name, _ in args] if args else []
+        expected = [arg.name for arg in in_args]
+        if names == expected:
+            # Return them untouched, so that None stays None in cache keys
+            return args
+        args = list(args) if args else []
+        missing = set(expected) - set(names)
+        if missing:
+            raise ValueError("{0} requires {1}".format(
+                action, ', '.join(sorted(missing))))
+        if len(set(names)) != len(names):
+            raise ValueError("Repeated argument for {0}".format(action))
+        declared = set(expected)
+        extra = [(name, value) for name, value in args
+                 if name not in declared]
+        if extra:
+            log.debug("%s does not declare %s, passing it on anyway",
+                      action, ', '.join(name for name, _ in extra))
+        values = dict(args)
+        return [(name, values[name]) for name in expected] + extra
+
+
+def default_cache_dir():
+    """ The directory in which descriptions are saved, unless
+    :data:`soco.config.SCPD_CACHE_DIR` says otherwise """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'soco', 'scpd')
+
+
+def _safe_name(text):
+    """ Make `text` safe for use as a file name """
+    return re.sub(r'[^\w.-]', '_', text)
+
+
+class ScpdRegistry(object):
+
+    """ A thread-safe registry of service descriptions, keyed by model,
+    firmware version and SCPD url. """
+
+    def __init__(self, cache_dir=None):
+        """
+        Args:
+            cache_dir (str): The directory in which descriptions are saved.
+                If None, :data:`soco.config.SCPD_CACHE_DIR` is used, or if
+                that is None too, :func:`default_cache_dir`. An empty string
+                means that descriptions are kept in memory only.
+
+        """
+        super(ScpdRegistry, self).__init__()
+        self._cache_dir = cache_dir
+        self._descriptions = {}
+        # Keys which are known not to be saved on disk
+        self._not_saved = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cache_dir(self):
+        """ The directory in which descriptions are saved, or '' """
+        if self._cache_dir is not None:
+            return self._cache_dir
+        if config.SCPD_CACHE_DIR is not None:
+            return config.SCPD_CACHE_DIR
+        return default_cache_dir()
+
+    @staticmethod
+    def key(service):
+        """ Return the key for a service, or None if the model and firmware
+        of its speaker are not yet known """
+        info = service.soco.speaker_info
+        if not isinstance(info, dict):
+            return None
+        model = info.get('model_number')
+        firmware = info.get('software_version')
+        if not (model and firmware):
+            return None
+        return (model, firmware, service.scpd_url)
+
+    def _path(self, key):
+        """ The file in which the description for `key` is saved """
+        model, firmware, scpd_url = key
+        return os.path.join(
+            self.cache_dir, _safe_name('{0}-{1}'.format(model, firmware)),
+            _safe_name(scpd_url.strip('/')) + '.json')
+
+    def _load(self, key):
+        """ Load the description for `key` from disk, or return None """
+        if not self.cache_dir or key in self._not_saved:
+            return None
+        path = self._path(key)
+        try:
+            with io.open(path, encoding='utf-8') as saved:
+                data = json.load(saved)
+            if data.get('format') != _FORMAT_VERSION:
+                raise ValueError('Unknown format')
+            description = ServiceDescription.from_dict(data)
+        except (IOError, OSError):
+            self._not_saved.add(key)
+            return None
+        except (ValueError, KeyError, TypeError) as error:
+            log.warning("Ignoring invalid SCPD cache file %s: %s",
+                        path, error)
+            self._not_saved.add(key)
+            return None
+        log.debug("Loaded service description from %s", path)
+        return description
+
+    def _save(self, key, description):
+        """ Save the description for `key` to disk, if possible """
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        data = description.to_dict()
+        data['format'] = _FORMAT_VERSION
+        temp_path = None
+        try:
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Write to a temporary file first, so that other processes never
+            # see a partly written one
+            handle, temp_path = tempfile.mkstemp(dir=directory,
+                                                 suffix='.tmp')
+            with io.open(handle, 'w', encoding='utf-8') as temp:
+                temp.write(json.dumps(data, ensure_ascii=False))
+            getattr(os, 'replace', os.rename)(temp_path, path)
+        except (IOError, OSError) as error:
+            log.warning("Could not save service description to %s: %s",
+                        path, error)
+            if temp_path is not None:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+        else:
+            self._not_saved.discard(key)
+
+    def lookup(self, service):
+        """ Return the description of a service if it is already known, in
+        memory or on disk, or None. Never makes a network request. """
+        key = self.key(service)
+        if key is None:
+            return None
+        description = self._descriptions.get(key)
+        if description is None and key not in self._not_saved:
+            with self._lock:
+                description = self._descriptions.get(key)
+                if description is None:
+                    description = self._load(key)
+                    if description is not None:
+                        self._descriptions[key] = description
+        return description
+
+    def get(self, service):
+        """ Return the description of a service, downloading it from the
+        speaker if it is not yet known """
+        if self.key(service) is None:
+            # Find out the model and firmware version
+            service.soco.get_speaker_info()
+        description = self.lookup(service)
+        if description is not None:
+            return description
+        log.info("Fetching service description %s from %s",
+                 service.scpd_url, service.soco.ip_address)
+        scpd_body = service.soco.http_session.get(
+            service.base_url + service.scpd_url,
+            timeout=service.soco.request_timeout).content
+        description = ServiceDescription.from_xml(scpd_body)
+        key = self.key(service)
+        if key is not None:
+            with self._lock:
+                self._descriptions[key] = description
+            # Saving is slow, so other threads are not kept waiting for it
+            self._save(key, description)
+        return description
+
+    def clear(self):
+        """ Forget all descriptions held in memory. Files saved on disk are
+        kept. """
+        with self._lock:
+            self._descriptions.clear()
+            self._not_saved.clear()
+
+
+#: The registry used by all services
+registry = ScpdRegistry()  # pylint: disable=invalid-name
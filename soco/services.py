@@ -39,30 +39,167 @@ from __future__ import unicode_literals, absolute_import
 # Python 3 compatibility
 
 
-from collections import namedtuple
 from xml.sax.saxutils import escape
-import json
+import asyncio
 import logging
+import threading
+from time import time
 
-import requests
-from .cache import Cache
+from . import metrics, trace
+from .compat import monotonic
+from .cache import Cache, LazyCache
+from .connection import get_client_session, client_timeout
 from .exceptions import SoCoUPnPException, UnknownSoCoException
-from .utils import prettify
 from .events import SonosSubscription
+from .library_cache import music_library_cache
+from .parser import EventVariables
 from .xml import XML
+# Action and Argument used to be defined here
+from .scpd import (  # pylint: disable=unused-import
+    Action, Argument, registry as scpd_registry)
+from soco import config
 
 log = logging.getLogger(__name__)  # pylint: disable=C0103
 
-performance_logger = logging.getLogger("sonos")
 
-Action = namedtuple('Action', 'name, in_args, out_args')
-Argument = namedtuple('Argument', 'name, vartype')
+_SOAP_BODY = "{http://schemas.xmlsoap.org/soap/envelope/}Body"
+
+# Compiled SOAP request templates, shared by all Service instances. See
+# Service.build_request
+_request_templates = {}  # pylint: disable=invalid-name
+
+
+class RequestTemplate(object):
+
+    """ A precompiled SOAP request for one action of a service, with a fixed
+    sequence of argument names.
+
+    The envelope, the argument tags and the SOAPACTION header are formatted
+    and encoded once, when the template is created. :meth:`render` then only
+    has to escape, encode and splice in the argument values.
+
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('headers', '_fragments')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, soap_body_template, service_type, version, action,
+                 arg_names):
+        # Format the body with a unique marker in place of each argument
+        # value, then split it at the markers.
+        marker = '\x00'
+        arguments = "".join(
+            "<{0}>{1}</{0}>".format(name, marker) for name in arg_names)
+        # pylint: disable=bad-format-string
+        body = soap_body_template.format(
+            arguments=arguments, action=action, service_type=service_type,
+            version=version)
+        self._fragments = [
+            fragment.encode('utf-8') for fragment in body.split(marker)]
+        soap_action = \
+            "urn:schemas-upnp-org:service:{0}:{1}#{2}".format(
+                service_type, version, action)
+        #: The POST headers. Content-length and host are added on sending.
+        self.headers = {'Content-Type': 'text/xml; charset="utf-8"',
+                        'SOAPACTION': soap_action}
+
+    def render(self, values):
+        """ Return the utf-8 encoded body of the request, for the given
+        argument values (in the same order as the argument names) """
+        fragments = self._fragments
+        if len(fragments) == 1:
+            return fragments[0]
+        chunks = [None] * (2 * len(fragments) - 1)
+        chunks[::2] = fragments
+        # % converts to unicode because we are using unicode literals.
+        chunks[1::2] = [escape("%s" % value, {'"': "&quot;"}).encode('utf-8')
+                        for value in values]
+        return b"".join(chunks)
+
+
+class _Flight(object):
+
+    """ A call in progress, as tracked by :class:`SingleFlight` """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('done', 'result', 'exception')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight(object):
+
+    """ Coalesce identical calls which are made concurrently.
+
+    While a call for a given key is in progress, any other thread making a
+    call with the same key waits for it to finish and receives the same
+    result (or exception), rather than making the call itself.
+
+    """
+
+    def __init__(self):
+        super(SingleFlight, self).__init__()
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def call(self, key, function, *args, **kwargs):
+        """ Call ``function(*args, **kwargs)``, unless a call with the same
+        (hashable) key is already in progress, in which case wait for that
+        one and return its result. """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            log.debug("Waiting for identical call in flight: %s", key)
+            flight.done.wait()
+            if flight.exception is not None:
+                raise flight.exception  # pylint: disable=raising-bad-type
+            return flight.result
+        try:
+            flight.result = function(*args, **kwargs)
+            return flight.result
+        except Exception as exc:
+            flight.exception = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+# Requests in flight from all Service instances
+_single_flight = SingleFlight()  # pylint: disable=invalid-name
 
 # A shared cache for ZoneGroupState. Each zone has the same info, so when a
 # SoCo instance is asked for group info, we can cache it and return it when
 # another instance is asked. To do this we need a cache to be shared between
 # instances
-zone_group_state_shared_cache = Cache()
+zone_group_state_shared_cache = LazyCache(name='zone group state (shared)')
+
+
+def stamp_zone_group_state(zone_group_state, timeout):
+    """ Record in :data:`zone_group_state_shared_cache` that
+    `zone_group_state` has just been fetched from, or reported by, a
+    speaker, so that whoever takes it from the cache later knows its age.
+    The time is by the wall clock, which is comparable between processes
+    sharing the cache. """
+    zone_group_state_shared_cache.put(
+        time(), 'ZoneGroupStateFetched', zone_group_state, timeout=timeout)
+
+
+def zone_group_state_age(zone_group_state):
+    """ Return how long ago `zone_group_state` was fetched from, or
+    reported by, a speaker, in seconds, or None if that is not known (see
+    :func:`stamp_zone_group_state`) """
+    fetched = zone_group_state_shared_cache.get(
+        'ZoneGroupStateFetched', zone_group_state)
+    if fetched is None:
+        return None
+    return max(0, time() - fetched)
 
 
 # pylint: disable=too-many-instance-attributes
@@ -107,8 +244,15 @@ class Service(object):
         # Eventing subscription
         self.event_subscription_url = '/{0}/Event'.format(self.service_type)
         #: A cache for storing the result of network calls. By default, this is
-        #: TimedCache(default_timeout=0). See :class:`TimedCache`
-        self.cache = Cache(default_timeout=0)
+        #: Cache(default_timeout=0). See :class:`soco.cache.Cache`
+        self.cache = Cache(default_timeout=0, name='{0} {1}'.format(
+            self.soco.ip_address, self.service_type))
+        # (action, args) of the cached results written through by setters,
+        # which no event has confirmed yet
+        self._provisional = set()
+        # Whether the service description has been fetched, or an attempt
+        # made, for validating commands
+        self._scpd_fetched = False
 
         # From table 3.3 in
         # http://upnp.org/specs/arch/UPnP-arch-DeviceArchitecture-v1.1.pdf
@@ -148,7 +292,21 @@ class Service(object):
         The name of the unknown method called is passed as a parameter, and the
         return value is the callable to be invoked.
 
+        If the description of the service is already known (see
+        :mod:`soco.scpd`), names which are not actions of the service raise
+        AttributeError straight away, rather than after a round trip to the
+        speaker.
+
         """
+        if action.startswith('_'):
+            # Not an action, and probably a special method looked up by
+            # Python or a library like copy or mock
+            raise AttributeError(action)
+        description = (scpd_registry.lookup(self)
+                       if config.SCPD_VALIDATION else None)
+        if description is not None and action not in description.actions:
+            raise AttributeError(
+                "{0} has no action {1}".format(self.service_type, action))
 
         # Define a function to be invoked as the method, which calls
         # send_command.
@@ -209,7 +367,9 @@ class Service(object):
         """ Extract arguments and their values from a SOAP response.
 
         Given an soap/xml response, return a dict of {argument_name, value)}
-        items
+        items. The response should preferably be the raw (utf-8 encoded)
+        bytes received from the network. A unicode string is also accepted,
+        but must be encoded first.
 
         """
 
@@ -235,18 +395,37 @@ class Service(object):
         #   </s:Body>
         # </s:Envelope>
 
-        # Get all tags in order. Elementree (in python 2.x) seems to prefer to
-        # be fed bytes, rather than unicode
-        xml_response = xml_response.encode('utf-8')
-        tree = XML.fromstring(xml_response)
-
-        # Get the first child of the <Body> tag which will be
-        # <{actionNameResponse}> (depends on what actionName is). Turn the
-        # children of this into a {tagname, content} dict. XML unescaping
-        # is carried out for us by elementree.
-        action_response = tree.find(
-            "{http://schemas.xmlsoap.org/soap/envelope/}Body")[0]
-        return dict((i.tag, i.text or "") for i in action_response)
+        # The bytes are fed straight into an incremental parser, without
+        # first being decoded and re-encoded. Only the children of the first
+        # child of the <Body> tag, which will be <{actionNameResponse}>
+        # (depends on what actionName is), are extracted into a
+        # {tagname, content} dict. XML unescaping is carried out for us by
+        # the parser, and each value is a single string which is not copied
+        # again.
+        if not isinstance(xml_response, bytes):
+            xml_response = xml_response.encode('utf-8')
+        parser = XML.XMLPullParser(events=('start', 'end'))
+        parser.feed(xml_response)
+        result = {}
+        depth = 0
+        in_response = False
+        seen_response = False
+        for event, element in parser.read_events():
+            if event == 'start':
+                depth += 1
+                if depth == 2:
+                    in_response = element.tag == _SOAP_BODY
+                elif depth == 3 and in_response:
+                    # Only the first child of <Body> is of interest
+                    in_response = not seen_response
+                    seen_response = True
+            else:
+                if depth == 4 and in_response:
+                    result[element.tag] = element.text or ""
+                    element.clear()
+                depth -= 1
+        parser.close()
+        return result
 
     def build_command(self, action, args=None):
         """ Build a SOAP request.
@@ -280,22 +459,34 @@ class Service(object):
         #   </s:Body>
         # </s:Envelope>
 
-        arguments = self.wrap_arguments(args)
-        # pylint: disable=bad-format-string
-        body = self.soap_body_template.format(
-            arguments=arguments, action=action, service_type=self.service_type,
-            version=self.version)
-        soap_action_template = \
-            "urn:schemas-upnp-org:service:{service_type}:{version}#{action}"
-        soap_action = soap_action_template.format(
-            service_type=self.service_type, version=self.version,
-            action=action)
-        headers = {'Content-Type': 'text/xml; charset="utf-8"',
-                   'SOAPACTION': soap_action}
-        # Note that although we set the charset to utf-8 here, in fact the
-        # body is still unicode. It will only be converted to bytes when it
-        # is set over the network
-        return (headers, body)
+        headers, body = self.build_request(action, args)
+        # Return a copy of the headers, since the compiled ones are shared
+        return (dict(headers), body.decode('utf-8'))
+
+    def build_request(self, action, args=None):
+        """ Build a SOAP request, ready to be sent over the network.
+
+        As :meth:`build_command`, but the body is returned as utf-8 encoded
+        bytes. The request is rendered from a :class:`RequestTemplate` which
+        is compiled on first use and cached, so that for each subsequent call
+        only the argument values have to be escaped and encoded.
+
+        The returned headers dict is shared between calls, and must not be
+        modified.
+
+        """
+        if args is None:
+            args = []
+        arg_names = tuple(name for name, _ in args)
+        key = (self.soap_body_template, self.service_type, self.version,
+               action, arg_names)
+        template = _request_templates.get(key)
+        if template is None:
+            template = _request_templates[key] = RequestTemplate(
+                self.soap_body_template, self.service_type, self.version,
+                action, arg_names)
+        return (template.headers,
+                template.render([value for _, value in args]))
 
     def send_command(self, action, args=None, cache=None, cache_timeout=None):
         """ Send a command to a Sonos device.
@@ -316,62 +507,400 @@ class Service(object):
         :attribute:`cache` attribute will be used, but a different cache object
         may be specified in the `cache` parameter.
 
+        If an identical read-only request (see :meth:`is_coalescable`) is
+        already being sent from another thread, no new request is sent.
+        Instead, the result of the one in flight is awaited and shared. If
+        the cache used is not this service's own :attr:`cache`, results are
+        assumed to be interchangeable between speakers, and requests to
+        different speakers are coalesced too. This can be switched off with
+        :data:`soco.config.SINGLE_FLIGHT_ENABLED`.
+
+        The action and arguments are checked against the description of the
+        service (see :meth:`normalize_arguments`), and the arguments are put
+        into the order the speaker expects, before anything else is done.
+        The first command sent through a service fetches its description, if
+        it is not already known.
+
+        The policy for the action in :data:`soco.config.CACHE_POLICIES`, if
+        any, supplies the timeout when `cache_timeout` is None, may forbid
+        caching altogether, and says which cached results a successful call
+        makes out of date (see :meth:`invalidate_cache_for`).
+
         Return a dict of {argument_name, value)} items or True on success.
         Raise an exception on failure.
 
         """
+        args, cache, cache_timeout, result = self._prepare_command(
+            action, args, cache, cache_timeout)
+        if result is not None:
+            return result
+        # Cache miss, so go ahead and make a network call, unless the same
+        # call is already in progress
+        key = self._flight_key(action, args, cache)
+        if key is not None:
+            return _single_flight.call(
+                key, self._post_command, action, args, cache, cache_timeout)
+        return self._post_command(action, args, cache, cache_timeout)
+
+    def _prepare_command(self, action, args, cache, cache_timeout):
+        """ Do what :meth:`send_command` and :meth:`async_send_command` do
+        before sending a command: check and order the arguments, choose the
+        cache and timeout, following the policy for the action, and look
+        for a cached result.
+
+        Returns:
+            tuple: (args, cache, cache_timeout, result), where result is
+            the cached result, or None if the command must be sent
+
+        """
+        args = self.normalize_arguments(action, args)
         if cache is None:
             cache = self.cache
+        policy = self.cache_policy(action)
+        if not policy.get('cacheable', True):
+            return args, cache, 0, None
+        if cache_timeout is None:
+            cache_timeout = policy.get('ttl')
         result = cache.get(action, args)
         if result is not None:
             log.debug("Cache hit")
+            metrics.cache_hits.inc(
+                self.soco.ip_address, self.service_type, action)
+        return args, cache, cache_timeout, result
+
+    def _flight_key(self, action, args, cache):
+        """ Return the key under which identical calls of `action` are
+        coalesced (see :class:`SingleFlight`), or None if they must not be
+        """
+        if not (config.SINGLE_FLIGHT_ENABLED and self.is_coalescable(action)):
+            return None
+        host = self.base_url if cache is self.cache else id(cache)
+        key = (host, self.control_url, action, tuple(args) if args else ())
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def service_description(self):
+        """ Return the description of the service (see :mod:`soco.scpd`),
+        for validating commands, or None if validation is switched off.
+
+        If the description is not already known, in memory or on disk, it is
+        fetched from the speaker the first time this is called. If that
+        fails, None is returned, and it is not tried again.
+
+        """
+        if not config.SCPD_VALIDATION:
+            return None
+        description = scpd_registry.lookup(self)
+        if description is None and not self._scpd_fetched:
+            self._scpd_fetched = True
+            try:
+                description = scpd_registry.get(self)
+            except Exception as error:  # pylint: disable=broad-except
+                # Validation is only a check. Never stop a command for it.
+                log.warning("Could not fetch service description %s from "
+                            "%s: %s", self.scpd_url, self.soco.ip_address,
+                            error)
+        return description
+
+    def normalize_arguments(self, action, args):
+        """ Check the arguments for `action` against the description of the
+        service, and put them in the declared order. If the description
+        cannot be had (see :meth:`service_description`), `args` is returned
+        unchanged.
+
+        Raises:
+            ValueError: if the action is unknown, or an argument is missing
+                or repeated.
+
+        """
+        description = self.service_description()
+        if description is None:
+            return args
+        return description.normalize_arguments(action, args)
+
+    def cache_policy(self, action):
+        """ Return the policy for `action` in
+        :data:`soco.config.CACHE_POLICIES`, or an empty dict if there is
+        none """
+        return config.CACHE_POLICIES.get((self.service_type, action), {})
+
+    def invalidate_cache_for(self, action, keep=()):
+        """ Discard the cached results which a successful call to `action`
+        makes out of date, according to the ``invalidated_by`` lists in
+        :data:`soco.config.CACHE_POLICIES`. The results may be held by any
+        of the speaker's services. Those of the (service type, action)
+        tuples in `keep` are left alone. """
+        trigger = (self.service_type, action)
+        for (service_type, cached_action), policy in \
+                config.CACHE_POLICIES.items():
+            if trigger not in policy.get('invalidated_by', ()):
+                continue
+            if (service_type, cached_action) in keep:
+                continue
+            service = self._sibling(service_type)
+            if service is not None:
+                service.cache.delete_action(cached_action)
+                service.confirm(cached_action)
+
+    def write_through(self, action, args, result):
+        """ Update the cached result of the getter which corresponds to a
+        setter `action`, after the setter succeeded with `args`, so that
+        reading the value back needs no request.
+
+        The getter, its arguments and its output values are given by the
+        ``writes_through`` entry of the setter's policy in
+        :data:`soco.config.CACHE_POLICIES`, a dict with these keys:
+
+        ``action``
+            The getter, eg ``'GetVolume'``.
+        ``service``
+            The service type of the getter, if not that of the setter.
+        ``args``
+            The getter's arguments, as a list of the names of arguments to
+            copy from the setter, or (name, value) tuples.
+        ``values``
+            A dict mapping each output argument of the getter to the name
+            of the setter argument, or setter output, which gives its value.
+        ``merge``
+            If True, the values are merged into a cached result of the
+            getter, which is left alone if there is none. Use this when the
+            getter returns more than the setter sets.
+        ``provisional``
+            If True, the value is held only for
+            :data:`soco.config.WRITE_THROUGH_PROVISIONAL_TTL` seconds,
+            until an event confirms it (see :meth:`is_provisional`), since
+            the speaker may not have applied it exactly as given (eg
+            because of a volume limit). Otherwise it is held for the
+            getter's own ttl.
+
+        Nothing is done if :data:`soco.config.WRITE_THROUGH_ENABLED` is
+        False, or the getter is not cacheable.
+
+        Returns:
+            tuple: the (service type, action) of the getter in a tuple, if
+            its cached results are now up to date and need not be
+            invalidated, or else an empty tuple
+
+        """
+        if not config.WRITE_THROUGH_ENABLED:
+            return ()
+        spec = self.cache_policy(action).get('writes_through')
+        if not spec:
+            return ()
+        service = self._sibling(spec.get('service', self.service_type))
+        if service is None:
+            return ()
+        getter = spec['action']
+        getter_policy = service.cache_policy(getter)
+        provisional = spec.get('provisional', False)
+        timeout = (config.WRITE_THROUGH_PROVISIONAL_TTL if provisional
+                   else getter_policy.get('ttl'))
+        if not (timeout and getter_policy.get('cacheable', True)):
+            return ()
+        written = ((service.service_type, getter),)
+        sources = dict(args or ())
+        if isinstance(result, dict):
+            sources.update(result)
+        try:
+            getter_args = [
+                arg if isinstance(arg, tuple) else (arg, sources[arg])
+                for arg in spec.get('args', ())]
+            values = dict((out_arg, '{0}'.format(sources[source]))
+                          for out_arg, source in spec['values'].items())
+        except KeyError as error:
+            log.warning("Cannot write %s through to %s: no %s", action,
+                        getter, error)
+            return ()
+        if spec.get('merge'):
+            cached = service.cache.get(getter, getter_args)
+            if not isinstance(cached, dict):
+                # Nothing to bring up to date
+                return written
+            values = dict(cached, **values)
+        service.cache.put(values, getter, getter_args, timeout=timeout)
+        key = (getter, tuple(getter_args))
+        if provisional:
+            service._provisional.add(key)
+        else:
+            service._provisional.discard(key)
+        return written
+
+    def is_provisional(self, action, args=None):
+        """ Return True if the cached result of `action` with `args` was
+        written through by a setter, and not yet confirmed by an event (see
+        :meth:`write_through`) """
+        return (action, tuple(args or ())) in self._provisional
+
+    def confirm(self, action, args=None):
+        """ Mark the cached result of `action` with `args`, or all of its
+        results if `args` is None, as no longer provisional. Called when an
+        event reports the value, or makes it out of date. """
+        if args is not None:
+            self._provisional.discard((action, tuple(args)))
+            return
+        for key in list(self._provisional):
+            if key[0] == action:
+                self._provisional.discard(key)
+
+    def _sibling(self, service_type):
+        """ Return the speaker's service of type `service_type`, or None """
+        if service_type == self.service_type:
+            return self
+        for value in vars(self.soco).values():
+            if isinstance(value, Service) and \
+                    value.service_type == service_type:
+                return value
+        return None
+
+    @staticmethod
+    def is_coalescable(action):
+        """ Return True if concurrent, identical calls to `action` may be
+        coalesced into a single request. This is the case for actions which
+        only read state (Get... and Browse), but not for actions which change
+        it, which must always be sent as often as they are called.
+
+        """
+        return action.startswith(('Get', 'Browse'))
+
+    def _post_command(self, action, args, cache, cache_timeout):
+        """ Send a command over the network, and process the response. See
+        :meth:`send_command` """
+        headers, body = self.build_request(action, args)
+        # The request and response are not logged in full here, since that
+        # would cost time even with debug logging off. Use soco.trace to
+        # record them instead.
+        log.info("Sending %s %s to %s", action, args, self.soco.ip_address)
+        try:
+            with metrics.track_request(
+                    self.soco.ip_address, self.service_type, action):
+                response = self.soco.http_session.post(
+                    self.base_url + self.control_url,
+                    headers=headers,
+                    data=body,
+                    timeout=self.soco.request_timeout,
+                )
+                status = response.status_code
+                # UPnP requires all XML to be utf-8 encoded, so there is no
+                # need for requests to guess an encoding and decode the
+                # content for us. The raw bytes are passed straight on to
+                # the parser.
+                result = self._handle_response(
+                    action, args, status, response.content, cache,
+                    cache_timeout)
+                if result is None:
+                    # Something else has gone wrong. Probably a network
+                    # error. Let Requests handle it
+                    response.raise_for_status()
+        except Exception:
+            trace.log_on_error(self.soco.ip_address)
+            raise
+        return result
+
+    async def async_send_command(self, action, args=None, cache=None,
+                                 cache_timeout=None, session=None):
+        """ Send a command to a Sonos device, without blocking.
+
+        A coroutine which behaves exactly like :meth:`send_command`, sharing
+        the same cache, but which makes its network call with aiohttp instead
+        of requests. This lets a single event loop drive many speakers at
+        once, without a thread for every request in flight.
+
+        `session` is the :class:`aiohttp.ClientSession` to use. If None, the
+        session shared by the current event loop is used (see
+        :func:`soco.connection.get_client_session`).
+
+        """
+        if config.SCPD_VALIDATION and not self._scpd_fetched:
+            # Fetching the description blocks, so do it in a thread
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.service_description)
+        args, cache, cache_timeout, result = self._prepare_command(
+            action, args, cache, cache_timeout)
+        if result is not None:
             return result
-        # Cache miss, so go ahead and make a network call
-        headers, body = self.build_command(action, args)
+        if session is None:
+            session = get_client_session()
+        headers, body = self.build_request(action, args)
+        health = self.soco.http_session.health
         log.info("Sending %s %s to %s", action, args, self.soco.ip_address)
-        log.debug("Sending %s, %s", headers, prettify(body))
-        # Convert the body to bytes, and send it.
-        response = requests.post(
-            self.base_url + self.control_url,
-            headers=headers,
-            data=body.encode('utf-8'),
-            timeout=self.soco.request_timeout,
-        )
-        log.debug("Received %s, %s", response.headers, response.text)
-        log_args = dict(action=action,args=args,duration=response.elapsed.total_seconds()*1000)
-        performance_logger.info("soco:send_command:%s" % json.dumps(log_args))
-        status = response.status_code
+        url = self.base_url + self.control_url
+        start = monotonic()
+        status = None
+        try:
+            with metrics.track_request(
+                    self.soco.ip_address, self.service_type, action):
+                with health.guard():
+                    async with session.post(
+                            url,
+                            headers=headers,
+                            data=body,
+                            timeout=client_timeout(
+                                health.deadline(self.soco.request_timeout)),
+                    ) as response:
+                        content = await response.read()
+                        status = response.status
+                if config.WIRE_TRACE_ENABLED:
+                    trace.record_exchange(
+                        self.soco.ip_address, 'POST', url, headers, body,
+                        start, status, response.headers, content)
+                result = self._handle_response(
+                    action, args, status, content, cache, cache_timeout)
+                if result is None:
+                    response.raise_for_status()
+        except Exception as error:
+            if config.WIRE_TRACE_ENABLED and status is None:
+                # No response was received
+                trace.record_exchange(
+                    self.soco.ip_address, 'POST', url, headers, body, start,
+                    error=error)
+            trace.log_on_error(self.soco.ip_address)
+            raise
+        return result
+
+    def _handle_response(self, action, args, status, content, cache,
+                         cache_timeout):
+        """ Process the response to a command sent by :meth:`send_command` or
+        :meth:`async_send_command`. `content` is the body of the response,
+        as bytes.
+
+        Return the result of the command if the status is 200, and raise the
+        appropriate exception if it is 500. Return None for any other status,
+        so that the caller can raise a suitable transport error.
+
+        """
         log.info(
             "Received status %s from %s", status, self.soco.ip_address)
         if status == 200:
             # The response is good. Get the output params, and return them.
             # NB an empty dict is a valid result. It just means that no
-            # params are returned. By using response.text, we rely upon
-            # the requests library to convert to unicode for us.
-            result = self.unwrap_arguments(response.text) or True
+            # params are returned.
+            result = self.unwrap_arguments(content) or True
             # Store in the cache. There is no need to do this if there was an
             # error, since we would want to try a network call again.
             cache.put(result, action, args, timeout=cache_timeout)
+            written = self.write_through(action, args, result)
+            self.invalidate_cache_for(action, keep=written)
             return result
         elif status == 500:
             # Internal server error. UPnP requires this to be returned if the
             # device does not like the action for some reason. The returned
             # content will be a SOAP Fault. Parse it and raise an error.
             try:
-                self.handle_upnp_error(response.text)
+                self.handle_upnp_error(content)
             except Exception as exc:
                 log.exception(str(exc))
                 raise
-        else:
-            # Something else has gone wrong. Probably a network error. Let
-            # Requests handle it
-            response.raise_for_status()
+        return None
 
     def handle_upnp_error(self, xml_error):
         """ Disect a UPnP error, and raise an appropriate exception
 
-        xml_error is a unicode string containing the body of the UPnP/SOAP
-        Fault response. Raises an exception containing the error code
+        xml_error is a byte (or unicode) string containing the body of the
+        UPnP/SOAP Fault response. Raises an exception containing the error
+        code
 
         """
 
@@ -406,7 +935,8 @@ class Service(object):
         # errorDescription is not required, and Sonos does not seem to use it.
 
         # NB need to encode unicode strings before passing to ElementTree
-        xml_error = xml_error.encode('utf-8')
+        if not isinstance(xml_error, bytes):
+            xml_error = xml_error.encode('utf-8')
         error = XML.fromstring(xml_error)
         log.debug("Error %s", xml_error)
         error_code = error.findtext(
@@ -426,7 +956,7 @@ class Service(object):
             raise UnknownSoCoException(xml_error)
 
     async def subscribe(self, loop, event_server, callback_func, requested_timeout=None,
-                        auto_renew=False):
+                        auto_renew=False, session=None):
         """Subscribe to the service's events.
 
         If requested_timeout is provided, a subscription valid for that number
@@ -440,6 +970,14 @@ class Service(object):
 
         Returns a Subscription object, representing the new subscription
 
+        Events received for the subscription also bring this service's cache
+        up to date (see :meth:`update_cache_from_event`).
+
+        session is the :class:`aiohttp.ClientSession` used to subscribe,
+        renew and unsubscribe. If None, the session shared by all requests on
+        the loop is used. See also
+        :class:`soco.subscriptions.SubscriptionManager`.
+
         To unsubscribe, call the `unsubscribe` method on the returned object.
 
         """
@@ -449,10 +987,61 @@ class Service(object):
             subscribe_uri=self.base_url + self.event_subscription_url,
             callback_func=callback_func,
             requested_timeout=requested_timeout,
+            service=self,
+            session=session,
         )
         await subscription.subscribe(auto_renew=auto_renew)
         return subscription
 
+    def update_cache_from_event(self, variables):
+        """ Update the cache with the state reported by an event.
+
+        Called by :class:`soco.events.SonosEventServer` for each event
+        received for a subscription to this service, with the evented
+        variables as returned by :func:`soco.parser.parse_event`. Cached
+        results which the event shows to be out of date are invalidated, and
+        those which it gives in full are primed, for
+        :data:`soco.config.EVENT_CACHE_TTL` seconds, so that they can be
+        read without a network request. This does nothing by default, and is
+        overridden by services whose events are understood.
+
+        """
+        pass
+
+    #: The getters which report the state carried by this service's events,
+    #: used by :meth:`resync_state`, as (action, args, variables) tuples.
+    #: `variables` maps output arguments of the action to the names of the
+    #: evented variables they correspond to, or to (name, channel) tuples.
+    RESYNC_GETTERS = ()
+
+    async def resync_state(self):
+        """ Fetch the state which this service's events report, afresh.
+
+        Used by :class:`soco.events.SonosEventServer` when events have been
+        lost, so that subscribers can catch up. Each getter in
+        :attr:`RESYNC_GETTERS` is called, bypassing its cached result.
+
+        Returns:
+            EventVariables: the state, named as in events (see
+            :func:`soco.parser.parse_event`)
+
+        """
+        raw = {}
+        for action, args, variables in self.RESYNC_GETTERS:
+            self.cache.delete(action, args)
+            result = await self.async_send_command(action, args)
+            if not isinstance(result, dict):
+                continue
+            for out_arg, name in variables.items():
+                if out_arg not in result:
+                    continue
+                if isinstance(name, tuple):
+                    name, channel = name
+                    raw.setdefault(name, {})[channel] = result[out_arg]
+                else:
+                    raw[name] = result[out_arg]
+        return EventVariables(raw)
+
     def iter_actions(self):
         """ Yield the service's actions with their in_arguments (ie parameters
         to pass to the action) and out_arguments (ie returned values).
@@ -464,47 +1053,15 @@ class Service(object):
         Action(name='SetFormat',
             in_args=[Argument(name='DesiredTimeFormat', vartype='string'),
                      Argument(name='DesiredDateFormat', vartype='string')],
-            out_args=[]) """
+            out_args=[])
+
+        The service description is only downloaded from the speaker if it is
+        not already held by the registry in :mod:`soco.scpd`. """
 
-        # pylint: disable=too-many-locals
         # TODO: Provide for Allowed value list, Allowed value range,
         # default value
-        # pylint: disable=invalid-name
-        ns = '{urn:schemas-upnp-org:service-1-0}'
-        # get the scpd body as bytes, and feed directly to elementtree
-        # which likes to receive bytes
-        scpd_body = requests.get(self.base_url + self.scpd_url).content
-        tree = XML.fromstring(scpd_body)
-        # parse the state variables to get the relevant variable types
-        vartypes = {}
-        srvStateTables = tree.findall('{0}serviceStateTable'.format(ns))
-        for srvStateTable in srvStateTables:
-            statevars = srvStateTable.findall('{0}stateVariable'.format(ns))
-            for state in statevars:
-                name = state.findtext('{0}name'.format(ns))
-                vartypes[name] = state.findtext('{0}dataType'.format(ns))
-        # find all the actions
-        actionLists = tree.findall('{0}actionList'.format(ns))
-        for actionList in actionLists:
-            actions = actionList.findall('{0}action'.format(ns))
-            for i in actions:
-                action_name = i.findtext('{0}name'.format(ns))
-                argLists = i.findall('{0}argumentList'.format(ns))
-                for argList in argLists:
-                    args_iter = argList.findall('{0}argument'.format(ns))
-                    in_args = []
-                    out_args = []
-                    for arg in args_iter:
-                        arg_name = arg.findtext('{0}name'.format(ns))
-                        direction = arg.findtext('{0}direction'.format(ns))
-                        related_variable = arg.findtext(
-                            '{0}relatedStateVariable'.format(ns))
-                        vartype = vartypes[related_variable]
-                        if direction == "in":
-                            in_args.append(Argument(arg_name, vartype))
-                        else:
-                            out_args.append(Argument(arg_name, vartype))
-                    yield Action(action_name, in_args, out_args)
+        for action in scpd_registry.get(self).actions.values():
+            yield action
 
     def iter_event_vars(self):
         """ Yield an iterator over the services eventable variables.
@@ -512,20 +1069,8 @@ class Service(object):
         Yields a tuple of (variable name, data type)
 
         """
-
-        # pylint: disable=invalid-name
-        ns = '{urn:schemas-upnp-org:service-1-0}'
-        scpd_body = requests.get(self.base_url + self.scpd_url).text
-        tree = XML.fromstring(scpd_body.encode('utf-8'))
-        # parse the state variables to get the relevant variable types
-        statevars = tree.findall('{0}stateVariable'.format(ns))
-        for state in statevars:
-            # We are only interested if 'sendEvents' is 'yes', i.e this
-            # is an eventable variable
-            if state.attrib['sendEvents'] == "yes":
-                name = state.findtext('{0}name'.format(ns))
-                vartype = state.findtext('{0}dataType'.format(ns))
-                yield (name, vartype)
+        for event_var in scpd_registry.get(self).event_vars():
+            yield event_var
 
 
 class AlarmClock(Service):
@@ -581,6 +1126,22 @@ class ZoneGroupTopology(Service):
         kwargs['cache'] = kwargs.get('cache', zone_group_state_shared_cache)
         return self.send_command('GetZoneGroupState', *args, **kwargs)
 
+    RESYNC_GETTERS = (
+        ('GetZoneGroupState', None, {'ZoneGroupState': 'zone_group_state'}),
+    )
+
+    def update_cache_from_event(self, variables):
+        """ Prime the shared zone group state cache from a topology event.
+        See :meth:`Service.update_cache_from_event` """
+        if not config.EVENT_CACHE_ENABLED:
+            return
+        zone_group_state = variables.get('zone_group_state')
+        if zone_group_state:
+            zone_group_state_shared_cache.put(
+                {'ZoneGroupState': zone_group_state}, 'GetZoneGroupState',
+                None, timeout=config.EVENT_CACHE_TTL)
+            stamp_zone_group_state(zone_group_state, config.EVENT_CACHE_TTL)
+
 
 class GroupManagement(Service):
 
@@ -631,6 +1192,32 @@ class ContentDirectory(Service):
             720: 'Cannot process the request',
         })
 
+    # Events report the update ID of the queue in ContainerUpdateIDs, with
+    # those of other containers. Browsing the queue reports it alone, as
+    # queue_update_id, which only resynchronised state has.
+    RESYNC_GETTERS = (
+        ('GetSystemUpdateID', None, {'Id': 'system_update_id'}),
+        ('Browse', [
+            ('ObjectID', 'Q:0'),
+            ('BrowseFlag', 'BrowseMetadata'),
+            ('Filter', ''),
+            ('StartingIndex', 0),
+            ('RequestedCount', 1),
+            ('SortCriteria', '')
+        ], {'UpdateID': 'queue_update_id'}),
+    )
+
+    def update_cache_from_event(self, variables):
+        """ Record a changed ``SystemUpdateID`` in the music library cache,
+        which drops pages fetched before the change. See
+        :meth:`Service.update_cache_from_event` """
+        if not (config.EVENT_CACHE_ENABLED and
+                config.MUSIC_LIBRARY_CACHE_ENABLED):
+            return
+        update_id = variables.get('system_update_id')
+        if update_id is not None:
+            music_library_cache.update_from_event(self.soco, update_id)
+
 
 class MS_ConnectionManager(Service):  # pylint: disable=invalid-name
 
@@ -653,6 +1240,42 @@ class RenderingControl(Service):
         self.control_url = "/MediaRenderer/RenderingControl/Control"
         self.event_subscription_url = "/MediaRenderer/RenderingControl/Event"
 
+    # Evented variable: (action which reads it, its output argument)
+    EVENTED_GETTERS = {
+        'volume': ('GetVolume', 'CurrentVolume'),
+        'mute': ('GetMute', 'CurrentMute'),
+        'bass': ('GetBass', 'CurrentBass'),
+        'treble': ('GetTreble', 'CurrentTreble'),
+        'loudness': ('GetLoudness', 'CurrentLoudness'),
+    }
+
+    RESYNC_GETTERS = tuple(
+        (action, [('InstanceID', 0), ('Channel', 'Master')],
+         {out_arg: (name, 'Master')})
+        for name, (action, out_arg) in sorted(EVENTED_GETTERS.items()))
+
+    def update_cache_from_event(self, variables):
+        """ Prime the cached results of GetVolume, GetMute, GetBass,
+        GetTreble and GetLoudness from a LastChange event. See
+        :meth:`Service.update_cache_from_event` """
+        if not config.EVENT_CACHE_ENABLED:
+            return
+        for name, (action, out_arg) in self.EVENTED_GETTERS.items():
+            value = variables.get(name)
+            if value is None:
+                continue
+            # Values for each channel arrive as a dict. The others apply to
+            # the Master channel.
+            channels = value if isinstance(value, dict) else {'Master': value}
+            for channel, channel_value in channels.items():
+                args = [('InstanceID', 0), ('Channel', channel)]
+                # Cache the values as the getter would return them
+                if isinstance(channel_value, bool):
+                    channel_value = '1' if channel_value else '0'
+                self.cache.put({out_arg: '{0}'.format(channel_value)},
+                               action, args, timeout=config.EVENT_CACHE_TTL)
+                self.confirm(action, args)
+
 
 class MR_ConnectionManager(Service):  # pylint: disable=invalid-name
 
@@ -700,6 +1323,39 @@ class AVTransport(Service):
             739: 'Server Error',
         })
 
+    # Actions whose results may be changed by any AVTransport event
+    EVENTED_GETTERS = ('GetTransportInfo', 'GetPositionInfo', 'GetMediaInfo',
+                       'GetTransportSettings', 'GetCrossfadeMode')
+
+    RESYNC_GETTERS = (
+        ('GetTransportInfo', [('InstanceID', 0)],
+         {'CurrentTransportState': 'transport_state'}),
+        ('GetMediaInfo', [('InstanceID', 0)],
+         {'NrTracks': 'number_of_tracks',
+          'CurrentURI': 'av_transport_uri',
+          'CurrentURIMetaData': 'av_transport_uri_meta_data'}),
+        ('GetPositionInfo', [('InstanceID', 0)],
+         {'Track': 'current_track',
+          'TrackURI': 'current_track_uri',
+          'TrackDuration': 'current_track_duration',
+          'TrackMetaData': 'current_track_meta_data'}),
+        ('GetTransportSettings', [('InstanceID', 0)],
+         {'PlayMode': 'current_play_mode'}),
+        ('GetCrossfadeMode', [('InstanceID', 0)],
+         {'CrossfadeMode': 'current_crossfade_mode'}),
+    )
+
+    def update_cache_from_event(self, variables):
+        """ Invalidate the cached transport, position and media info after
+        a LastChange event. These cannot be primed, since events do not
+        carry all of their output arguments. See
+        :meth:`Service.update_cache_from_event` """
+        if not config.EVENT_CACHE_ENABLED:
+            return
+        for action in self.EVENTED_GETTERS:
+            self.cache.delete_action(action)
+            self.confirm(action)
+
 
 class Queue(Service):
 
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+""" Managing many event subscriptions at once
+
+Subscribing to several services on every speaker in a household means many
+SUBSCRIBE requests at startup, and many renewals after that. A
+:class:`SubscriptionManager` makes them all through one
+:class:`aiohttp.ClientSession`, whose connector is sized for the household by
+:data:`soco.config.SUBSCRIPTION_MAX_CONNECTIONS`, so that keep-alive
+connections to each speaker are reused rather than opened afresh for every
+request. It keeps track of the subscriptions it made, and
+:meth:`SubscriptionManager.close` unsubscribes them all before closing the
+session.
+
+Subscriptions which each renew themselves (with ``auto_renew``) renew after
+three quarters of their timeout, so those made together at startup renew
+together, hitting every speaker at the same moment, for ever. The manager
+renews its subscriptions itself instead. Each renewal is put on a
+:class:`TimerWheel` at a random point within
+:data:`soco.config.SUBSCRIPTION_RENEWAL_JITTER` of
+:data:`soco.config.SUBSCRIPTION_RENEWAL_FRACTION` of the timeout, so that
+they drift apart, and renewals which fall due together are made at most
+:data:`soco.config.SUBSCRIPTION_RENEWAL_CONCURRENCY` at a time. A failed
+renewal is tried again after :data:`soco.config.SUBSCRIPTION_RETRY_INTERVAL`
+seconds, and :meth:`SubscriptionManager.health` reports the state of every
+subscription::
+
+    manager = SubscriptionManager(loop, event_server)
+    await manager.subscribe_all(
+        [speaker.renderingControl for speaker in speakers], callback,
+        auto_renew=True)
+    ...
+    await manager.close()
+
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import random
+from collections import namedtuple
+
+import aiohttp
+
+from . import metrics
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+#: The state of a subscription, as reported by
+#: :meth:`SubscriptionManager.health`. `state` is ``'ok'``, ``'renewing'``,
+#: ``'retrying'`` after a renewal failed, or ``'expired'`` if the
+#: subscription ran out before it could be renewed. `expires_in` is the
+#: number of seconds until the speaker forgets the subscription, or None if
+#: it never does, and `last_error` the exception raised by the latest failed
+#: renewal, if any.
+SubscriptionHealth = namedtuple('SubscriptionHealth', [
+    'sid', 'speaker', 'service', 'state', 'expires_in', 'renewals',
+    'failures', 'last_error'])
+
+
+class TimerWheel(object):
+
+    """ A hashed timer wheel: a ring of slots, each holding the items due in
+    one tick. Scheduling and cancelling an item are O(1), and advancing the
+    wheel only looks at the slots passed. Items due more than a turn of the
+    wheel ahead wait in their slot until their turn comes round. """
+
+    def __init__(self, tick, slots=512):
+        """
+        Args:
+            tick (float): The length of a slot, in seconds
+            slots (int): The number of slots in the ring
+
+        """
+        super(TimerWheel, self).__init__()
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        # The item: slot index of everything scheduled
+        self._where = {}
+        # The number of the last tick advanced to, or None before the first
+        self._position = None
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, item):
+        return item in self._where
+
+    def schedule(self, item, when):
+        """ Schedule `item` to be due at time `when`, replacing any time it
+        was already scheduled for """
+        self.cancel(item)
+        tick = int(when // self.tick)
+        if self._position is not None:
+            # Items already due are returned by the next advance
+            tick = max(tick, self._position + 1)
+        index = tick % len(self._slots)
+        self._slots[index][item] = when
+        self._where[item] = index
+
+    def cancel(self, item):
+        """ Stop `item` from being due, if it is scheduled """
+        index = self._where.pop(item, None)
+        if index is not None:
+            del self._slots[index][item]
+
+    def advance(self, now):
+        """ Move the wheel on to time `now`, and return a list of the items
+        which have fallen due, in the order they were due. They are no longer
+        scheduled. """
+        target = int(now // self.tick)
+        if self._position is None:
+            self._position = target - 1
+        if target <= self._position:
+            return []
+        if target - self._position >= len(self._slots):
+            indices = range(len(self._slots))
+        else:
+            indices = [tick % len(self._slots)
+                       for tick in range(self._position + 1, target + 1)]
+        self._position = target
+        due = []
+        for index in indices:
+            slot = self._slots[index]
+            for item, when in list(slot.items()):
+                if when < (target + 1) * self.tick:
+                    due.append((when, item))
+                    del slot[item]
+                    del self._where[item]
+        due.sort(key=lambda pair: pair[0])
+        return [item for _, item in due]
+
+
+class _Tracked(object):
+
+    """ The renewal state of a subscription made by a manager """
+
+    def __init__(self, subscription, now):
+        super(_Tracked, self).__init__()
+        self.subscription = subscription
+        self.granted_at = now
+        self.renewing = False
+        self.renewals = 0
+        self.failures = 0
+        self.last_error = None
+
+    @property
+    def expires_at(self):
+        if self.subscription.timeout is None:
+            return None
+        return self.granted_at + self.subscription.timeout
+
+
+class SubscriptionManager(object):
+
+    """ Subscribes to services, through one shared aiohttp session, and
+    unsubscribes from them all when closed. """
+
+    def __init__(self, loop, event_server, max_connections=None):
+        """
+        Args:
+            loop: The event loop on which subscriptions are made.
+            event_server (soco.events.SonosEventServer): The server which
+                receives the events.
+            max_connections (int): The maximum number of connections open to
+                all speakers at once. If None,
+                :data:`soco.config.SUBSCRIPTION_MAX_CONNECTIONS` is used.
+
+        """
+        super(SubscriptionManager, self).__init__()
+        self.loop = loop
+        self.event_server = event_server
+        self._max_connections = max_connections
+        self._session = None
+        #: The :class:`soco.events.SonosSubscription` objects made by the
+        #: manager, and not yet unsubscribed
+        self.subscriptions = []
+        # The subscriptions renewed by the manager, by subscription
+        self._tracked = {}
+        self._wheel = TimerWheel(config.SUBSCRIPTION_WHEEL_TICK)
+        self._timer = None
+        self._semaphore = None
+        self._renewals = set()
+
+    @property
+    def session(self):
+        """ The :class:`aiohttp.ClientSession` used for all requests, created
+        when first needed """
+        if self._session is None or self._session.closed:
+            max_connections = self._max_connections
+            if max_connections is None:
+                max_connections = config.SUBSCRIPTION_MAX_CONNECTIONS
+            connector = aiohttp.TCPConnector(
+                limit=max_connections,
+                limit_per_host=config.HTTP_POOL_SIZE,
+                keepalive_timeout=config.HTTP_IDLE_TIMEOUT or None,
+                loop=self.loop)
+            self._session = aiohttp.ClientSession(
+                connector=connector, loop=self.loop)
+        return self._session
+
+    async def subscribe(self, service, callback_func, requested_timeout=None,
+                        auto_renew=False):
+        """ Subscribe to the events of a service. See
+        :meth:`soco.services.Service.subscribe`. If `auto_renew` is True,
+        the manager renews the subscription, on its timer wheel.
+
+        Returns:
+            soco.events.SonosSubscription: the new subscription
+
+        """
+        subscription = await service.subscribe(
+            self.loop, self.event_server, callback_func,
+            requested_timeout=requested_timeout, auto_renew=False,
+            session=self.session)
+        self.subscriptions.append(subscription)
+        if auto_renew:
+            self._tracked[subscription] = _Tracked(
+                subscription, self.loop.time())
+            self._schedule_renewal(subscription)
+        return subscription
+
+    async def subscribe_all(self, services, callback_func,
+                            requested_timeout=None, auto_renew=False):
+        """ Subscribe to the events of several services at once.
+
+        Returns:
+            list: a :class:`soco.events.SonosSubscription` for each service,
+            in the same order, or the exception raised when subscribing to
+            it failed.
+
+        """
+        results = await asyncio.gather(*[
+            self.subscribe(service, callback_func, requested_timeout,
+                           auto_renew)
+            for service in services], return_exceptions=True)
+        for service, result in zip(services, results):
+            if isinstance(result, Exception):
+                log.warning("Could not subscribe to %s on %s: %s",
+                            service.service_type, service.soco.ip_address,
+                            result)
+        return results
+
+    def _schedule_renewal(self, subscription, delay=None):
+        """ Put the next renewal of a subscription on the wheel, after
+        `delay` seconds, or if that is None, at a jittered fraction of its
+        timeout """
+        if delay is None:
+            timeout = subscription.timeout
+            if timeout is None:
+                # It never expires
+                self._wheel.cancel(subscription)
+                return
+            fraction = config.SUBSCRIPTION_RENEWAL_FRACTION + random.uniform(
+                -config.SUBSCRIPTION_RENEWAL_JITTER,
+                config.SUBSCRIPTION_RENEWAL_JITTER)
+            delay = timeout * min(max(fraction, 0), 1)
+        self._wheel.schedule(subscription, self.loop.time() + delay)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(
+                config.SUBSCRIPTION_RENEWAL_CONCURRENCY)
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._run_wheel(),
+                                                loop=self.loop)
+
+    async def _run_wheel(self):
+        """ Turn the wheel, starting the renewals which fall due, until no
+        renewals are scheduled """
+        while len(self._wheel):
+            await asyncio.sleep(self._wheel.tick)
+            for subscription in self._wheel.advance(self.loop.time()):
+                renewal = asyncio.ensure_future(
+                    self._renew(subscription), loop=self.loop)
+                self._renewals.add(renewal)
+                renewal.add_done_callback(self._renewals.discard)
+
+    async def _renew(self, subscription):
+        """ Renew a subscription, waiting for a turn if too many renewals
+        are already being made, and schedule the next one """
+        tracked = self._tracked.get(subscription)
+        if tracked is None:
+            return
+        service_type = getattr(subscription.service, 'service_type', '')
+        async with self._semaphore:
+            tracked.renewing = True
+            try:
+                await subscription.renew()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:  # pylint: disable=broad-except
+                tracked.failures += 1
+                tracked.last_error = error
+                metrics.subscription_renewals.inc(service_type, 'error')
+                log.warning("Could not renew subscription %s: %s",
+                            subscription.sid, error)
+                if subscription in self._tracked:
+                    self._schedule_renewal(
+                        subscription, config.SUBSCRIPTION_RETRY_INTERVAL)
+                return
+            finally:
+                tracked.renewing = False
+        tracked.granted_at = self.loop.time()
+        tracked.renewals += 1
+        tracked.last_error = None
+        metrics.subscription_renewals.inc(service_type, 'ok')
+        if subscription in self._tracked:
+            self._schedule_renewal(subscription)
+
+    def health(self):
+        """ Return a list of :class:`SubscriptionHealth` tuples, one for each
+        subscription which the manager renews """
+        now = self.loop.time()
+        result = []
+        for tracked in self._tracked.values():
+            subscription = tracked.subscription
+            expires_at = tracked.expires_at
+            if expires_at is not None and expires_at <= now:
+                state = 'expired'
+            elif tracked.renewing:
+                state = 'renewing'
+            elif tracked.last_error is not None:
+                state = 'retrying'
+            else:
+                state = 'ok'
+            service = subscription.service
+            result.append(SubscriptionHealth(
+                subscription.sid,
+                getattr(getattr(service, 'soco', None), 'ip_address', None),
+                getattr(service, 'service_type', None),
+                state,
+                None if expires_at is None else expires_at - now,
+                tracked.renewals, tracked.failures, tracked.last_error))
+        return result
+
+    def _forget(self, subscription):
+        """ Stop tracking and renewing a subscription """
+        try:
+            self.subscriptions.remove(subscription)
+        except ValueError:
+            pass
+        self._tracked.pop(subscription, None)
+        self._wheel.cancel(subscription)
+
+    async def unsubscribe(self, subscription):
+        """ Unsubscribe one of the manager's subscriptions """
+        self._forget(subscription)
+        await subscription.unsubscribe()
+
+    async def unsubscribe_all(self):
+        """ Unsubscribe all of the manager's subscriptions. Failures are
+        logged, not raised, since the speaker forgets the subscription when
+        it expires anyway. """
+        subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            self._forget(subscription)
+        results = await asyncio.gather(*[
+            subscription.unsubscribe() for subscription in subscriptions],
+            return_exceptions=True)
+        for subscription, result in zip(subscriptions, results):
+            if isinstance(result, Exception):
+                log.warning("Could not unsubscribe %s: %s",
+                            subscription.sid, result)
+
+    async def close(self):
+        """ Unsubscribe everything, stop renewing, and close the session """
+        tasks = list(self._renewals)
+        if self._timer is not None:
+            tasks.append(self._timer)
+            self._timer = None
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.unsubscribe_all()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+""" Wire tracing: a record of recent HTTP exchanges with each speaker
+
+When :data:`soco.config.WIRE_TRACE_ENABLED` is True, every HTTP request made
+to a speaker, and its response, is recorded as raw bytes, with its status and
+timing, in a ring buffer for that speaker. Only the last
+:data:`soco.config.WIRE_TRACE_BUFFER_SIZE` exchanges with each speaker are
+kept. When tracing is disabled (the default), nothing is recorded, and the
+cost is a single check of the setting for each request.
+
+The buffers can be read with :func:`records` or written out with :func:`dump`
+at any time::
+
+    >>> from soco import config, trace
+    >>> config.WIRE_TRACE_ENABLED = True
+    >>> # ... later, after something odd happened
+    >>> trace.dump('192.168.1.101')
+
+If :data:`soco.config.WIRE_TRACE_DUMP_ON_ERROR` is True, the buffer for a
+speaker is also logged, at WARNING level, whenever a command sent to it
+fails.
+
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+from .compat import monotonic
+from .utils import prettify
+from soco import config
+
+log = logging.getLogger(__name__)  # pylint: disable=C0103
+
+#: One HTTP exchange with a speaker. `timestamp` is the wall clock time at
+#: which the request was sent, and `duration` the number of seconds until
+#: the response (or error) was received. The bodies are bytes. `status`,
+#: `response_headers` and `response_body` are None, and `error` is the
+#: exception, if no response was received.
+TraceRecord = namedtuple('TraceRecord', [
+    'timestamp', 'speaker', 'method', 'url', 'request_headers',
+    'request_body', 'status', 'response_headers', 'response_body',
+    'duration', 'error'])
+
+
+def _to_bytes(body):
+    """ Return a request or response body as bytes """
+    if body is None or isinstance(body, bytes):
+        return body
+    return body.encode('utf-8')
+
+
+def _format_body(body, pretty):
+    """ Format a body as text, for a dump """
+    if not body:
+        return ''
+    text = body.decode('utf-8', 'replace')
+    if pretty:
+        try:
+            return prettify(text)
+        except Exception:  # pylint: disable=broad-except
+            pass
+    return text
+
+
+def format_record(record, pretty=False):
+    """ Format a :class:`TraceRecord` as text
+
+    Args:
+        record (TraceRecord): The record
+        pretty (bool): If True, indent XML bodies for reading
+
+    """
+    lines = ['{0} {1} {2} {3} -> {4} in {5:.1f} ms'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S',
+                      time.localtime(record.timestamp)),
+        record.speaker, record.method, record.url,
+        record.status if record.error is None else repr(record.error),
+        record.duration * 1000)]
+    for name, value in sorted((record.request_headers or {}).items()):
+        lines.append('> {0}: {1}'.format(name, value))
+    lines.append(_format_body(record.request_body, pretty))
+    for name, value in sorted((record.response_headers or {}).items()):
+        lines.append('< {0}: {1}'.format(name, value))
+    lines.append(_format_body(record.response_body, pretty))
+    return '\n'.join(lines)
+
+
+class WireTracer(object):
+
+    """ Ring buffers of :class:`TraceRecord` objects, one for each
+    speaker """
+
+    def __init__(self, size=None):
+        """
+        Args:
+            size (int): The number of records to keep for each speaker. If
+                None, :data:`soco.config.WIRE_TRACE_BUFFER_SIZE` is used.
+
+        """
+        super(WireTracer, self).__init__()
+        self._size = size
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        """ Add a :class:`TraceRecord` to the buffer for its speaker """
+        buffer_ = self._buffers.get(record.speaker)
+        if buffer_ is None:
+            with self._lock:
+                buffer_ = self._buffers.get(record.speaker)
+                if buffer_ is None:
+                    buffer_ = self._buffers[record.speaker] = deque(
+                        maxlen=self._size or config.WIRE_TRACE_BUFFER_SIZE)
+        # deque.append is atomic
+        buffer_.append(record)
+
+    def records(self, speaker=None):
+        """ Return a list of the records for the speaker with ip address
+        `speaker`, oldest first, or for all speakers if it is None """
+        with self._lock:
+            if speaker is not None:
+                return list(self._buffers.get(speaker, ()))
+            result = [record for buffer_ in self._buffers.values()
+                      for record in list(buffer_)]
+        result.sort(key=lambda record: record.timestamp)
+        return result
+
+    def dump(self, speaker=None, stream=None, pretty=False):
+        """ Write the records for a speaker, or all speakers, as text
+
+        Args:
+            speaker (str): The ip address of the speaker, or None for all
+            stream: A file-like object to write to. Defaults to stderr.
+            pretty (bool): If True, indent XML bodies for reading
+
+        """
+        if stream is None:
+            stream = sys.stderr
+        for record in self.records(speaker):
+            stream.write(format_record(record, pretty))
+            stream.write('\n\n')
+
+    def clear(self, speaker=None):
+        """ Forget the records for a speaker, or all speakers """
+        with self._lock:
+            if speaker is None:
+                self._buffers.clear()
+            else:
+                self._buffers.pop(speaker, None)
+
+
+#: The tracer used for all speakers
+tracer = WireTracer()  # pylint: disable=invalid-name
+
+
+def records(speaker=None):
+    """ Return the recorded exchanges with a speaker, or all speakers. See
+    :meth:`WireTracer.records` """
+    return tracer.records(speaker)
+
+
+def dump(speaker=None, stream=None, pretty=False):
+    """ Write the recorded exchanges with a speaker, or all speakers. See
+    :meth:`WireTracer.dump` """
+    tracer.dump(speaker, stream, pretty)
+
+
+def record_exchange(speaker, method, url, headers, body, start, status=None,
+                    response_headers=None, response_body=None, error=None):
+    """ Record an exchange with a speaker. `start` is the value of
+    :func:`soco.compat.monotonic` when the request was sent. """
+    duration = monotonic() - start
+    tracer.record(TraceRecord(
+        time.time() - duration, speaker, method, url,
+        dict(headers) if headers else {}, _to_bytes(body), status,
+        dict(response_headers) if response_headers is not None else None,
+        response_body, duration, error))
+
+
+def traced_request(session, speaker, method, url, **kwargs):
+    """ Send a request with a :class:`requests.Session`, and record it """
+    start = monotonic()
+    try:
+        response = session.request(method, url, **kwargs)
+    except Exception as error:
+        record_exchange(speaker, method, url, kwargs.get('headers'),
+                        kwargs.get('data'), start, error=error)
+        raise
+    record_exchange(speaker, method, url, kwargs.get('headers'),
+                    kwargs.get('data'), start, response.status_code,
+                    response.headers, response.content)
+    return response
+
+
+def log_on_error(speaker):
+    """ Log the recent exchanges with a speaker after a failed command, if
+    :data:`soco.config.WIRE_TRACE_DUMP_ON_ERROR` is True """
+    if not (config.WIRE_TRACE_ENABLED and config.WIRE_TRACE_DUMP_ON_ERROR):
+        return
+    log.warning("Recent exchanges with %s:\n%s", speaker, '\n\n'.join(
+        format_record(record) for record in tracer.records(speaker)))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+""" Tests for the aio module """
+
+from __future__ import unicode_literals
+
+import asyncio
+
+import aiohttp.web
+import mock
+import pytest
+
+from soco import SoCo
+from soco.aio import AsyncSoCo
+from soco.connection import close_client_session
+from soco.exceptions import SoCoUPnPException
+
+IP_ADDR = '192.168.1.201'
+
+VALID_RESPONSE = "".join([
+    '<?xml version="1.0"?>',
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"',
+    ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">',
+    '<s:Body>',
+    '<u:GetVolumeResponse ',
+    'xmlns:u="urn:schemas-upnp-org:service:RenderingControl:1">',
+    '<CurrentVolume>17</CurrentVolume>',
+    '</u:GetVolumeResponse>',
+    '</s:Body>',
+    '</s:Envelope>'])
+
+ERROR_RESPONSE = "".join([
+    '<?xml version="1.0"?>',
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"',
+    ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">',
+    '<s:Body><s:Fault><faultcode>s:Client</faultcode>',
+    '<faultstring>UPnPError</faultstring><detail>',
+    '<UPnPError xmlns="urn:schemas-upnp-org:control-1-0">',
+    '<errorCode>402</errorCode></UPnPError>',
+    '</detail></s:Fault></s:Body></s:Envelope>'])
+
+
+def run(coroutine):
+    """ Run a coroutine to completion on a fresh event loop """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(close_client_session(loop))
+        loop.close()
+
+
+async def serve(handler):
+    """ Start a local web server which answers every POST with `handler`.
+    Return the runner and the base url """
+    app = aiohttp.web.Application()
+    app.router.add_route('POST', '/{tail:.*}', handler)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    site = aiohttp.web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://127.0.0.1:{0}'.format(port)
+
+
+def test_async_send_command():
+    requests_seen = []
+
+    async def handler(request):
+        requests_seen.append((request.headers['SOAPACTION'],
+                              await request.read()))
+        return aiohttp.web.Response(
+            body=VALID_RESPONSE.encode('utf-8'),
+            content_type='text/xml', charset='utf-8')
+
+    async def main():
+        runner, url = await serve(handler)
+        service = SoCo(IP_ADDR).renderingControl
+        service.base_url = url
+        try:
+            args = [('InstanceID', 0), ('Channel', 'Master')]
+            result = await service.async_send_command(
+                'GetVolume', args, cache_timeout=10)
+            # The second call is answered from the cache
+            cached = await service.async_send_command('GetVolume', args)
+        finally:
+            service.base_url = 'http://{0}:1400'.format(IP_ADDR)
+            service.cache.clear()
+            await runner.cleanup()
+        return result, cached
+
+    result, cached = run(main())
+    assert result == cached == {'CurrentVolume': '17'}
+    assert len(requests_seen) == 1
+    soap_action, body = requests_seen[0]
+    assert soap_action.endswith('RenderingControl:1#GetVolume')
+    assert b'<Channel>Master</Channel>' in body
+
+
+def test_async_send_command_upnp_error():
+    async def handler(request):
+        return aiohttp.web.Response(
+            status=500, body=ERROR_RESPONSE.encode('utf-8'))
+
+    async def main():
+        runner, url = await serve(handler)
+        service = SoCo(IP_ADDR).renderingControl
+        service.base_url = url
+        try:
+            await service.async_send_command('GetVolume')
+        finally:
+            service.base_url = 'http://{0}:1400'.format(IP_ADDR)
+            await runner.cleanup()
+
+    with pytest.raises(SoCoUPnPException) as error:
+        run(main())
+    assert error.value.error_code == '402'
+
+
+def test_async_soco_methods():
+    speaker = AsyncSoCo(IP_ADDR, session=mock.Mock())
+    assert speaker.soco is SoCo(IP_ADDR)
+    send = mock.AsyncMock(return_value={'CurrentVolume': '42'})
+    with mock.patch.object(AsyncSoCo, '_send', send):
+        assert run(speaker.volume()) == 42
+        send.assert_called_with(
+            speaker.soco.renderingControl, 'GetVolume',
+            [('InstanceID', 0), ('Channel', 'Master')])
+        run(speaker.set_volume(120))
+        send.assert_called_with(
+            speaker.soco.renderingControl, 'SetVolume',
+            [('InstanceID', 0), ('Channel', 'Master'),
+             ('DesiredVolume', 100)])
+
+
+def test_async_soco_only_on_master():
+    speaker = AsyncSoCo(IP_ADDR, session=mock.Mock())
+    send = mock.AsyncMock()
+    with mock.patch.object(AsyncSoCo, '_send', send):
+        with mock.patch.object(
+                AsyncSoCo, 'is_coordinator',
+                mock.AsyncMock(return_value=False)):
+            with pytest.raises(Exception) as error:
+                run(speaker.play())
+            assert 'coordinator' in str(error.value)
+            assert not send.called
+        with mock.patch.object(
+                AsyncSoCo, 'is_coordinator',
+                mock.AsyncMock(return_value=True)):
+            run(speaker.play())
+            send.assert_called_once_with(
+                speaker.soco.avTransport, 'Play',
+                [('InstanceID', 0), ('Speed', 1)])
+
+
+def test_async_topology_stale_while_revalidate():
+    from soco.services import zone_group_state_shared_cache
+    zone_group_state_shared_cache.clear()
+    speaker = AsyncSoCo('192.168.1.207', session=mock.Mock())
+    send = mock.AsyncMock(return_value={'ZoneGroupState': '<ZoneGroups/>'})
+    group = mock.Mock(members=[mock.Mock(is_visible=True)])
+    try:
+        with mock.patch.object(AsyncSoCo, '_send', send), \
+                mock.patch('soco.core.parser.parse_zone_group_state',
+                           return_value=[group]):
+            with mock.patch('soco.core.monotonic', return_value=100):
+                assert len(run(speaker.all_zones())) == 1
+            assert send.call_count == 1
+            # Stale: as with SoCo, the topology is refreshed in the
+            # background, rather than waited for
+            zone_group_state_shared_cache.clear()
+            with mock.patch('soco.core.monotonic', return_value=110), \
+                    mock.patch('soco.core.threading.Thread') as thread:
+                assert len(run(speaker.all_zones())) == 1
+            assert send.call_count == 1
+            assert thread.call_count == 1
+    finally:
+        zone_group_state_shared_cache.clear()
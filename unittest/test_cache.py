@@ -2,11 +2,17 @@
 """ Tests for the cache module """
 
 from __future__ import unicode_literals
-from soco.cache import Cache, NullCache, TimedCache
+import mock
+from soco.cache import (
+    Cache, NullCache, TimedCache, LRUCache, SharedCache, LazyCache,
+    live_caches)
 
 def test_instance_creation():
-    assert isinstance(Cache(), TimedCache)
+    assert isinstance(Cache(), LRUCache)
     from soco import config
+    config.CACHE_CLASS = TimedCache
+    assert isinstance(Cache(), TimedCache)
+    config.CACHE_CLASS = None
     config.CACHE_ENABLED = False
     assert isinstance(Cache(), NullCache)
     config.CACHE_ENABLED = True
@@ -69,3 +75,205 @@ def test_cache_disable():
     assert cache.get('some', kw='args') == None
 
 
+def test_lru_eviction():
+    cache = LRUCache(max_entries=3, shards=1)
+    for index in range(3):
+        cache.put(index, 'Browse', [('StartingIndex', index)], timeout=10)
+    # Use the first, so that the second is the least recently used
+    assert cache.get('Browse', [('StartingIndex', 0)]) == 0
+    cache.put(3, 'Browse', [('StartingIndex', 3)], timeout=10)
+    assert len(cache) == 3
+    assert cache.get('Browse', [('StartingIndex', 1)]) is None
+    assert cache.get('Browse', [('StartingIndex', 0)]) == 0
+    assert cache.get('Browse', [('StartingIndex', 3)]) == 3
+
+
+def test_lru_byte_limit():
+    cache = LRUCache(max_bytes=2000, shards=1)
+    cache.put('x' * 800, 'first', timeout=10)
+    cache.put('y' * 800, 'second', timeout=10)
+    cache.put('z' * 800, 'third', timeout=10)
+    assert cache.get('first') is None
+    assert cache.get('third') == 'z' * 800
+    # Items bigger than the limit are not cached at all
+    cache.put('w' * 5000, 'huge', timeout=10)
+    assert cache.get('huge') is None
+
+
+def test_lru_expiry_and_purge():
+    cache = LRUCache(shards=2)
+    with mock.patch('soco.cache.monotonic', return_value=100):
+        cache.put('item', 'GetVolume', timeout=5)
+        cache.put('other', 'GetMute', timeout=50)
+        cache.put('never', 'Play', timeout=0)
+        assert len(cache) == 2
+    with mock.patch('soco.cache.monotonic', return_value=110):
+        assert cache.purge_expired() == 1
+        assert cache.get('GetVolume') is None
+        assert cache.get('GetMute') == 'other'
+
+
+def test_lru_structural_key():
+    key = LRUCache.make_key(('SetVolume', [('DesiredVolume', 1)]), {})
+    assert key == LRUCache.make_key(('SetVolume', [('DesiredVolume', 1)]), {})
+    assert key != LRUCache.make_key(
+        ('SetVolume', [('DesiredVolume', True)]), {})
+    hash(key)
+
+
+def test_lru_stats_and_entries():
+    cache = LRUCache(max_entries=2, shards=1, name='test')
+    with mock.patch('soco.cache.monotonic', return_value=100):
+        cache.put('on', 'GetLEDState', [], timeout=10)
+        assert cache.get('GetLEDState', []) == 'on'
+        assert cache.get('GetVolume', [('Channel', 'Master')]) is None
+        cache.put(10, 'GetVolume', [('Channel', 'Master')], timeout=2)
+        cache.put(0, 'GetBass', [], timeout=5)
+        entries = cache.entries()
+        assert [(entry.action, entry.ttl, entry.item)
+                for entry in entries] == [('GetVolume', 2, 10),
+                                          ('GetBass', 5, 0)]
+    with mock.patch('soco.cache.monotonic', return_value=103):
+        assert cache.get('GetVolume', [('Channel', 'Master')]) is None
+    stats = cache.stats()
+    assert stats['name'] == 'test'
+    assert stats['size'] == 1
+    assert stats['actions']['GetLEDState'] == {
+        'hits': 1, 'misses': 0, 'expirations': 0, 'evictions': 1,
+        'hit_ratio': 1.0}
+    assert stats['actions']['GetVolume'] == {
+        'hits': 0, 'misses': 2, 'expirations': 1, 'evictions': 0,
+        'hit_ratio': 0.0}
+    assert stats['totals']['hits'] == 1
+    assert stats['totals']['misses'] == 2
+    cache.reset_stats()
+    assert cache.stats()['actions'] == {}
+    assert cache in live_caches()
+
+
+def test_shared_cache_across_instances(tmpdir):
+    "Caches with the same name share items through the database"
+    path = str(tmpdir.join('shared.sqlite'))
+    first = SharedCache(name='a', path=path)
+    second = SharedCache(name='a', path=path)
+    other = SharedCache(name='b', path=path)
+    first.put({'CurrentVolume': '36'}, 'GetVolume', [('Channel', 'Master')],
+              timeout=10)
+    assert second.get('GetVolume', [('Channel', 'Master')]) == {
+        'CurrentVolume': '36'}
+    assert other.get('GetVolume', [('Channel', 'Master')]) is None
+    second.delete_action('GetVolume')
+    assert first.get('GetVolume', [('Channel', 'Master')]) is None
+    assert first.stats()['actions']['GetVolume']['hits'] == 0
+
+
+def test_shared_cache_expiry_and_limit(tmpdir):
+    path = str(tmpdir.join('shared.sqlite'))
+    cache = SharedCache(name='a', path=path, max_entries=3)
+    with mock.patch('soco.cache.time', return_value=1000):
+        for number in range(5):
+            cache.put(number, 'item', number, timeout=10 + number)
+        cache.put('gone', 'expired', timeout=0)
+        assert len(cache) == 3
+        # Those closest to expiry were removed
+        assert cache.get('item', 0) is None
+        assert cache.get('item', 4) == 4
+    with mock.patch('soco.cache.time', return_value=1013.5):
+        assert cache.get('item', 2) is None
+        assert cache.purge_expired() == 2
+        assert [entry.item for entry in cache.entries()] == [4]
+
+
+def test_shared_cache_purges_without_limit(tmpdir):
+    "Expired items are removed now and then, even with no limit"
+    import sqlite3
+    from soco import config
+    path = str(tmpdir.join('shared.sqlite'))
+    cache = SharedCache(name='a', path=path, max_entries=0)
+
+    def rows():
+        return sqlite3.connect(path).execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    with mock.patch('soco.cache.time', return_value=1000), \
+            mock.patch('soco.cache.monotonic', return_value=50):
+        for number in range(5):
+            cache.put(number, 'item', number, timeout=1)
+    # Expired, but purged at most every SHARED_CACHE_PURGE_INTERVAL seconds
+    with mock.patch('soco.cache.time', return_value=1010), \
+            mock.patch('soco.cache.monotonic', return_value=60):
+        cache.put(5, 'item', 5, timeout=100)
+    assert rows() == 6
+    with mock.patch('soco.cache.time', return_value=1100), \
+            mock.patch('soco.cache.monotonic',
+                       return_value=50 + config.SHARED_CACHE_PURGE_INTERVAL):
+        cache.put(6, 'item', 6, timeout=100)
+    assert rows() == 2
+
+
+def test_shared_cache_is_private_json(tmpdir):
+    "The database is created 0600, and holds JSON rather than pickles"
+    import os
+    import sqlite3
+    path = str(tmpdir.join('shared.sqlite'))
+    cache = SharedCache(name='a', path=path)
+    cache.put({'CurrentMute': '1'}, 'GetMute', [('Channel', 'Master')],
+              timeout=10)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    row = sqlite3.connect(path).execute(
+        'SELECT key, item FROM entries').fetchone()
+    assert row == ('[[["GetMute",[["Channel","Master"]]],{}],{}]',
+                   '{"CurrentMute":"1"}')
+    # Items which are not JSON are not cached
+    cache.put(object(), 'GetObject', timeout=10)
+    assert cache.get('GetObject') is None
+
+
+def test_shared_cache_refuses_open_file(tmpdir):
+    "A database which other users can write is not used"
+    import os
+    path = str(tmpdir.join('shared.sqlite'))
+    tmpdir.join('shared.sqlite').write('')
+    os.chmod(path, 0o644)
+    cache = SharedCache(name='a', path=path)
+    with mock.patch('soco.cache.log') as log:
+        cache.put({'CurrentVolume': '36'}, 'GetVolume', timeout=10)
+        assert cache.get('GetVolume') is None
+    assert log.warning.called
+    assert tmpdir.join('shared.sqlite').read() == ''
+
+
+def test_default_shared_cache_path(tmpdir):
+    import os
+    from soco.cache import default_shared_cache_path
+    os.chmod(str(tmpdir), 0o700)
+    with mock.patch.dict('os.environ', {'XDG_RUNTIME_DIR': str(tmpdir)}):
+        assert default_shared_cache_path() == str(
+            tmpdir.join('soco-cache.sqlite'))
+    os.chmod(str(tmpdir), 0o755)
+    with mock.patch.dict('os.environ', {'XDG_RUNTIME_DIR': str(tmpdir)}):
+        try:
+            default_shared_cache_path()
+        except OSError:
+            pass
+        else:
+            assert False, "OSError not raised"
+    with mock.patch.dict('os.environ', {'XDG_RUNTIME_DIR': ''}), \
+            mock.patch('os.path.isdir', return_value=False), \
+            mock.patch('tempfile.gettempdir', return_value=str(tmpdir)):
+        path = default_shared_cache_path()
+    directory = os.path.dirname(path)
+    assert os.path.dirname(directory) == str(tmpdir)
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+
+def test_lazy_cache_follows_config():
+    from soco import config
+    cache = LazyCache(name='lazy')
+    config.CACHE_CLASS = TimedCache
+    try:
+        cache.put('item', 'some', timeout=10)
+        assert isinstance(cache.cache, TimedCache)
+        assert cache.get('some') == 'item'
+    finally:
+        config.CACHE_CLASS = None
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+""" Tests for the connection module """
+
+from __future__ import unicode_literals
+
+import threading
+
+import mock
+
+from soco import config
+from soco.connection import SpeakerSession, SessionRegistry
+
+
+def test_registry_shares_sessions():
+    registry = SessionRegistry()
+    session = registry.get('192.168.1.101')
+    assert registry.get('192.168.1.101') is session
+    assert registry.get('192.168.1.102') is not session
+
+
+def test_session_reused_between_requests():
+    session = SpeakerSession('192.168.1.101', pool_size=2, idle_timeout=60)
+    with mock.patch('requests.Session.request') as fake_request:
+        session.get('http://192.168.1.101:1400/xml/device_description.xml')
+        first = session._session
+        session.post('http://192.168.1.101:1400/Service/Control', data=b'')
+        assert session._session is first
+    assert fake_request.call_count == 2
+    fake_request.assert_called_with(
+        'POST', 'http://192.168.1.101:1400/Service/Control', data=b'',
+        timeout=config.REQUEST_TIMEOUT)
+    adapter = first.get_adapter('http://192.168.1.101:1400/')
+    assert adapter._pool_maxsize == 2
+
+
+def test_idle_session_is_evicted():
+    session = SpeakerSession('192.168.1.101', idle_timeout=10)
+    with mock.patch('soco.connection.monotonic', return_value=100):
+        with mock.patch('requests.Session.request'):
+            session.get('http://192.168.1.101:1400/')
+        first = session._session
+        assert not session.evict_idle()
+    with mock.patch('soco.connection.monotonic', return_value=200):
+        with mock.patch('requests.Session.request'):
+            session.get('http://192.168.1.101:1400/')
+        # The old connections are closed and a new session used
+        assert session._session is not first
+    with mock.patch('soco.connection.monotonic', return_value=300):
+        assert session.evict_idle()
+    assert session._session is None
+
+
+def test_session_in_use_is_not_evicted():
+    session = SpeakerSession('192.168.1.101', idle_timeout=10)
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow_request(*args, **kwargs):
+        started.set()
+        finish.wait(5)
+
+    with mock.patch('requests.Session.request', side_effect=slow_request):
+        thread = threading.Thread(
+            target=session.get, args=('http://192.168.1.101:1400/',))
+        thread.start()
+        started.wait(5)
+        with mock.patch('soco.connection.monotonic', return_value=1e9):
+            assert not session.evict_idle()
+        finish.set()
+        thread.join()
+    assert session._in_use == 0
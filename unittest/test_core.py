@@ -4,7 +4,7 @@ from __future__ import unicode_literals
 import pytest
 import mock
 
-from soco import SoCo
+from soco import SoCo, config
 from soco.groups import ZoneGroup
 from soco.xml import XML
 from soco.data_structures import DidlMusicTrack, to_didl_string
@@ -333,6 +333,15 @@ class TestAVTransport:
                 ('CurrentURIMetaData', '')]
         )
 
+    def test_partymode(self, moco):
+        zones = [moco, mock.Mock(), mock.Mock()]
+        with mock.patch.object(
+                type(moco), 'visible_zones', return_value=set(zones)):
+            with mock.patch('soco.core.fan_out') as fake_fan_out:
+                moco.partymode()
+        fake_fan_out.assert_called_once_with(mock.ANY, 'join', args=(moco,))
+        assert set(fake_fan_out.call_args[0][0]) == set(zones[1:])
+
     def test_unjoin(self, moco):
         moco.unjoin()
         moco.avTransport.BecomeCoordinatorOfStandaloneGroup\
@@ -821,3 +830,81 @@ def test_not_on_master_false(moco_only_on_master):
         with pytest.raises(SoCoSlaveException):
             moco_only_on_master.play()
         is_coord.assert_called_once_with()
+
+
+def test_topology_stale_while_revalidate():
+    from soco.services import zone_group_state_shared_cache
+    zone_group_state_shared_cache.clear()
+    speaker = SoCo('192.168.1.202')
+    # Parsing real topology would query each member
+    group = mock.Mock(members=[mock.Mock(is_visible=True)])
+    with mock.patch.object(speaker, 'zoneGroupTopology') as topology:
+        get_zgs = topology.GetZoneGroupState
+        get_zgs.side_effect = lambda **kwargs: {
+            'ZoneGroupState': '<ZoneGroups{0}/>'.format(get_zgs.call_count)}
+        with mock.patch('soco.core.parser.parse_zone_group_state',
+                        return_value=[group]), \
+                mock.patch('soco.core.monotonic', return_value=100):
+            assert len(speaker.all_zones()) > 0
+            assert get_zgs.call_count == 1
+        # Fresh: no request at all
+        with mock.patch('soco.core.monotonic', return_value=103):
+            speaker.all_zones()
+            assert get_zgs.call_count == 1
+        # Stale: the old topology is returned, and refreshed in the
+        # background
+        with mock.patch('soco.core.monotonic', return_value=110):
+            with mock.patch('soco.core.threading.Thread') as thread:
+                zones = speaker.all_zones()
+                speaker.all_zones()
+            assert zones == speaker._all_zones
+            assert get_zgs.call_count == 1
+            # Only one refresh is started
+            assert thread.call_count == 1
+            thread.call_args[1]['target']()
+            assert get_zgs.call_count == 2
+        # Too stale: callers wait for a fresh copy
+        with mock.patch('soco.core.monotonic', return_value=200):
+            speaker.all_zones()
+            assert get_zgs.call_count == 3
+        # A copy from the shared cache is used, but counts as fetched when
+        # it was put there, or if that is not known, TOPOLOGY_TTL ago
+        zone_group_state_shared_cache.put(
+            {'ZoneGroupState': '<ZoneGroups/>'}, 'GetZoneGroupState', None,
+            timeout=10)
+        try:
+            with mock.patch('soco.core.parser.parse_zone_group_state',
+                            return_value=[group]), \
+                    mock.patch('soco.core.monotonic', return_value=300):
+                speaker.all_zones()
+            assert get_zgs.call_count == 3
+            assert speaker._zgs_cache == '<ZoneGroups/>'
+            assert speaker._zgs_fetched_at == 300 - config.TOPOLOGY_TTL
+        finally:
+            zone_group_state_shared_cache.clear()
+
+
+def test_topology_first_taken_from_shared_cache():
+    "The age of a topology taken from the shared cache is kept"
+    from soco.services import (
+        zone_group_state_shared_cache, stamp_zone_group_state)
+    zone_group_state_shared_cache.clear()
+    speaker = SoCo('192.168.1.206')
+    zone_group_state_shared_cache.put(
+        {'ZoneGroupState': '<ZoneGroups/>'}, 'GetZoneGroupState', None,
+        timeout=10)
+    with mock.patch('soco.services.time', return_value=1000):
+        stamp_zone_group_state('<ZoneGroups/>', 10)
+    group = mock.Mock(members=[mock.Mock(is_visible=True)])
+    try:
+        with mock.patch.object(speaker, 'zoneGroupTopology') as topology, \
+                mock.patch('soco.core.parser.parse_zone_group_state',
+                           return_value=[group]), \
+                mock.patch('soco.services.time', return_value=1003), \
+                mock.patch('soco.core.monotonic', return_value=100):
+            assert len(speaker.all_zones()) > 0
+            assert not topology.GetZoneGroupState.called
+            # Fetched 3 seconds ago, not now, and not never
+            assert speaker._zgs_fetched_at == 97
+    finally:
+        zone_group_state_shared_cache.clear()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+""" Tests for the event_capture module """
+
+from __future__ import unicode_literals
+
+import asyncio
+
+import pytest
+
+from soco.event_capture import (
+    CapturedEvent, EventRecorder, benchmark, read_capture)
+
+BODY = (
+    '<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+    '<e:property><SystemUpdateID>{0}</SystemUpdateID></e:property>'
+    '</e:propertyset>')
+
+
+def events(count, interval=0.0):
+    """ `count` events for one subscription, `interval` seconds apart """
+    return [CapturedEvent(
+        1000.0 + seq * interval,
+        {'sid': 'uuid:sub-1', 'seq': str(seq), 'nt': 'upnp:event',
+         'nts': 'upnp:propchange'},
+        BODY.format(seq).encode('utf-8')) for seq in range(count)]
+
+
+def run(coroutine):
+    """ Run a coroutine to completion on a fresh event loop """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_capture_round_trip(tmpdir):
+    path = str(tmpdir.join('capture.events'))
+    with EventRecorder(path) as recorder:
+        recorder.record({'SID': 'uuid:sub-1', 'SEQ': '0', 'Host': 'x'},
+                        b'<body/>', timestamp=1000.5)
+        recorder.record({'SID': 'uuid:sub-1', 'SEQ': '1'}, b'', 1001.0)
+    assert recorder.count == 2
+    assert list(read_capture(path)) == [
+        CapturedEvent(1000.5, {'sid': 'uuid:sub-1', 'seq': '0'},
+                      b'<body/>'),
+        CapturedEvent(1001.0, {'sid': 'uuid:sub-1', 'seq': '1'}, b''),
+    ]
+
+
+def test_read_capture_rejects_other_files(tmpdir):
+    path = tmpdir.join('other')
+    path.write('not a capture')
+    with pytest.raises((ValueError, IOError, OSError)):
+        list(read_capture(str(path)))
+
+
+def test_benchmark():
+    report = run(benchmark(events(20)))
+    assert report.count == 20
+    assert report.errors == 0
+    assert report.parse[0] == 20
+    assert report.dispatch[0] == 20
+    assert report.throughput > 0
+    assert '20 events' in report.format()
+
+
+def test_replay_at_original_speed():
+    report = run(benchmark(events(3, interval=0.05), speed=1))
+    assert report.errors == 0
+    assert report.elapsed >= 0.1
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+""" Tests for SonosEventServer """
+
+from __future__ import unicode_literals
+
+import asyncio
+import threading
+
+import mock
+import pytest
+
+from soco import config, metrics, parser
+from soco.events import (
+    SonosEventServer, SonosEvent, EventQueue, compare_sequence, SEQ_OK,
+    SEQ_DUPLICATE, SEQ_GAP, SEQ_MAX, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE,
+    OVERFLOW_BLOCK)
+from soco.parser import EventVariables
+
+EVENT = (
+    b'<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+    b'<e:property><SystemUpdateID>12</SystemUpdateID></e:property>'
+    b'</e:propertyset>')
+
+
+@pytest.fixture()
+def loop():
+    """ A new event loop """
+    event_loop = asyncio.new_event_loop()
+    yield event_loop
+    event_loop.close()
+
+
+@pytest.fixture()
+def server(loop):
+    """ An event server which is not listening """
+    event_server = SonosEventServer(loop, '127.0.0.1', 0)
+    yield event_server
+    deliveries = list(event_server._deliveries.values())
+    for delivery in deliveries:
+        delivery.cancel()
+    if deliveries:
+        loop.run_until_complete(
+            asyncio.gather(*deliveries, return_exceptions=True))
+
+
+def notify(server, seq, sid='uuid:sub-1'):
+    """ Pass a NOTIFY request with sequence number `seq` to the server """
+    request = mock.Mock(method='NOTIFY', headers={'sid': sid, 'seq': seq})
+    future = asyncio.Future(loop=server.loop)
+    future.set_result(EVENT)
+    request.read.return_value = future
+    return server.loop.run_until_complete(
+        server.handle_incoming_event(request))
+
+
+def test_compare_sequence():
+    assert compare_sequence(None, 0) == SEQ_OK
+    assert compare_sequence(None, 5) == SEQ_GAP
+    assert compare_sequence(4, 5) == SEQ_OK
+    assert compare_sequence(4, 7) == SEQ_GAP
+    assert compare_sequence(4, 4) == SEQ_DUPLICATE
+    assert compare_sequence(4, 2) == SEQ_DUPLICATE
+    # Wrapping round skips 0
+    assert compare_sequence(SEQ_MAX, 1) == SEQ_OK
+    assert compare_sequence(SEQ_MAX - 1, 2) == SEQ_GAP
+    assert compare_sequence(1, SEQ_MAX) == SEQ_DUPLICATE
+    # 0 again after others is a restart, but a repeated 0 is a duplicate
+    assert compare_sequence(7, 0) == SEQ_OK
+    assert compare_sequence(0, 0) == SEQ_DUPLICATE
+
+
+def test_duplicates_dropped_before_parsing(server):
+    received = []
+
+    async def callback(event):
+        received.append(event.seq)
+
+    service = mock.Mock(service_type='ContentDirectory')
+    server.register_callback_for_service_id('uuid:sub-1', callback)
+    server.register_service_for_service_id('uuid:sub-1', service)
+    before = metrics.event_duplicates.get('ContentDirectory')
+    with mock.patch('soco.parser.parse_event',
+                    wraps=parser.parse_event) as parse:
+        for seq in ('0', '1', '1', '0', '1'):
+            notify(server, seq)
+        server.loop.run_until_complete(asyncio.sleep(0))
+    # The second '0' restarts the sequence
+    assert received == ['0', '1', '0', '1']
+    assert parse.call_count == 4
+    assert metrics.event_duplicates.get('ContentDirectory') == before + 1
+
+
+def test_gap_triggers_resync(server):
+    received = []
+
+    async def callback(event):
+        received.append((event.seq, event.resync, event.system_update_id))
+
+    async def resync_state():
+        return EventVariables({'system_update_id': '13'})
+
+    service = mock.Mock(service_type='ContentDirectory')
+    service.resync_state = resync_state
+    server.register_callback_for_service_id('uuid:sub-1', callback)
+    server.register_service_for_service_id('uuid:sub-1', service)
+    before = metrics.event_gaps.get('ContentDirectory')
+    notify(server, '0')
+    notify(server, '3')
+    server.loop.run_until_complete(asyncio.sleep(0.01))
+    assert received == [('0', False, 12), ('3', False, 12), (None, True, 13)]
+    assert metrics.event_gaps.get('ContentDirectory') == before + 1
+
+
+def test_sync_callbacks_run_on_threads(server):
+    threads = []
+
+    def callback(event):
+        threads.append((event.seq, threading.current_thread()))
+
+    server.register_callback_for_service_id('uuid:sub-1', callback)
+    server.register_service_for_service_id(
+        'uuid:sub-1', mock.Mock(service_type='ContentDirectory'))
+    for seq in ('0', '1', '2'):
+        notify(server, seq)
+    server.loop.run_until_complete(asyncio.sleep(0.05))
+    assert [seq for seq, _ in threads] == ['0', '1', '2']
+    assert threading.current_thread() not in [thread for _, thread in threads]
+
+
+def test_events_delivered_in_order(server):
+    received = []
+
+    async def slow(event):
+        # Later events must wait for this one
+        await asyncio.sleep(0.01 if event.seq == '0' else 0)
+        received.append(event.seq)
+
+    server.register_callback_for_service_id('uuid:sub-1', slow)
+    server.register_service_for_service_id(
+        'uuid:sub-1', mock.Mock(service_type='ContentDirectory'))
+    for seq in ('0', '1', '2'):
+        notify(server, seq)
+    server.loop.run_until_complete(asyncio.sleep(0.05))
+    assert received == ['0', '1', '2']
+
+
+def test_queue_drop_oldest(loop):
+    queue = EventQueue(2, OVERFLOW_DROP_OLDEST, 'AVTransport')
+    before = metrics.events_overflowed.get('AVTransport', 'drop_oldest')
+    for seq in range(4):
+        loop.run_until_complete(queue.put(SonosEvent({'seq': seq})))
+    assert len(queue) == 2
+    assert loop.run_until_complete(queue.get()).seq == 2
+    assert loop.run_until_complete(queue.get()).seq == 3
+    assert metrics.events_overflowed.get(
+        'AVTransport', 'drop_oldest') == before + 2
+
+
+def test_queue_coalesce(loop):
+    queue = EventQueue(1, OVERFLOW_COALESCE, 'RenderingControl')
+    first = parser.EventVariables({'volume': {'Master': '10'}, 'mute': '0'})
+    second = parser.EventVariables({'volume': {'Master': '20'}})
+    loop.run_until_complete(queue.put(SonosEvent(first)))
+    # Converted already, so the merge must replace the converted value
+    assert first['volume'] == {'Master': 10}
+    loop.run_until_complete(queue.put(SonosEvent(second)))
+    assert len(queue) == 1
+    event = loop.run_until_complete(queue.get())
+    assert event.volume == {'Master': 20}
+    assert event.mute is False
+
+
+def test_queue_block(loop):
+    queue = EventQueue(1, OVERFLOW_BLOCK)
+    loop.run_until_complete(queue.put(SonosEvent({'seq': 0})))
+    put = asyncio.ensure_future(queue.put(SonosEvent({'seq': 1})), loop=loop)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert not put.done()
+    assert loop.run_until_complete(queue.get()).seq == 0
+    loop.run_until_complete(put)
+    assert loop.run_until_complete(queue.get()).seq == 1
+
+
+def test_queue_size_from_config(server):
+    async def callback(event):
+        pass
+
+    server.register_callback_for_service_id('uuid:sub-1', callback)
+    server.register_service_for_service_id(
+        'uuid:sub-1', mock.Mock(service_type='ContentDirectory'))
+    with mock.patch.object(config, 'EVENT_QUEUE_SIZE', 7):
+        notify(server, '0')
+    assert server._queues['uuid:sub-1'].maxsize == 7
+    server.unregister_service_for_service_id('uuid:sub-1')
+    assert 'uuid:sub-1' not in server._queues
+
+
+def test_resubscribe_after_412_forgets_old_sid(server):
+    """ When a renewal fails with 412 Precondition Failed, the events of the
+    old subscription are no longer handled """
+    from soco.events import SonosSubscription
+    from soco.exceptions import SoCoPreconditionException
+    received = []
+
+    async def callback(event):
+        received.append(event.sid)
+
+    sids = iter(['uuid:old', 'uuid:new'])
+
+    async def request(method, headers):
+        if 'SID' in headers:
+            raise SoCoPreconditionException('Not subscribed')
+        return mock.Mock(headers={'sid': next(sids), 'timeout': None})
+
+    subscription = SonosSubscription(
+        server.loop, server, 'http://192.168.1.101:1400/Event', callback,
+        service=mock.Mock(service_type='AVTransport'))
+    with mock.patch.object(subscription, '_make_subscription_request',
+                           side_effect=request):
+        server.loop.run_until_complete(subscription.subscribe())
+        notify(server, 0, sid='uuid:old')
+        server.loop.run_until_complete(asyncio.sleep(0.05))
+        assert received == ['uuid:old']
+        server.loop.run_until_complete(subscription.renew())
+    assert subscription.sid == 'uuid:new'
+    assert 'uuid:old' not in server.sid_to_callback_mapping
+    assert 'uuid:old' not in server.sid_to_service_mapping
+    assert 'uuid:old' not in server.sid_to_last_seq
+    assert 'uuid:old' not in server._queues
+    assert 'uuid:old' not in server._deliveries
+    notify(server, 1, sid='uuid:old')
+    notify(server, 0, sid='uuid:new')
+    server.loop.run_until_complete(asyncio.sleep(0.1))
+    assert received == ['uuid:old', 'uuid:new']
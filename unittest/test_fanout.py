@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+""" Tests for the fanout module """
+
+from __future__ import unicode_literals
+
+from concurrent.futures import TimeoutError
+import threading
+import time
+
+import mock
+
+from soco.exceptions import SoCoUPnPException
+from soco.fanout import fan_out
+
+
+def make_zones(count):
+    return [mock.Mock(name='zone{0}'.format(i)) for i in range(count)]
+
+
+def test_fan_out_method_name():
+    zones = make_zones(3)
+    for number, zone in enumerate(zones):
+        zone.volume.return_value = number
+    results = fan_out(zones, 'volume')
+    assert set(results) == set(zones)
+    for number, zone in enumerate(zones):
+        assert results[zone].ok
+        assert results[zone].result == number
+
+
+def test_fan_out_service_action():
+    zones = make_zones(2)
+    fan_out(zones, 'renderingControl.SetVolume',
+            args=([('InstanceID', 0), ('DesiredVolume', 20)],))
+    for zone in zones:
+        zone.renderingControl.SetVolume.assert_called_once_with(
+            [('InstanceID', 0), ('DesiredVolume', 20)])
+
+
+def test_fan_out_partial_failure():
+    zones = make_zones(3)
+    error = SoCoUPnPException('failed', '701', '')
+    zones[1].pause.side_effect = error
+    results = fan_out(zones, 'pause')
+    assert results[zones[0]].ok and results[zones[2]].ok
+    assert not results[zones[1]].ok
+    assert results[zones[1]].exception is error
+    assert results[zones[1]].result is None
+
+
+def test_fan_out_is_concurrent_and_bounded():
+    zones = make_zones(6)
+    lock = threading.Lock()
+    running = [0, 0]  # current, maximum
+
+    def call(zone, delay):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(delay)
+        with lock:
+            running[0] -= 1
+        return zone
+
+    start = time.time()
+    results = fan_out(zones, call, args=(0.1,), max_workers=3)
+    assert time.time() - start < 0.5
+    assert running[1] == 3
+    assert all(results[zone].result is zone for zone in zones)
+
+
+def test_fan_out_timeout():
+    zones = make_zones(2)
+    finish = threading.Event()
+    zones[0].stop.side_effect = lambda: finish.wait(5)
+    results = fan_out(zones, 'stop', timeout=0.1)
+    finish.set()
+    assert results[zones[1]].ok
+    assert isinstance(results[zones[0]].exception, TimeoutError)
+
+
+def test_fan_out_no_zones():
+    assert fan_out([], 'play') == {}
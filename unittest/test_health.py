@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+""" Tests for the health module """
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+import requests
+
+from soco import config
+from soco.connection import SpeakerSession
+from soco.exceptions import SoCoCircuitOpenException, SoCoUPnPException
+from soco.health import SpeakerHealth, HEALTHY, DEGRADED, OPEN, HALF_OPEN
+
+
+def fail(health):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        with health.guard():
+            raise requests.exceptions.ConnectionError()
+
+
+def test_circuit_opens_after_consecutive_failures():
+    health = SpeakerHealth('192.168.1.201', failure_threshold=3,
+                           reset_timeout=30)
+    assert health.state == HEALTHY
+    fail(health)
+    assert health.state == DEGRADED
+    fail(health)
+    assert health.state == DEGRADED
+    fail(health)
+    assert health.state == OPEN
+    assert not health.available
+    with pytest.raises(SoCoCircuitOpenException) as error:
+        with health.guard():
+            pytest.fail('request should not be sent')
+    assert error.value.ip_address == '192.168.1.201'
+    assert 0 < error.value.retry_in <= 30
+
+
+def test_speaker_errors_count_as_success():
+    health = SpeakerHealth('192.168.1.201', failure_threshold=3)
+    fail(health)
+    with pytest.raises(SoCoUPnPException):
+        with health.guard():
+            raise SoCoUPnPException('message', 402, '')
+    assert health.state == HEALTHY
+    assert health.failures == 0
+
+
+def test_half_open_probe():
+    health = SpeakerHealth('192.168.1.201', failure_threshold=1,
+                           reset_timeout=10)
+    with mock.patch('soco.health.monotonic', return_value=100):
+        fail(health)
+        assert health.state == OPEN
+    with mock.patch('soco.health.monotonic', return_value=111):
+        assert health.state == HALF_OPEN
+        assert health.available
+        # A failed probe opens the circuit again
+        fail(health)
+        assert health.state == OPEN
+    with mock.patch('soco.health.monotonic', return_value=122):
+        with health.guard():
+            # While the probe is in flight, other requests fail fast
+            assert not health.available
+            with pytest.raises(SoCoCircuitOpenException):
+                health.before_call()
+        assert health.state == HEALTHY
+
+
+def test_deadline():
+    health = SpeakerHealth('192.168.1.201', failure_threshold=3)
+    assert health.deadline(None) == config.REQUEST_TIMEOUT
+    assert health.deadline(60) == 60
+    fail(health)
+    assert health.deadline(60) == config.DEGRADED_REQUEST_TIMEOUT
+    assert health.deadline(0.5) == 0.5
+
+
+def test_session_fails_fast_when_open():
+    session = SpeakerSession('192.168.1.201')
+    with mock.patch('requests.Session.request',
+                    side_effect=requests.exceptions.ConnectTimeout()
+                    ) as fake_request:
+        for _ in range(config.CIRCUIT_FAILURE_THRESHOLD):
+            with pytest.raises(requests.exceptions.ConnectTimeout):
+                session.get('http://192.168.1.201:1400/')
+        with pytest.raises(SoCoCircuitOpenException):
+            session.get('http://192.168.1.201:1400/')
+    assert fake_request.call_count == config.CIRCUIT_FAILURE_THRESHOLD
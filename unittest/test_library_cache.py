@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+""" Tests for the library_cache module """
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from soco import config
+from soco.core import SoCo
+from soco.library_cache import MusicLibraryCache
+
+RESPONSE = {
+    'Result': '<DIDL-Lite></DIDL-Lite>',
+    'NumberReturned': '0',
+    'TotalMatches': '0',
+    'UpdateID': '7',
+}
+METADATA = {'number_returned': 0, 'total_matches': 0, 'update_id': 7}
+
+
+@pytest.fixture()
+def speaker():
+    """ A mock speaker in household 'Sonos_1', whose library has
+    SystemUpdateID 12 """
+    mock_soco = mock.MagicMock()
+    mock_soco.ip_address = '192.168.1.201'
+    mock_soco.deviceProperties.GetHouseholdID.return_value = {
+        'CurrentHouseholdID': 'Sonos_1'}
+    mock_soco.contentDirectory.GetSystemUpdateID.return_value = {'Id': '12'}
+    return mock_soco
+
+
+def test_store_and_lookup(speaker):
+    library_cache = MusicLibraryCache(':memory:', check_interval=300)
+    assert library_cache.lookup(speaker, 'A:ARTIST', 0, 100) is None
+    library_cache.store(speaker, 'A:ARTIST', 0, 100, RESPONSE, METADATA)
+    assert library_cache.lookup(speaker, 'A:ARTIST', 0, 100) == (
+        RESPONSE, METADATA)
+    # Other pages are not cached
+    assert library_cache.lookup(speaker, 'A:ARTIST', 100, 100) is None
+    # The household and SystemUpdateID were only asked for once
+    assert speaker.deviceProperties.GetHouseholdID.call_count == 1
+    assert speaker.contentDirectory.GetSystemUpdateID.call_count == 1
+
+
+def test_pages_dropped_when_library_changes(speaker):
+    library_cache = MusicLibraryCache(':memory:', check_interval=0)
+    library_cache.store(speaker, 'A:ARTIST', 0, 100, RESPONSE, METADATA)
+    assert library_cache.lookup(speaker, 'A:ARTIST', 0, 100) is not None
+    speaker.contentDirectory.GetSystemUpdateID.return_value = {'Id': '13'}
+    assert library_cache.lookup(speaker, 'A:ARTIST', 0, 100) is None
+    speaker.contentDirectory.GetSystemUpdateID.return_value = {'Id': '12'}
+    assert library_cache.lookup(speaker, 'A:ARTIST', 0, 100) is None
+
+
+def test_update_from_event(speaker):
+    library_cache = MusicLibraryCache(':memory:', check_interval=300)
+    # Unknown households are ignored, rather than asked for
+    library_cache.update_from_event(speaker, '13')
+    assert speaker.deviceProperties.GetHouseholdID.call_count == 0
+    library_cache.store(speaker, 'A:ARTIST', 0, 100, RESPONSE, METADATA)
+    library_cache.update_from_event(speaker, '12')
+    assert library_cache.lookup(speaker, 'A:ARTIST', 0, 100) is not None
+    library_cache.update_from_event(speaker, '13')
+    assert library_cache.lookup(speaker, 'A:ARTIST', 0, 100) is None
+    assert speaker.contentDirectory.GetSystemUpdateID.call_count == 1
+
+
+def test_survives_restart(speaker, tmpdir):
+    path = str(tmpdir.join('library.sqlite'))
+    library_cache = MusicLibraryCache(path, check_interval=300)
+    library_cache.store(speaker, 'A:ARTIST', 0, 100, RESPONSE, METADATA)
+    library_cache.close()
+    speaker.reset_mock()
+    restarted = MusicLibraryCache(path, check_interval=300)
+    assert restarted.lookup(speaker, 'A:ARTIST', 0, 100) == (
+        RESPONSE, METADATA)
+    # No requests were needed
+    assert speaker.deviceProperties.GetHouseholdID.call_count == 0
+    assert speaker.contentDirectory.GetSystemUpdateID.call_count == 0
+
+
+def test_music_lib_search_uses_cache(speaker):
+    library_cache = MusicLibraryCache(':memory:', check_interval=300)
+    soco = SoCo('192.168.1.202')
+    soco.contentDirectory = mock.Mock()
+    soco.contentDirectory.Browse.return_value = RESPONSE
+    soco.contentDirectory.GetSystemUpdateID.return_value = {'Id': '12'}
+    soco.deviceProperties = speaker.deviceProperties
+    with mock.patch('soco.core.music_library_cache', library_cache), \
+            mock.patch.object(config, 'MUSIC_LIBRARY_CACHE_ENABLED', True):
+        first = soco._music_lib_search('A:ARTIST', 0, 100)
+        second = soco._music_lib_search('A:ARTIST', 0, 100)
+    assert first == second
+    assert soco.contentDirectory.Browse.call_count == 1
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+""" Tests for the metrics module """
+
+from __future__ import unicode_literals
+
+import pytest
+import requests
+
+from soco import metrics
+from soco.metrics import MetricsRegistry
+
+
+def test_counter_and_gauge():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_total', 'A counter', ('speaker',))
+    gauge = registry.gauge('test_gauge', 'A gauge')
+    counter.inc('192.168.1.201')
+    counter.inc('192.168.1.201', amount=2)
+    assert counter.get('192.168.1.201') == 3
+    assert counter.get('192.168.1.202') == 0
+    with pytest.raises(ValueError):
+        counter.inc('192.168.1.201', amount=-1)
+    with pytest.raises(ValueError):
+        counter.inc()
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.get() == 1
+    with pytest.raises(ValueError):
+        registry.counter('test_total', 'Again')
+
+
+def test_histogram_exposition():
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        'test_seconds', 'A "histogram"', ('action',), buckets=(0.1, 1))
+    histogram.observe(0.05, 'Play')
+    histogram.observe(0.5, 'Play')
+    histogram.observe(5, 'Play')
+    assert histogram.get('Play') == (3, 5.55)
+    assert registry.exposition() == '\n'.join([
+        '# HELP test_seconds A "histogram"',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{action="Play",le="0.1"} 1',
+        'test_seconds_bucket{action="Play",le="1"} 2',
+        'test_seconds_bucket{action="Play",le="+Inf"} 3',
+        'test_seconds_count{action="Play"} 3',
+        'test_seconds_sum{action="Play"} 5.55',
+        ''])
+    snapshot = registry.snapshot()
+    assert snapshot['test_seconds_count{action="Play"}'] == 3
+
+
+def test_track_request():
+    labels = ('192.168.1.201', 'AVTransport', 'Play')
+    count, _ = metrics.request_duration.get(*labels)
+    with pytest.raises(ValueError):
+        with metrics.track_request(*labels):
+            assert metrics.requests_in_flight.get(labels[0]) == 1
+            raise ValueError()
+    assert metrics.requests_in_flight.get(labels[0]) == 0
+    assert metrics.request_duration.get(*labels)[0] == count + 1
+    assert metrics.request_errors.get(*(labels + ('ValueError',))) == 1
+
+
+def test_http_server():
+    metrics.cache_hits.inc('192.168.1.201', 'AVTransport', 'GetMediaInfo')
+    server = metrics.start_http_server(0, '127.0.0.1')
+    try:
+        response = requests.get('http://127.0.0.1:{0}/metrics'.format(
+            server.server_address[1]), timeout=5)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    assert ('soco_cache_hits_total{speaker="192.168.1.201",'
+            'service="AVTransport",action="GetMediaInfo"}') in response.text
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+""" Tests for the mirror module """
+
+from __future__ import unicode_literals
+
+import asyncio
+
+import mock
+import pytest
+
+from soco import SoCo
+from soco.events import SonosEvent
+from soco.mirror import StateMirror
+from soco.parser import EventVariables
+
+IP_ADDR = '192.168.1.201'
+
+METADATA = (
+    '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" '
+    'xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" '
+    'xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+    '<item id="-1" parentID="-1" restricted="true">'
+    '<dc:title>Song</dc:title><dc:creator>Band</dc:creator>'
+    '<upnp:album>Album</upnp:album><upnp:class>object.item.audioItem'
+    '.musicTrack</upnp:class></item></DIDL-Lite>')
+
+
+@pytest.fixture()
+def loop():
+    """ A new event loop """
+    event_loop = asyncio.new_event_loop()
+    yield event_loop
+    event_loop.close()
+
+
+@pytest.fixture()
+def mirrored(loop):
+    """ A mirror of one speaker, whose subscriptions are mocks. Returns the
+    mirror, the speaker and a function which passes an event to the
+    callback for a service """
+    callbacks = {}
+
+    async def subscribe(service, callback, **kwargs):
+        callbacks[service.service_type] = callback
+        return mock.Mock(sid='uuid:{0}'.format(service.service_type))
+
+    async def unsubscribe(subscription):
+        pass
+
+    manager = mock.Mock(subscribe=mock.Mock(side_effect=subscribe),
+                        unsubscribe=mock.Mock(side_effect=unsubscribe))
+    mirror = StateMirror(loop, mock.Mock(), manager=manager)
+    speaker = SoCo(IP_ADDR)
+    loop.run_until_complete(mirror.add(speaker))
+
+    def send(service_type, variables):
+        """ Pass an event with `variables` to the mirror """
+        variables = EventVariables(dict(variables, sid='uuid:x', seq='1'))
+        loop.run_until_complete(
+            callbacks[service_type](SonosEvent(variables)))
+
+    return mirror, speaker, send
+
+
+def test_subscribes_to_services(mirrored):
+    mirror, _, _ = mirrored
+    assert sorted(call[0][0].service_type for call in
+                  mirror.manager.subscribe.call_args_list) == [
+        'AVTransport', 'ContentDirectory', 'RenderingControl',
+        'ZoneGroupTopology']
+    assert all(call[1]['auto_renew']
+               for call in mirror.manager.subscribe.call_args_list)
+
+
+def test_reads_without_requests(mirrored):
+    mirror, speaker, send = mirrored
+    assert mirror.volume(speaker) is None
+    send('RenderingControl', {
+        'volume': {'Master': '12', 'LF': '100'}, 'mute': {'Master': '0'}})
+    # Later events may report only some channels
+    send('RenderingControl', {'volume': {'Master': '15'}})
+    send('AVTransport', {
+        'transport_state': 'PLAYING', 'current_track': '3',
+        'current_track_duration': '0:03:00',
+        'current_track_uri': 'x-file-cifs://song.mp3',
+        'current_track_meta_data': METADATA})
+    send('ContentDirectory', {'container_update_i_ds': 'S:,3,Q:0,42'})
+    with mock.patch('soco.services.Service.send_command') as send_command:
+        assert mirror.volume(speaker) == 15
+        assert mirror.volume(speaker, 'LF') == 100
+        assert mirror.mute(speaker) is False
+        assert mirror.queue_update_id(speaker) == 42
+        assert mirror.get_current_transport_info(speaker)[
+            'current_transport_state'] == 'PLAYING'
+        track = mirror.get_current_track_info(speaker)
+        assert send_command.call_count == 0
+    assert (track['title'], track['artist'], track['album']) == (
+        'Song', 'Band', 'Album')
+    assert track['playlist_position'] == '3'
+    assert track['position'] == ''
+    assert mirror.snapshot(speaker)['rendering']['volume'] == {
+        'Master': 15, 'LF': 100}
+
+
+def test_listeners_see_changes(mirrored):
+    mirror, speaker, send = mirrored
+    changes = []
+    mirror.add_listener(lambda *args: changes.append(args))
+    send('RenderingControl', {'volume': {'Master': '12'}})
+    # Nothing changed
+    send('RenderingControl', {'volume': {'Master': '12'}})
+    send('RenderingControl', {'volume': {'Master': '13'}, 'resync': True})
+    assert changes == [
+        (speaker, 'rendering', {'volume': {'Master': '12'}}),
+        (speaker, 'rendering', {'volume': {'Master': '13'}}),
+    ]
+
+
+def test_queue_after_gap(mirrored):
+    mirror, speaker, send = mirrored
+    send('ContentDirectory', {'container_update_i_ds': 'Q:0,42'})
+    # The state fetched again after a gap includes the queue's update ID
+    send('ContentDirectory', {
+        'system_update_id': '7', 'queue_update_id': '45', 'resync': True})
+    assert mirror.queue_update_id(speaker) == 45
+    # If it does not, the update ID is not known, rather than stale
+    send('ContentDirectory', {'system_update_id': '7', 'resync': True})
+    assert mirror.queue_update_id(speaker) is None
+    send('ContentDirectory', {'container_update_i_ds': 'S:,3,Q:0,46'})
+    assert mirror.queue_update_id(speaker) == 46
+
+
+def test_group(mirrored):
+    mirror, speaker, send = mirrored
+    assert mirror.group(speaker) is None
+    send('ZoneGroupTopology', {'zone_group_state': '<ZoneGroups/>'})
+    group = mock.MagicMock()
+    group.__contains__.return_value = True
+
+    def update(zone_group_state):
+        # The state is parsed under the mirror's lock
+        assert mirror._lock.locked()
+        speaker._groups = [group]
+
+    with mock.patch.object(speaker, '_update_zone_group_state',
+                           side_effect=update) as update_zgs, \
+            mock.patch.object(speaker, '_groups', []):
+        assert mirror.group(speaker) is group
+        assert mirror.group(speaker) is group
+    assert update_zgs.call_count == 1
+
+
+def test_remove(mirrored, loop):
+    mirror, speaker, send = mirrored
+    loop.run_until_complete(mirror.remove(speaker))
+    assert mirror.manager.unsubscribe.call_count == 4
+    with pytest.raises(ValueError):
+        mirror.volume(speaker)
+    # Late events are ignored
+    send('RenderingControl', {'volume': {'Master': '12'}})
@@ -5,6 +5,7 @@ from soco import groups
 import unittest
 from unittest import mock
 from soco.xml import XML
+from xml.sax.saxutils import escape
 
 class ParserTestCase(unittest.TestCase):
 
@@ -15,6 +16,77 @@ class ParserTestCase(unittest.TestCase):
     ids = [z.uid for z in zone_groups]
     self.assertCountEqual(["RINCON_000XXXX1400:0", "RINCON_000XXX1400:46"], ids)
 
+  def test_parse_event_types_values(self):
+    variables = parser.parse_event(rendering_control_event_xml())
+    self.assertEqual(variables['volume'], {'Master': 36, 'LF': 100, 'RF': 100})
+    self.assertIs(variables['mute']['Master'], False)
+    self.assertEqual(variables['bass'], -2)
+    self.assertEqual(variables['preset_name_list'], 'FactoryDefaults')
+    self.assertEqual(variables.raw('bass'), '-2')
+
+  def test_parse_event_didl_is_lazy(self):
+    with mock.patch('soco.parser.from_didl_string') as from_didl:
+      variables = parser.parse_event(av_transport_event_xml())
+      self.assertEqual(variables['transport_state'], 'PLAYING')
+      self.assertEqual(variables['number_of_tracks'], 12)
+      self.assertFalse(from_didl.called)
+      variables['current_track_meta_data']
+      variables['current_track_meta_data']
+      self.assertEqual(from_didl.call_count, 1)
+
+  def test_parse_event_last_change_is_lazy(self):
+    with mock.patch('soco.parser.XML.fromstring',
+                    wraps=parser.XML.fromstring) as fromstring:
+      variables = parser.parse_event(rendering_control_event_xml())
+      # Only the propertyset has been parsed
+      self.assertEqual(fromstring.call_count, 1)
+      variables['sid'] = 'uuid:sub-1'
+      self.assertEqual(fromstring.call_count, 1)
+      self.assertEqual(variables['bass'], -2)
+      self.assertEqual(variables['sid'], 'uuid:sub-1')
+      self.assertEqual(variables['volume']['Master'], 36)
+      self.assertEqual(fromstring.call_count, 2)
+
+
+def _last_change_event(last_change):
+  """ An event whose only variable is a LastChange holding `last_change` """
+  return (
+      '<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+      '<e:property><LastChange>{0}</LastChange></e:property>'
+      '</e:propertyset>').format(escape(last_change)).encode('utf-8')
+
+
+def rendering_control_event_xml():
+  return _last_change_event(
+      '<Event xmlns="urn:schemas-upnp-org:metadata-1-0/RCS/">'
+      '<InstanceID val="0">'
+      '<Volume channel="Master" val="36"/>'
+      '<Volume channel="LF" val="100"/>'
+      '<Volume channel="RF" val="100"/>'
+      '<Mute channel="Master" val="0"/>'
+      '<Bass val="-2"/>'
+      '<PresetNameList>FactoryDefaults</PresetNameList>'
+      '</InstanceID></Event>')
+
+
+def av_transport_event_xml():
+  didl = (
+      '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" '
+      'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" '
+      'xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+      '<item id="-1" parentID="-1" restricted="true">'
+      '<dc:title>Track</dc:title>'
+      '<upnp:class>object.item.audioItem.musicTrack</upnp:class>'
+      '</item></DIDL-Lite>')
+  return _last_change_event(
+      '<Event xmlns="urn:schemas-upnp-org:metadata-1-0/AVT/">'
+      '<InstanceID val="0">'
+      '<TransportState val="PLAYING"/>'
+      '<NumberOfTracks val="12"/>'
+      '<CurrentTrackMetaData val="{0}"/>'
+      '</InstanceID></Event>'.format(escape(didl, {'"': '&quot;'})))
+
+
 def zone_group_xml():
   return """
     <ZoneGroups>
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+""" Tests for the scpd module """
+
+from __future__ import unicode_literals
+
+import asyncio
+import contextlib
+
+import mock
+import pytest
+
+from soco import SoCo
+from soco.scpd import (
+    ScpdRegistry, ServiceDescription, Action, Argument)
+from soco.services import Service
+
+DUMMY_SCPD = b"".join([
+    b'<?xml version="1.0"?>',
+    b'<scpd xmlns="urn:schemas-upnp-org:service-1-0">',
+    b'<actionList>',
+    b'<action><name>SetVolume</name><argumentList>',
+    b'<argument><name>InstanceID</name><direction>in</direction>',
+    b'<relatedStateVariable>A_ARG_TYPE_InstanceID</relatedStateVariable>',
+    b'</argument>',
+    b'<argument><name>Channel</name><direction>in</direction>',
+    b'<relatedStateVariable>A_ARG_TYPE_Channel</relatedStateVariable>',
+    b'</argument>',
+    b'<argument><name>DesiredVolume</name><direction>in</direction>',
+    b'<relatedStateVariable>Volume</relatedStateVariable>',
+    b'</argument>',
+    b'</argumentList></action>',
+    b'<action><name>GetVolume</name><argumentList>',
+    b'<argument><name>InstanceID</name><direction>in</direction>',
+    b'<relatedStateVariable>A_ARG_TYPE_InstanceID</relatedStateVariable>',
+    b'</argument>',
+    b'<argument><name>Channel</name><direction>in</direction>',
+    b'<relatedStateVariable>A_ARG_TYPE_Channel</relatedStateVariable>',
+    b'</argument>',
+    b'<argument><name>CurrentVolume</name><direction>out</direction>',
+    b'<relatedStateVariable>Volume</relatedStateVariable>',
+    b'</argument>',
+    b'</argumentList></action>',
+    b'<action><name>ResetBasicEQ</name></action>',
+    b'</actionList>',
+    b'<serviceStateTable>',
+    b'<stateVariable sendEvents="no"><name>A_ARG_TYPE_InstanceID</name>',
+    b'<dataType>ui4</dataType></stateVariable>',
+    b'<stateVariable sendEvents="no"><name>A_ARG_TYPE_Channel</name>',
+    b'<dataType>string</dataType></stateVariable>',
+    b'<stateVariable sendEvents="yes"><name>Volume</name>',
+    b'<dataType>ui2</dataType></stateVariable>',
+    b'</serviceStateTable>',
+    b'</scpd>'])
+
+
+@pytest.fixture()
+def service():
+    """ A Service for a mock speaker whose model and firmware are known """
+    mock_soco = mock.MagicMock()
+    mock_soco.ip_address = "192.168.1.201"
+    mock_soco.speaker_info = {
+        'model_number': 'S12', 'software_version': '29.3-87071'}
+    mock_soco.http_session.get.return_value.content = DUMMY_SCPD
+    return Service(mock_soco)
+
+
+def test_parse_description():
+    description = ServiceDescription.from_xml(DUMMY_SCPD)
+    assert list(description.actions) == [
+        'SetVolume', 'GetVolume', 'ResetBasicEQ']
+    assert description.actions['GetVolume'] == Action(
+        'GetVolume',
+        [Argument('InstanceID', 'ui4'), Argument('Channel', 'string')],
+        [Argument('CurrentVolume', 'ui2')])
+    assert description.actions['ResetBasicEQ'].in_args == []
+    assert description.event_vars() == [('Volume', 'ui2')]
+    copy = ServiceDescription.from_dict(description.to_dict())
+    assert copy.actions == description.actions
+    assert copy.state_variables == description.state_variables
+
+
+def test_normalize_arguments():
+    description = ServiceDescription.from_xml(DUMMY_SCPD)
+    args = [('InstanceID', 0), ('Channel', 'Master'), ('DesiredVolume', 5)]
+    assert description.normalize_arguments('SetVolume', args) == args
+    assert description.normalize_arguments(
+        'SetVolume', list(reversed(args))) == args
+    with pytest.raises(ValueError):
+        description.normalize_arguments('SetVolume', args[:2])
+    # Undeclared arguments are passed on, after the others
+    assert description.normalize_arguments(
+        'SetVolume', [('Foo', 1)] + list(reversed(args))) == args + [
+            ('Foo', 1)]
+    with pytest.raises(ValueError):
+        description.normalize_arguments('SetVolume', args + args[:1])
+    with pytest.raises(ValueError):
+        description.normalize_arguments('SetVolumes', args)
+
+
+def test_registry_fetches_once_and_persists(service, tmpdir):
+    registry = ScpdRegistry(cache_dir=str(tmpdir))
+    assert registry.lookup(service) is None
+    description = registry.get(service)
+    assert registry.get(service) is description
+    assert service.soco.http_session.get.call_count == 1
+    # A new registry, as in a later run, finds it on disk
+    service.soco.http_session.get.reset_mock()
+    registry = ScpdRegistry(cache_dir=str(tmpdir))
+    assert registry.lookup(service).actions == description.actions
+    assert not service.soco.http_session.get.called
+
+
+def test_registry_save_failure(service, tmpdir):
+    "No temporary file is left behind if a description cannot be saved"
+    registry = ScpdRegistry(cache_dir=str(tmpdir))
+    with mock.patch('os.replace', side_effect=OSError('Disk full')):
+        assert registry.get(service) is not None
+    assert not [path for path in tmpdir.visit() if path.check(file=1)]
+    # It is still held in memory
+    assert registry.lookup(service) is not None
+
+
+def test_registry_unknown_speaker(service, tmpdir):
+    registry = ScpdRegistry(cache_dir=str(tmpdir))
+    service.soco.speaker_info = {}
+    assert registry.lookup(service) is None
+    assert not service.soco.http_session.get.called
+
+
+def test_send_command_is_validated(service, tmpdir):
+    registry = ScpdRegistry(cache_dir=str(tmpdir))
+    registry.get(service)
+    with mock.patch('soco.services.scpd_registry', registry):
+        with pytest.raises(AttributeError):
+            service.SetVolumes
+        with mock.patch.object(service, '_post_command') as post:
+            service.SetVolume([('DesiredVolume', 5), ('InstanceID', 0),
+                               ('Channel', 'Master')])
+            post.assert_called_once_with(
+                'SetVolume',
+                [('InstanceID', 0), ('Channel', 'Master'),
+                 ('DesiredVolume', 5)],
+                mock.ANY, None)
+            with pytest.raises(ValueError):
+                service.SetVolume([('InstanceID', 0)])
+            assert post.call_count == 1
+
+
+def sonos_scpd(actions, state_variables):
+    """ Build an SCPD document from (name, [(argument, direction, related
+    state variable)]) tuples and (name, data type) tuples """
+    parts = [b'<?xml version="1.0"?>',
+             b'<scpd xmlns="urn:schemas-upnp-org:service-1-0">',
+             b'<specVersion><major>1</major><minor>0</minor></specVersion>',
+             b'<serviceStateTable>']
+    for name, vartype in state_variables:
+        parts.append(
+            '<stateVariable sendEvents="no"><name>{0}</name>'
+            '<dataType>{1}</dataType></stateVariable>'.format(
+                name, vartype).encode('utf-8'))
+    parts.append(b'</serviceStateTable><actionList>')
+    for name, arguments in actions:
+        parts.append('<action><name>{0}</name><argumentList>'.format(
+            name).encode('utf-8'))
+        for argument, direction, related in arguments:
+            parts.append(
+                '<argument><name>{0}</name><direction>{1}</direction>'
+                '<relatedStateVariable>{2}</relatedStateVariable>'
+                '</argument>'.format(argument, direction, related).encode(
+                    'utf-8'))
+        parts.append(b'</argumentList></action>')
+    parts.append(b'</actionList></scpd>')
+    return b''.join(parts)
+
+
+INSTANCE = ('InstanceID', 'in', 'A_ARG_TYPE_InstanceID')
+CHANNEL = ('Channel', 'in', 'A_ARG_TYPE_Channel')
+
+# The actions used by SoCo, as declared by a Sonos speaker (S12, firmware
+# 29.3), at /xml/AVTransport1.xml and /xml/RenderingControl1.xml
+AV_TRANSPORT_SCPD = sonos_scpd([
+    ('Play', [INSTANCE, ('Speed', 'in', 'TransportPlaySpeed')]),
+    ('Pause', [INSTANCE]),
+    ('Stop', [INSTANCE]),
+    ('Next', [INSTANCE]),
+    ('Previous', [INSTANCE]),
+    ('GetTransportInfo', [
+        INSTANCE,
+        ('CurrentTransportState', 'out', 'TransportState'),
+        ('CurrentTransportStatus', 'out', 'TransportStatus'),
+        ('CurrentSpeed', 'out', 'TransportPlaySpeed')]),
+    ('GetPositionInfo', [
+        INSTANCE,
+        ('Track', 'out', 'CurrentTrack'),
+        ('TrackDuration', 'out', 'CurrentTrackDuration'),
+        ('TrackMetaData', 'out', 'CurrentTrackMetaData'),
+        ('TrackURI', 'out', 'CurrentTrackURI'),
+        ('RelTime', 'out', 'A_ARG_TYPE_GetPositionInfoRelTime'),
+        ('AbsTime', 'out', 'A_ARG_TYPE_GetPositionInfoAbsTime'),
+        ('RelCount', 'out', 'A_ARG_TYPE_GetPositionInfoRelCount'),
+        ('AbsCount', 'out', 'A_ARG_TYPE_GetPositionInfoAbsCount')]),
+], [
+    ('A_ARG_TYPE_InstanceID', 'ui4'), ('TransportPlaySpeed', 'string'),
+    ('TransportState', 'string'), ('TransportStatus', 'string'),
+    ('CurrentTrack', 'ui4'), ('CurrentTrackDuration', 'string'),
+    ('CurrentTrackMetaData', 'string'), ('CurrentTrackURI', 'string'),
+    ('A_ARG_TYPE_GetPositionInfoRelTime', 'string'),
+    ('A_ARG_TYPE_GetPositionInfoAbsTime', 'string'),
+    ('A_ARG_TYPE_GetPositionInfoRelCount', 'i4'),
+    ('A_ARG_TYPE_GetPositionInfoAbsCount', 'i4'),
+])
+
+RENDERING_CONTROL_SCPD = sonos_scpd([
+    ('GetVolume', [INSTANCE, CHANNEL, ('CurrentVolume', 'out', 'Volume')]),
+    ('SetVolume', [INSTANCE, CHANNEL,
+                   ('DesiredVolume', 'in', 'Volume')]),
+    ('GetMute', [INSTANCE, CHANNEL, ('CurrentMute', 'out', 'Mute')]),
+    ('SetMute', [INSTANCE, CHANNEL, ('DesiredMute', 'in', 'Mute')]),
+    ('GetBass', [INSTANCE, ('CurrentBass', 'out', 'Bass')]),
+    ('SetBass', [INSTANCE, ('DesiredBass', 'in', 'Bass')]),
+    ('GetTreble', [INSTANCE, ('CurrentTreble', 'out', 'Treble')]),
+    ('SetTreble', [INSTANCE, ('DesiredTreble', 'in', 'Treble')]),
+    ('GetLoudness', [INSTANCE, CHANNEL,
+                     ('CurrentLoudness', 'out', 'Loudness')]),
+    ('SetLoudness', [INSTANCE, CHANNEL,
+                     ('DesiredLoudness', 'in', 'Loudness')]),
+], [
+    ('A_ARG_TYPE_InstanceID', 'ui4'), ('A_ARG_TYPE_Channel', 'string'),
+    ('Volume', 'ui2'), ('Mute', 'boolean'), ('Bass', 'i2'),
+    ('Treble', 'i2'), ('Loudness', 'boolean'),
+])
+
+RESULTS = {
+    'CurrentVolume': '10', 'CurrentMute': '0', 'CurrentBass': '2',
+    'CurrentTreble': '-1', 'CurrentLoudness': '1',
+    'CurrentTransportState': 'PLAYING', 'CurrentTransportStatus': 'OK',
+    'CurrentSpeed': '1', 'Track': '1', 'TrackDuration': '0:03:00',
+    'TrackURI': '', 'TrackMetaData': '', 'RelTime': '0:00:10',
+}
+
+
+def test_core_calls_pass_sonos_scpd():
+    speaker = SoCo('192.168.1.203')
+    descriptions = {
+        'AVTransport': ServiceDescription.from_xml(AV_TRANSPORT_SCPD),
+        'RenderingControl': ServiceDescription.from_xml(
+            RENDERING_CONTROL_SCPD),
+    }
+    registry = ScpdRegistry(cache_dir='')
+    sent = []
+
+    def post(action, args, cache, cache_timeout):
+        sent.append((action, args))
+        return RESULTS
+
+    with mock.patch.object(registry, 'lookup', side_effect=lambda service:
+                           descriptions.get(service.service_type)), \
+            mock.patch('soco.services.scpd_registry', registry), \
+            mock.patch.object(speaker.avTransport, '_post_command',
+                              side_effect=post), \
+            mock.patch.object(speaker.renderingControl, '_post_command',
+                              side_effect=post):
+        speaker.play()
+        speaker.pause()
+        speaker.stop()
+        speaker.next()
+        speaker.previous()
+        assert speaker.get_current_transport_info()[
+            'current_transport_state'] == 'PLAYING'
+        assert speaker.get_current_track_info()['position'] == '0:00:10'
+        assert speaker.volume() == 10
+        speaker.set_volume(12)
+        assert speaker.mute() is False
+        speaker.set_mute(True)
+        assert speaker.bass() == 2
+        speaker.set_bass(3)
+        assert speaker.treble() == -1
+        speaker.set_treble(0)
+        assert speaker.loudness() is True
+        speaker.set_loudness(False)
+    speaker.renderingControl.cache.clear()
+    speaker.avTransport.cache.clear()
+    # Declared arguments first, then any others SoCo sends
+    assert ('GetBass', [('InstanceID', 0), ('Channel', 'Master')]) in sent
+    assert ('Pause', [('InstanceID', 0), ('Speed', 1)]) in sent
+    assert ('GetPositionInfo', [('InstanceID', 0),
+                                ('Channel', 'Master')]) in sent
+
+
+@contextlib.contextmanager
+def unknown_service(ip_address, sent):
+    """ Yield the RenderingControl service of a speaker whose model,
+    firmware and service descriptions are not yet known, and the mock http
+    session from which they are fetched. Commands are appended to `sent`
+    rather than sent. """
+    speaker = SoCo(ip_address)
+    rendering = speaker.renderingControl
+
+    def get_speaker_info():
+        speaker.speaker_info.update(
+            model_number='S12', software_version='57.3-77280')
+
+    def post(action, args, cache, cache_timeout):
+        sent.append((action, args))
+        return RESULTS
+
+    with mock.patch('soco.services.scpd_registry',
+                    ScpdRegistry(cache_dir='')), \
+            mock.patch.object(speaker, 'speaker_info', {}), \
+            mock.patch.object(speaker, 'get_speaker_info',
+                              side_effect=get_speaker_info), \
+            mock.patch.object(speaker, 'http_session') as session, \
+            mock.patch.object(rendering, '_post_command', side_effect=post), \
+            mock.patch.object(rendering, '_scpd_fetched', False):
+        session.get.return_value.content = RENDERING_CONTROL_SCPD
+        yield rendering, session
+
+
+def test_first_command_fetches_description():
+    "Commands are validated without the description being known first"
+    sent = []
+    with unknown_service('192.168.1.204', sent) as (rendering, session):
+        with pytest.raises(ValueError):
+            rendering.send_command('Frobnicate')
+        rendering.SetVolume([
+            ('DesiredVolume', 5), ('Channel', 'Master'), ('InstanceID', 0)])
+        with pytest.raises(ValueError):
+            rendering.SetVolume([('InstanceID', 0)])
+        # Fetched once, on the first command
+        assert session.get.call_count == 1
+    assert sent == [('SetVolume', [('InstanceID', 0), ('Channel', 'Master'),
+                                   ('DesiredVolume', 5)])]
+
+
+def test_first_async_command_fetches_description():
+    "Commands sent without blocking are validated in the same way"
+    loop = asyncio.new_event_loop()
+    try:
+        with unknown_service('192.168.1.204', []) as (rendering, session):
+            with pytest.raises(ValueError):
+                loop.run_until_complete(
+                    rendering.async_send_command('Frobnicate'))
+            assert session.get.call_count == 1
+    finally:
+        loop.close()
@@ -6,8 +6,14 @@
 
 from __future__ import unicode_literals
 
+import contextlib
+import threading
+
 import pytest
-from soco.services import Service
+import soco.services
+from soco.services import (
+    Service, SingleFlight, RenderingControl, AVTransport, ZoneGroupTopology,
+    ContentDirectory, zone_group_state_shared_cache)
 from soco.exceptions import SoCoUPnPException
 
 try:
@@ -76,6 +82,30 @@ def service():
     return Service(mock_soco)
 
 
+@pytest.fixture()
+def speaker():
+    """ A mock speaker with real RenderingControl, AVTransport,
+    ZoneGroupTopology and ContentDirectory services, for use as a test
+    fixture """
+
+    mock_soco = mock.MagicMock()
+    mock_soco.ip_address = "192.168.1.201"
+    mock_soco.renderingControl = RenderingControl(mock_soco)
+    mock_soco.avTransport = AVTransport(mock_soco)
+    mock_soco.zoneGroupTopology = ZoneGroupTopology(mock_soco)
+    mock_soco.contentDirectory = ContentDirectory(mock_soco)
+    return mock_soco
+
+
+def _response(content):
+    """ A mock requests response with status 200 and `content` """
+    response = mock.MagicMock()
+    response.headers = {}
+    response.status_code = 200
+    response.content = content.encode('utf-8')
+    return response
+
+
 def test_init_defaults(service):
     """ Check default properties are set up correctly """
     assert service.service_type == "Service"
@@ -136,6 +166,30 @@ def test_unwrap(service):
         "Unicode": "μИⅠℂ☺ΔЄ💋"}
 
 
+def test_unwrap_bytes(service):
+    """ unwrapping args from the raw bytes of a response """
+    assert service.unwrap_arguments(DUMMY_VALID_RESPONSE.encode('utf-8')) == {
+        "CurrentLEDState": "On",
+        "Unicode": "μИⅠℂ☺ΔЄ💋"}
+    # Escaped XML (eg DIDL metadata) is unescaped, and only the children of
+    # the first element in the body are returned
+    response = "".join([
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">',
+        '<s:Header><Ignored>1</Ignored></s:Header>',
+        '<s:Body>',
+        '<u:BrowseResponse xmlns:u="urn:schemas-upnp-org:service:CD:1">',
+        '<Result>&lt;DIDL-Lite&gt;&amp;amp;&lt;/DIDL-Lite&gt;</Result>',
+        '<NumberReturned>0</NumberReturned><Empty/>',
+        '</u:BrowseResponse>',
+        '<Other><Ignored>2</Ignored></Other>',
+        '</s:Body>',
+        '</s:Envelope>'])
+    assert service.unwrap_arguments(response.encode('utf-8')) == {
+        "Result": "<DIDL-Lite>&amp;</DIDL-Lite>",
+        "NumberReturned": "0",
+        "Empty": ""}
+
+
 def test_build_command(service):
     """ Test creation of SOAP body and headers from a command """
     headers, body = service.build_command('SetAVTransportURI', [
@@ -151,14 +205,41 @@ def test_build_command(service):
         'urn:schemas-upnp-org:service:Service:1#SetAVTransportURI'}
 
 
+def test_build_request(service):
+    """ Requests are rendered as bytes from a cached, compiled template """
+    args = [
+        ('InstanceID', 0),
+        ('CurrentURI', 'URI'),
+        ('CurrentURIMetaData', ''),
+        ('Unicode', 'μИⅠℂ☺ΔЄ💋')
+        ]
+    headers, body = service.build_request('SetAVTransportURI', args)
+    assert body == DUMMY_VALID_ACTION.encode('utf-8')
+    assert headers['SOAPACTION'] == \
+        'urn:schemas-upnp-org:service:Service:1#SetAVTransportURI'
+    # The same template is used for the same action and argument names
+    headers2, body2 = service.build_request('SetAVTransportURI', [
+        (name, 'x&y') for name, _ in args])
+    assert headers2 is headers
+    assert b'<CurrentURI>x&amp;y</CurrentURI>' in body2
+    # but not for different argument names
+    headers3, body3 = service.build_request('SetAVTransportURI', args[:1])
+    assert b'<CurrentURI>' not in body3
+    _, body4 = service.build_request('Play')
+    assert b'<u:Play xmlns:u="urn:schemas-upnp-org:service:Service:1">' \
+        b'</u:Play>' in body4
+
+
 def test_send_command(service):
     """ Calling a command should result in a http request, unless the cache
     is hit """
     response = mock.MagicMock()
     response.headers = {}
     response.status_code = 200
-    response.text = DUMMY_VALID_RESPONSE
-    with mock.patch('requests.post', return_value=response) as fake_post:
+    response.content = DUMMY_VALID_RESPONSE.encode('utf-8')
+    response.elapsed.total_seconds.return_value = 0.1
+    with mock.patch.object(service.soco.http_session, 'post',
+                           return_value=response) as fake_post:
         result = service.send_command('SetAVTransportURI', [
             ('InstanceID', 0),
             ('CurrentURI', 'URI'),
@@ -168,7 +249,8 @@ def test_send_command(service):
         assert result == {'CurrentLEDState': 'On', 'Unicode': "μИⅠℂ☺ΔЄ💋"}
         fake_post.assert_called_once_with(
             'http://192.168.1.101:1400/Service/Control',
-            headers=mock.ANY, data=DUMMY_VALID_ACTION.encode('utf-8'))
+            headers=mock.ANY, data=DUMMY_VALID_ACTION.encode('utf-8'),
+            timeout=mock.ANY)
         # Now the cache should be primed, so try it again
         fake_post.reset_mock()
         result = service.send_command('SetAVTransportURI', [
@@ -200,6 +282,127 @@ def test_send_command(service):
             ])
         assert fake_post.called
 
+
+@contextlib.contextmanager
+def followers_waiting(count):
+    """ Yield an event which is set once `count` callers are waiting for
+    calls in flight """
+    all_waiting = threading.Event()
+    waiters = []
+    make_flight = soco.services._Flight
+
+    def flight():
+        result = make_flight()
+        wait = result.done.wait
+
+        def counted_wait(*args):
+            waiters.append(1)
+            if len(waiters) == count:
+                all_waiting.set()
+            return wait(*args)
+        result.done.wait = counted_wait
+        return result
+
+    with mock.patch('soco.services._Flight', side_effect=flight):
+        yield all_waiting
+
+
+def test_send_command_coalesces_reads(service):
+    """ Identical read commands sent concurrently should share one request """
+    response = _response(DUMMY_VALID_RESPONSE)
+    release = threading.Event()
+
+    def slow_post(*args, **kwargs):
+        release.wait(5)
+        return response
+
+    results = []
+
+    def get_led_state():
+        results.append(service.send_command('GetLEDState', cache_timeout=0))
+
+    with mock.patch.object(service.soco.http_session, 'post',
+                           side_effect=slow_post) as fake_post, \
+            followers_waiting(4) as all_waiting:
+        threads = [threading.Thread(target=get_led_state) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        assert all_waiting.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        assert fake_post.call_count == 1
+        assert len(results) == 5
+        assert all(result == results[0] for result in results)
+
+
+def test_send_paths_share_preparation(service):
+    """ send_command and async_send_command check arguments and the cache
+    in the same way """
+    import asyncio
+    args = [('InstanceID', 0)]
+    cached = {'CurrentLEDState': 'On'}
+    with mock.patch.object(
+            service, '_prepare_command',
+            return_value=(args, service.cache, 0, cached)) as prepare:
+        assert service.send_command('GetLEDState', args) is cached
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(service.async_send_command(
+                'GetLEDState', args)) is cached
+        finally:
+            loop.close()
+    assert prepare.call_args_list == [
+        mock.call('GetLEDState', args, None, None)] * 2
+
+
+def test_is_coalescable():
+    """ Only actions which read state may be coalesced """
+    assert Service.is_coalescable('GetZoneGroupState')
+    assert Service.is_coalescable('Browse')
+    assert not Service.is_coalescable('SetVolume')
+    assert not Service.is_coalescable('Play')
+
+
+def test_single_flight_shares_exceptions():
+    """ Callers waiting on a call which fails should see the same error """
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise ValueError('boom')
+
+    errors = []
+
+    def call():
+        try:
+            flight.call('key', fail)
+        except ValueError as error:
+            errors.append(error)
+
+    with followers_waiting(3) as all_waiting:
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=call) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        assert all_waiting.wait(5)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+    assert len(calls) == 1
+    assert len(errors) == 4
+    assert all(error is errors[0] for error in errors)
+    # Once the call has finished, the next one goes ahead again
+    assert flight.call('key', lambda: 42) == 42
+
+
 def test_handle_upnp_error(service):
     """ Check errors are extracted properly """
     with pytest.raises(SoCoUPnPException) as E:
@@ -211,3 +414,159 @@ def test_handle_upnp_error(service):
     # TODO: Try this with a None Error Code
 
 # TODO: test iter_actions
+
+
+def test_content_directory_resync_includes_queue(speaker):
+    """ The state fetched after lost ContentDirectory events includes the
+    update ID of the queue """
+    import asyncio
+    directory = speaker.contentDirectory
+    results = {'GetSystemUpdateID': {'Id': '7'},
+               'Browse': {'Result': '', 'NumberReturned': '1',
+                          'TotalMatches': '1', 'UpdateID': '45'}}
+
+    async def send(action, args):
+        return results[action]
+
+    loop = asyncio.new_event_loop()
+    try:
+        with mock.patch.object(directory, 'async_send_command',
+                               side_effect=send) as async_send_command:
+            variables = loop.run_until_complete(directory.resync_state())
+    finally:
+        loop.close()
+    assert variables.raw('queue_update_id') == '45'
+    assert variables.raw('system_update_id') == '7'
+    assert dict(async_send_command.call_args_list[1][0][1])[
+        'ObjectID'] == 'Q:0'
+
+
+def test_rendering_control_event_primes_cache(speaker):
+    """ A RenderingControl event stores the values it reports as the
+    results of the corresponding getters """
+    service = speaker.renderingControl
+    service.update_cache_from_event({
+        'volume': {'Master': '36', 'LF': '100', 'RF': '100'},
+        'bass': '2', 'sid': 'uuid:RINCON_1', 'seq': '3'})
+    with mock.patch.object(service.soco.http_session, 'post') as fake_post:
+        assert service.GetVolume([
+            ('InstanceID', 0), ('Channel', 'Master')]) == {
+                'CurrentVolume': '36'}
+        assert service.GetVolume([
+            ('InstanceID', 0), ('Channel', 'LF')]) == {
+                'CurrentVolume': '100'}
+        assert service.GetBass([
+            ('InstanceID', 0), ('Channel', 'Master')]) == {
+                'CurrentBass': '2'}
+    assert not fake_post.called
+
+
+def test_av_transport_event_invalidates_cache(speaker):
+    """ An AVTransport event drops the cached results of the getters whose
+    values it changes """
+    service = speaker.avTransport
+    service.cache.put({'CurrentTransportState': 'PLAYING'},
+                      'GetTransportInfo', [('InstanceID', 0)], timeout=60)
+    service.cache.put({'CurrentURI': 'x'}, 'GetMediaInfo',
+                      [('InstanceID', 0)], timeout=60)
+    service.update_cache_from_event({'transport_state': 'STOPPED'})
+    assert service.cache.get('GetTransportInfo', [('InstanceID', 0)]) is None
+    assert service.cache.get('GetMediaInfo', [('InstanceID', 0)]) is None
+
+
+def test_topology_event_primes_shared_cache(speaker):
+    """ A ZoneGroupTopology event stores the zone group state in the cache
+    shared by all speakers """
+    service = speaker.zoneGroupTopology
+    try:
+        service.update_cache_from_event({'zone_group_state': '<ZGS/>'})
+        with mock.patch.object(service.soco.http_session, 'post') as post:
+            assert service.GetZoneGroupState(cache_timeout=5) == {
+                'ZoneGroupState': '<ZGS/>'}
+        assert not post.called
+    finally:
+        zone_group_state_shared_cache.clear()
+
+
+def test_cache_policy_ttl_and_invalidation(speaker):
+    """ A cache policy supplies the timeout of an action, and the actions,
+    on any service of the speaker, which invalidate its results """
+    policies = {
+        ('RenderingControl', 'GetLEDState'): {
+            'ttl': 60,
+            'invalidated_by': [('AVTransport', 'SetAVTransportURI')]},
+    }
+    with mock.patch('soco.config.CACHE_POLICIES', policies), \
+            mock.patch.object(speaker.http_session, 'post',
+                              return_value=_response(DUMMY_VALID_RESPONSE)
+                              ) as fake_post:
+        speaker.renderingControl.send_command('GetLEDState')
+        speaker.renderingControl.send_command('GetLEDState')
+        assert fake_post.call_count == 1
+        # A successful call to an invalidating action, on another service
+        speaker.avTransport.send_command('SetAVTransportURI')
+        speaker.renderingControl.send_command('GetLEDState')
+        assert fake_post.call_count == 3
+
+
+def test_cache_policy_not_cacheable(service):
+    """ The results of an action whose policy forbids caching are never
+    cached """
+    policies = {('Service', 'GetLEDState'): {'cacheable': False}}
+    with mock.patch('soco.config.CACHE_POLICIES', policies), \
+            mock.patch.object(service.soco.http_session, 'post',
+                              return_value=_response(DUMMY_VALID_RESPONSE)
+                              ) as fake_post:
+        service.send_command('GetLEDState', cache_timeout=60)
+        service.send_command('GetLEDState', cache_timeout=60)
+        assert fake_post.call_count == 2
+
+
+DUMMY_EMPTY_RESPONSE = "".join([
+    '<?xml version="1.0"?>',
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"',
+        ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">',
+        '<s:Body>',
+            '<u:SetVolumeResponse ',
+                'xmlns:u="urn:schemas-upnp-org:service:RenderingControl:1">',
+            '</u:SetVolumeResponse>',
+        '</s:Body>',
+    '</s:Envelope>'])  # noqa PEP8
+
+
+def test_setter_writes_through(speaker):
+    """ A successful setter stores the value it set as the result of the
+    getter, provisionally until an event confirms it """
+    service = speaker.renderingControl
+    master = [('InstanceID', 0), ('Channel', 'Master')]
+    with mock.patch.object(speaker.http_session, 'post',
+                           return_value=_response(DUMMY_EMPTY_RESPONSE)
+                           ) as fake_post:
+        service.SetVolume(master + [('DesiredVolume', 30)])
+        assert service.GetVolume(master) == {'CurrentVolume': '30'}
+    assert fake_post.call_count == 1
+    assert service.is_provisional('GetVolume', master)
+    # An event confirms it
+    service.update_cache_from_event({'volume': {'Master': '29'}})
+    assert not service.is_provisional('GetVolume', master)
+    assert service.cache.get('GetVolume', master) == {'CurrentVolume': '29'}
+
+
+def test_setter_write_through_merges(speaker):
+    """ A setter whose getter returns several values updates only the one
+    it set, or without write through, invalidates the cached result """
+    service = speaker.avTransport
+    args = [('InstanceID', 0)]
+    service.cache.put({'PlayMode': 'NORMAL', 'RecQualityMode': 'x'},
+                      'GetTransportSettings', args, timeout=10)
+    with mock.patch.object(speaker.http_session, 'post',
+                           return_value=_response(DUMMY_EMPTY_RESPONSE)):
+        service.SetPlayMode(args + [('NewPlayMode', 'SHUFFLE')])
+    assert service.cache.get('GetTransportSettings', args) == {
+        'PlayMode': 'SHUFFLE', 'RecQualityMode': 'x'}
+    with mock.patch('soco.config.WRITE_THROUGH_ENABLED', False), \
+            mock.patch.object(speaker.http_session, 'post',
+                              return_value=_response(DUMMY_EMPTY_RESPONSE)):
+        service.SetPlayMode(args + [('NewPlayMode', 'NORMAL')])
+    # Without write through, the cached result is invalidated instead
+    assert service.cache.get('GetTransportSettings', args) is None
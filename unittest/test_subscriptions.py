@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+""" Tests for the subscriptions module """
+
+from __future__ import unicode_literals
+
+import asyncio
+
+import aiohttp.web
+import mock
+
+from soco import SoCo, config
+from soco.subscriptions import SubscriptionManager, TimerWheel
+
+IP_ADDR = '192.168.1.201'
+
+
+async def serve(handler):
+    """ Start a local web server which answers every request with `handler`.
+    Return the runner and the base url """
+    app = aiohttp.web.Application()
+    app.router.add_route('*', '/{tail:.*}', handler)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    site = aiohttp.web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://127.0.0.1:{0}'.format(port)
+
+
+def test_subscriptions_share_session():
+    seen = []
+
+    async def handler(request):
+        seen.append((request.method, request.headers.get('SID'),
+                     request.transport.get_extra_info('peername')))
+        return aiohttp.web.Response(headers={
+            'SID': 'uuid:sub-{0}'.format(len(seen)),
+            'TIMEOUT': 'Second-3600'})
+
+    async def callback(event):
+        pass
+
+    async def main():
+        runner, url = await serve(handler)
+        speaker = SoCo(IP_ADDR)
+        services = [speaker.renderingControl, speaker.avTransport]
+        event_server = mock.Mock(listen_host='127.0.0.1', listen_port=1400)
+        try:
+            for service in services:
+                service.base_url = url
+            manager = SubscriptionManager(loop, event_server)
+            async with manager:
+                # One after the other, so that the connection can be reused
+                for service in services:
+                    await manager.subscribe(service, callback)
+                session = manager.session
+                assert [subscription.session for subscription in
+                        manager.subscriptions] == [session, session]
+            assert session.closed
+            assert manager.subscriptions == []
+        finally:
+            for service in services:
+                service.base_url = 'http://{0}:1400'.format(IP_ADDR)
+            await runner.cleanup()
+        return event_server
+
+    loop = asyncio.new_event_loop()
+    try:
+        event_server = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert sorted((method, sid) for method, sid, _ in seen) == [
+        ('SUBSCRIBE', None), ('SUBSCRIBE', None),
+        ('UNSUBSCRIBE', 'uuid:sub-1'), ('UNSUBSCRIBE', 'uuid:sub-2')]
+    # The keep-alive connection was reused
+    assert seen[0][2] == seen[1][2]
+    assert event_server.unregister_service_for_service_id.call_count == 2
+
+
+def test_subscribe_all_reports_failures():
+    subscription = mock.Mock()
+
+    async def subscribe(*args, **kwargs):
+        return subscription
+
+    async def refuse(*args, **kwargs):
+        raise ValueError('refused')
+
+    async def unsubscribe():
+        pass
+
+    subscription.unsubscribe = unsubscribe
+    good = mock.Mock()
+    good.subscribe.side_effect = subscribe
+    bad = mock.Mock(service_type='AVTransport')
+    bad.subscribe.side_effect = refuse
+
+    async def main():
+        manager = SubscriptionManager(loop, mock.Mock())
+        results = await manager.subscribe_all([good, bad], None)
+        assert manager.subscriptions == [subscription]
+        await manager.close()
+        return results
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert results[0] is subscription
+    assert isinstance(results[1], ValueError)
+    assert good.subscribe.call_args[1]['session'] is not None
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(1.0, slots=8)
+    assert wheel.advance(100.0) == []
+    wheel.schedule('b', 102.5)
+    wheel.schedule('a', 102.2)
+    # More than a turn of the wheel ahead, in the same slot as 'a'
+    wheel.schedule('c', 110.7)
+    wheel.schedule('d', 104.0)
+    wheel.cancel('d')
+    assert len(wheel) == 3
+    assert wheel.advance(101.0) == []
+    assert wheel.advance(102.9) == ['a', 'b']
+    assert 'c' in wheel
+    assert wheel.advance(109.0) == []
+    # Jumping more than a turn still finds everything due
+    assert wheel.advance(130.0) == ['c']
+    assert len(wheel) == 0
+    # Scheduling in the past makes the item due at the next advance
+    wheel.schedule('e', 50.0)
+    assert wheel.advance(130.5) == []
+    assert wheel.advance(131.0) == ['e']
+
+
+class FakeSubscription(object):
+
+    """ A subscription whose renewals take a little while, and are counted,
+    along with the number in progress at once """
+
+    running = 0
+    most_running = 0
+
+    def __init__(self, number, fail=False):
+        self.sid = 'uuid:sub-{0}'.format(number)
+        self.service = mock.Mock(service_type='AVTransport')
+        self.service.soco.ip_address = '192.168.1.{0}'.format(number)
+        self.timeout = 1
+        self.fail = fail
+        self.renewed = 0
+
+    async def renew(self, auto_renew=False):
+        FakeSubscription.running += 1
+        FakeSubscription.most_running = max(
+            FakeSubscription.most_running, FakeSubscription.running)
+        await asyncio.sleep(0.05)
+        FakeSubscription.running -= 1
+        if self.fail:
+            raise ValueError('gone')
+        self.renewed += 1
+        # Not due again during the test
+        self.timeout = 100
+
+    async def unsubscribe(self):
+        pass
+
+
+def fake_service(subscription):
+    """ A service whose subscribe method returns `subscription` """
+    async def subscribe(*args, **kwargs):
+        return subscription
+
+    return mock.Mock(subscribe=mock.Mock(side_effect=subscribe))
+
+
+def test_renewals_jittered_batched_and_healthy():
+    subscriptions = [FakeSubscription(number, fail=number == 9)
+                     for number in range(10)]
+
+    async def main():
+        manager = SubscriptionManager(loop, mock.Mock())
+        await manager.subscribe_all(
+            [fake_service(subscription) for subscription in subscriptions],
+            None, auto_renew=True)
+        # The renewals are not all due at the same time
+        times = set(when for slot in manager._wheel._slots
+                    for when in slot.values())
+        assert len(times) == 10
+        await asyncio.sleep(0.5)
+        health = dict((entry.sid, entry) for entry in manager.health())
+        await manager.close()
+        return health
+
+    loop = asyncio.new_event_loop()
+    try:
+        with mock.patch.multiple(config, SUBSCRIPTION_WHEEL_TICK=0.01,
+                                 SUBSCRIPTION_RENEWAL_FRACTION=0.05,
+                                 SUBSCRIPTION_RENEWAL_JITTER=0.02,
+                                 SUBSCRIPTION_RENEWAL_CONCURRENCY=3,
+                                 SUBSCRIPTION_RETRY_INTERVAL=10):
+            health = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert FakeSubscription.most_running == 3
+    assert all(subscription.renewed for subscription in subscriptions[:9])
+    assert health['uuid:sub-0'].state == 'ok'
+    assert health['uuid:sub-0'].speaker == '192.168.1.0'
+    assert health['uuid:sub-0'].renewals == 1
+    assert health['uuid:sub-0'].expires_in > 99
+    assert health['uuid:sub-9'].state == 'retrying'
+    assert health['uuid:sub-9'].failures == 1
+    assert isinstance(health['uuid:sub-9'].last_error, ValueError)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+""" Tests for the trace module """
+
+from __future__ import unicode_literals
+
+import io
+
+import mock
+import pytest
+import requests
+
+from soco import config, trace
+from soco.connection import SpeakerSession
+
+URL = 'http://192.168.1.201:1400/MediaRenderer/AVTransport/Control'
+
+
+@pytest.fixture()
+def tracing():
+    """ Enable wire tracing for the duration of a test """
+    trace.tracer.clear()
+    with mock.patch.object(config, 'WIRE_TRACE_ENABLED', True):
+        yield trace.tracer
+    trace.tracer.clear()
+
+
+def test_nothing_recorded_when_disabled():
+    trace.tracer.clear()
+    session = SpeakerSession('192.168.1.201')
+    with mock.patch('requests.Session.request'):
+        session.post(URL, data=b'<Play/>')
+    assert trace.records('192.168.1.201') == []
+
+
+def test_exchange_recorded(tracing):
+    session = SpeakerSession('192.168.1.201')
+    response = mock.Mock(status_code=200, headers={'Server': 'Sonos'},
+                         content='<PlayResponse/>'.encode('utf-8'))
+    with mock.patch('requests.Session.request', return_value=response):
+        session.post(URL, headers={'SOAPACTION': 'Play'}, data=b'<Play/>')
+    record, = trace.records('192.168.1.201')
+    assert record.method == 'POST'
+    assert record.url == URL
+    assert record.request_headers == {'SOAPACTION': 'Play'}
+    assert record.request_body == b'<Play/>'
+    assert record.status == 200
+    assert record.response_body == b'<PlayResponse/>'
+    assert record.error is None
+    output = io.StringIO()
+    trace.dump('192.168.1.201', output)
+    assert 'POST {0} -> 200'.format(URL) in output.getvalue()
+    assert '> SOAPACTION: Play' in output.getvalue()
+
+
+def test_error_recorded(tracing):
+    session = SpeakerSession('192.168.1.201')
+    with mock.patch('requests.Session.request',
+                    side_effect=requests.exceptions.ReadTimeout()):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            session.get(URL)
+    record, = trace.records('192.168.1.201')
+    assert record.status is None
+    assert isinstance(record.error, requests.exceptions.ReadTimeout)
+    session.health.reset()
+
+
+def test_buffer_is_bounded():
+    tracer = trace.WireTracer(size=3)
+    for index in range(5):
+        tracer.record(trace.TraceRecord(
+            index, '192.168.1.201', 'GET', URL, {}, None, 200, {}, b'',
+            0.01, None))
+    assert [record.timestamp for record in tracer.records()] == [2, 3, 4]